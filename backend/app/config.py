@@ -20,15 +20,158 @@ class LLMConfig:
     ollama_model: str = "qwen2.5:7b"
     max_tokens: int = 2048
     temperature: float = 0.3
+    report_direct_rows: int = 40   # 聚合分组不超过该数时单次调用生成报告
+    report_chunk_rows: int = 30    # map 阶段每块的分组行数
+    report_max_chunks: int = 8     # map 阶段最多块数
+    report_concurrency: int = 4    # map 阶段并发调用数
+    report_workers: int = 2        # 后台报告任务的工作协程数
+    report_queue_size: int = 32    # 排队中的报告任务上限
+    report_job_ttl: float = 3600.0 # 已结束任务在内存中的保留时长（秒）
+    fallback_enabled: bool = True  # 主提供方不可用时转向另一提供方（openai <-> ollama）
+    request_deadline: float = 60.0 # 单次调用的总时限（含重试与故障转移，秒）
+    connect_timeout: float = 5.0   # 建立连接超时（秒）
+    max_retries: int = 2           # 单个提供方的重试次数（连接错误/超时/429/5xx）
+    retry_backoff: float = 0.5     # 退避基数（秒），实际等待为 [0, 基数*2^n] 内随机
+    retry_backoff_max: float = 8.0 # 单次退避上限（秒）
+    max_concurrency: int = 8       # 每个提供方的并发请求上限
+    queue_timeout: float = 10.0    # 等待并发槽位的时长，超时后转向备用提供方（秒）
+    pool_connections: int = 16     # 每个提供方的连接池上限
+    pool_keepalive: int = 8        # 保持的空闲 keep-alive 连接数
+    keepalive_expiry: float = 60.0 # 空闲连接保留时长（秒）
+    breaker_failures: int = 5      # 连续失败达到该次数时熔断
+    breaker_cooldown: float = 30.0 # 熔断持续时长，之后放行一次试探请求（秒）
 
 
 @dataclass
 class DetectorConfig:
     rule_enabled: bool = True
     ml_enabled: bool = True
+    sequence_enabled: bool = True
+    sequence_min_prob: float = 0.001      # 低于该转移概率的CAN ID序列判为异常
+    payload_profile_enabled: bool = True
+    payload_min_samples: int = 20         # 建立单个ID负载画像所需最少帧数
+    payload_flip_tolerance: float = 0.4   # 比特翻转率与画像的最大允许偏差
     frequency_threshold: float = 3.0
     iforest_contamination: float = 0.05
     anomaly_window_size: int = 100
+    retrain_window: int = 5000            # 基线特征滑动窗口大小
+    retrain_min_samples: int = 500        # 重训练所需最少窗口样本
+    drift_threshold: float = 0.5          # 特征均值标准化偏移阈值
+    retrain_check_interval: float = 30.0  # 后台漂移检查间隔（秒）
+    novelty_window: float = 3600.0        # 同一未知CAN ID的告警间隔窗口（秒）
+    novelty_extended_slots: int = 16384   # 29 位扩展帧ID的哈希槽位数
+    novelty_max_alerts: int = 32          # 单批逐条告警的新未知ID上限，其余合并为一条
+    someip_enabled: bool = True
+    someip_rate_window: float = 1.0       # SOME/IP 流速率计数窗口（秒）
+    someip_rate_limit: int = 100          # 单个流在窗口内允许的最大帧数
+    someip_flow_slots: int = 4096         # 流速率计数的哈希槽位数（定长内存）
+    someip_response_timeout: float = 2.0  # 请求超过该秒数未应答判为异常
+    someip_max_pending: int = 8192        # 待应答请求上限，超出时丢弃最早的请求
+    v2x_enabled: bool = True
+    v2x_max_speed_kmh: float = 250.0      # 位置跳变判定的最大车速
+    v2x_position_tolerance: float = 5.0   # 定位误差容限（米）
+    v2x_speed_tolerance_kmh: float = 20.0 # 位移折合速度与上报速度的最大偏差
+    v2x_heading_tolerance: float = 45.0   # 位移方向与上报航向的最大偏差（度）
+    v2x_consistency_max_gap: float = 5.0  # 速度/航向一致性只比较该间隔（秒）内的相邻上报
+    v2x_sender_ttl: float = 10.0          # 发送者超过该秒数未上报即移出网格索引
+    v2x_max_senders: int = 4096           # 同时跟踪的发送者上限
+    v2x_sybil_radius: float = 3.0         # Sybil 聚集半径（米），同时为网格边长
+    v2x_sybil_min_senders: int = 4        # 半径内同时出现的身份数达到该值判为 Sybil
+    v2x_sybil_window: float = 2.0         # 视为“同时出现”的上报时间差（秒）
+
+
+@dataclass
+class FleetConfig:
+    max_cached_vehicles: int = 64        # 内存中保留检测器状态的车辆数上限
+    state_dir: str = "./detector_state"  # 被换出车辆的检测器状态目录
+    shard_workers: int = 0               # 检测工作进程数，0 表示在API进程内检测
+
+
+@dataclass
+class IngestConfig:
+    shm_enabled: bool = False                 # 启用共享内存环形缓冲区分发报文
+    shm_name: str = "gatewayguard_ring"       # 共享内存段名称
+    shm_capacity: int = 65536                 # 环形缓冲区槽位数（定长记录）
+    detector_workers: int = 2                 # 独立检测进程数
+    poll_interval: float = 0.05               # 检测进程空闲轮询间隔（秒）
+    read_batch: int = 4096                    # 检测进程单次读取的最大记录数
+    state_dir: str = "./detector_state/ring"  # 检测进程的车辆检测器状态目录（与 fleet.state_dir 分开）
+
+
+@dataclass
+class SchedulerConfig:
+    enabled: bool = True          # 启用后台持续检测
+    interval: float = 5.0         # 检测间隔（秒）
+    packet_threshold: int = 1000  # 新报文数达到该值时立即检测
+    min_batch: int = 200          # 自适应块大小下限
+    max_batch: int = 2000         # 自适应块大小上限
+    max_chunks: int = 20          # 单轮最多处理的块数
+    lease_ttl: float = 60.0       # 检测游标租约时长（秒），持有进程退出后到期即可被其他进程接管
+
+
+@dataclass
+class ArchiveConfig:
+    enabled: bool = False          # 启用冷归档后台任务
+    archive_dir: str = "./archive" # 归档块文件目录
+    max_age: float = 3600.0        # 报文超过该时长（秒）后移出 packets 表
+    interval: float = 300.0        # 归档任务间隔（秒）
+    block_rows: int = 65536        # 单个块文件的最大帧数
+    max_blocks_per_run: int = 16   # 单轮最多写入的块数
+    compression_level: int = 3     # zstd 压缩级别
+
+
+@dataclass
+class ChatConfig:
+    context_ttl: float = 1800.0       # 会话上下文在内存中的保留时长（秒）
+    max_sessions: int = 256           # 内存中缓存的会话数上限
+    history_token_budget: int = 1500  # 发送给模型的历史消息 Token 上限
+    summary_token_budget: int = 300   # 滚动摘要的 Token 上限
+    min_recent_turns: int = 2         # 折叠时至少保留的最近消息数
+    max_tool_rounds: int = 4          # 单条消息内服务端执行工具的最大轮数
+
+
+@dataclass
+class RollupConfig:
+    second_retention: int = 86400    # 1 秒桶保留时长（秒），0 表示不清理
+    minute_retention: int = 2592000  # 1 分钟桶保留时长（秒）
+    hour_retention: int = 0          # 1 小时桶保留时长（秒）
+    max_buckets: int = 5000          # 聚合查询单次返回的桶数上限
+
+
+@dataclass
+class LiveConfig:
+    max_fps: float = 4.0             # /ws/live 推送帧率上限
+    max_alerts_per_frame: int = 50   # 单帧携带的新告警上限（计数不受限）
+    recent_packets: int = 20         # 单帧携带的最近报文数
+    send_timeout: float = 5.0        # 单帧发送超时，超时断开慢连接（秒）
+
+
+@dataclass
+class CacheConfig:
+    enabled: bool = True     # 启用读接口响应缓存
+    ttl: float = 30.0        # 缓存项最长保留时长（秒），兜底其他进程直接写库
+    max_entries: int = 512   # 缓存项数上限（LRU 淘汰）
+    api_workers: int = 1     # API 进程数（uvicorn --workers），大于 1 时缓存自动关闭
+
+
+@dataclass
+class DatabaseConfig:
+    pool_size: int = 10                   # 连接池常驻连接数（PostgreSQL）
+    max_overflow: int = 20                # 高峰时可额外创建的连接数
+    pool_timeout: float = 30.0            # 等待空闲连接的超时（秒）
+    pool_recycle: int = 1800              # 连接最长复用时长（秒）
+    copy_min_rows: int = 500              # 报文行数达到该值时改用 COPY 批量导入
+    timescale: bool = False               # packets 表转为 TimescaleDB 超表
+    chunk_rows: int = 5_000_000           # 超表按报文ID分块，每块的ID跨度
+    compress_after_rows: int = 20_000_000 # 落后最新报文ID超过该值的块自动压缩
+
+
+@dataclass
+class WriterConfig:
+    enabled: bool = True            # 报文与告警经写后队列组提交
+    flush_interval_ms: float = 10.0 # 一组提交的最长收集时间（毫秒）
+    max_batch_rows: int = 20000     # 累计行数达到该值时提前提交
+    queue_size: int = 1024          # 队列中待提交的任务数上限（满时提交方等待）
 
 
 @dataclass
@@ -40,6 +183,16 @@ class AppConfig:
     cors_origins: list = field(default_factory=lambda: ["http://localhost:5173"])
     llm: LLMConfig = field(default_factory=LLMConfig)
     detector: DetectorConfig = field(default_factory=DetectorConfig)
+    fleet: FleetConfig = field(default_factory=FleetConfig)
+    ingest: IngestConfig = field(default_factory=IngestConfig)
+    scheduler: SchedulerConfig = field(default_factory=SchedulerConfig)
+    archive: ArchiveConfig = field(default_factory=ArchiveConfig)
+    chat: ChatConfig = field(default_factory=ChatConfig)
+    rollup: RollupConfig = field(default_factory=RollupConfig)
+    live: LiveConfig = field(default_factory=LiveConfig)
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    database: DatabaseConfig = field(default_factory=DatabaseConfig)
+    writer: WriterConfig = field(default_factory=WriterConfig)
 
 
 def _load_yaml() -> dict:
@@ -71,6 +224,36 @@ def load_config() -> AppConfig:
     detector_data = data.get("detector", {})
     _apply_section(config.detector, detector_data)
 
+    fleet_data = data.get("fleet", {})
+    _apply_section(config.fleet, fleet_data)
+
+    ingest_data = data.get("ingest", {})
+    _apply_section(config.ingest, ingest_data)
+
+    scheduler_data = data.get("scheduler", {})
+    _apply_section(config.scheduler, scheduler_data)
+
+    archive_data = data.get("archive", {})
+    _apply_section(config.archive, archive_data)
+
+    chat_data = data.get("chat", {})
+    _apply_section(config.chat, chat_data)
+
+    rollup_data = data.get("rollup", {})
+    _apply_section(config.rollup, rollup_data)
+
+    live_data = data.get("live", {})
+    _apply_section(config.live, live_data)
+
+    cache_data = data.get("cache", {})
+    _apply_section(config.cache, cache_data)
+
+    database_data = data.get("database", {})
+    _apply_section(config.database, database_data)
+
+    writer_data = data.get("writer", {})
+    _apply_section(config.writer, writer_data)
+
     # --- 环境变量层：优先级最高，覆盖 YAML ---
     if env_key := os.getenv("OPENAI_API_KEY"):
         config.llm.openai_api_key = env_key
@@ -78,6 +261,8 @@ def load_config() -> AppConfig:
         config.llm.provider = env_provider
     if env_ollama := os.getenv("OLLAMA_URL"):
         config.llm.ollama_base_url = env_ollama
+    if env_db := os.getenv("DATABASE_URL"):
+        config.db_url = env_db
 
     return config
 
@@ -1,22 +1,132 @@
-"""GatewayGuard 数据库初始化"""
+"""GatewayGuard 数据库初始化
 
+默认使用 SQLite；db_url 为 postgresql+asyncpg 时按 database 配置调整连接池，
+可选将 packets 表转为 TimescaleDB 超表并开启压缩。
+启动时校验库中记录的表结构版本，旧版本创建的库文件拒绝启动，避免按新结构读写旧表。
+"""
+
+from sqlalchemy import Column, Integer, Table, inspect, select, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 
 from app.config import settings
 
 
-engine = create_async_engine(settings.db_url, echo=settings.debug)
+def _engine_options() -> dict:
+    cfg = settings.database
+    if make_url(settings.db_url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": cfg.pool_size,
+        "max_overflow": cfg.max_overflow,
+        "pool_timeout": cfg.pool_timeout,
+        "pool_recycle": cfg.pool_recycle,
+        "pool_pre_ping": True,
+    }
+
+
+engine = create_async_engine(settings.db_url, echo=settings.debug, **_engine_options())
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+IS_POSTGRES = engine.dialect.name == "postgresql"
+
 
 class Base(DeclarativeBase):
     pass
 
 
+# 表结构版本：任一表增删列或改变编码方式时递增
+SCHEMA_VERSION = 2
+
+schema_version = Table(
+    "schema_version", Base.metadata,
+    Column("version", Integer, primary_key=True),
+)
+
+
+class SchemaMismatchError(RuntimeError):
+    """库中的表结构与当前版本不一致"""
+
+
+def _check_columns(conn) -> None:
+    """已存在的表须包含模型定义的全部列（create_all 不会修改已有表）"""
+    insp = inspect(conn)
+    existing = set(insp.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        columns = {c["name"] for c in insp.get_columns(table.name)}
+        missing = [c.name for c in table.columns if c.name not in columns]
+        if missing:
+            raise SchemaMismatchError(
+                f"数据表 {table.name} 缺少列 {', '.join(missing)}，"
+                "数据库由旧版本创建，请备份后删除或迁移"
+            )
+
+
+async def _check_version(conn) -> None:
+    """首次启动写入当前版本；已记录的版本与当前不一致时拒绝启动"""
+    version = await conn.scalar(select(schema_version.c.version))
+    if version is None:
+        await conn.execute(schema_version.insert().values(version=SCHEMA_VERSION))
+    elif version != SCHEMA_VERSION:
+        raise SchemaMismatchError(
+            f"数据库表结构版本为 {version}，当前版本为 {SCHEMA_VERSION}，请备份后删除或迁移"
+        )
+
+
+async def _setup_timescale(conn) -> None:
+    """packets 表按报文ID分块为超表，较旧的块按车辆分段压缩
+
+    报文时间戳为浮点数，不能作为超表时间维度；报文ID单调递增，
+    以其为整数时间维度，分块与压缩策略均以ID跨度计。
+    """
+    cfg = settings.database
+    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
+    await conn.execute(text(
+        "SELECT create_hypertable('packets', 'id', chunk_time_interval => CAST(:rows AS BIGINT),"
+        " if_not_exists => TRUE, migrate_data => TRUE)"
+    ), {"rows": cfg.chunk_rows})
+    await conn.execute(text(
+        "CREATE OR REPLACE FUNCTION packets_max_id() RETURNS BIGINT"
+        " LANGUAGE SQL STABLE AS $$ SELECT COALESCE(MAX(id), 0) FROM packets $$"
+    ))
+    await conn.execute(text(
+        "SELECT set_integer_now_func('packets', 'packets_max_id', replace_if_exists => TRUE)"
+    ))
+    compressed = await conn.scalar(text(
+        "SELECT compression_enabled FROM timescaledb_information.hypertables"
+        " WHERE hypertable_name = 'packets'"
+    ))
+    if not compressed:
+        await conn.execute(text(
+            "ALTER TABLE packets SET (timescaledb.compress,"
+            " timescaledb.compress_segmentby = 'vehicle_code',"
+            " timescaledb.compress_orderby = 'id')"
+        ))
+    await conn.execute(text(
+        "SELECT add_compression_policy('packets', compress_after => CAST(:rows AS BIGINT),"
+        " if_not_exists => TRUE)"
+    ), {"rows": cfg.compress_after_rows})
+
+
 async def init_db():
     async with engine.begin() as conn:
+        await conn.run_sync(_check_columns)
         await conn.run_sync(Base.metadata.create_all)
+        await _check_version(conn)
+        if IS_POSTGRES and settings.database.timescale:
+            await _setup_timescale(conn)
+
+
+def database_stats() -> dict:
+    return {
+        "dialect": engine.dialect.name,
+        "schema_version": SCHEMA_VERSION,
+        "timescale": IS_POSTGRES and settings.database.timescale,
+        "pool": engine.pool.status(),
+    }
 
 
 async def get_db():
@@ -1,5 +1,6 @@
 """GatewayGuard - FastAPI 主入口"""
 
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
@@ -7,13 +8,33 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import settings
 from app.database import init_db
-from app.routers import traffic, anomaly, llm, system
+from app.routers import traffic, anomaly, llm, system, ws
+from app.services.archive import packet_archive
+from app.services.live_hub import live_hub
+from app.services.write_behind import write_behind
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    write_behind.start()
+    tasks = [asyncio.create_task(
+        anomaly.detector_pool.maintenance_loop(settings.detector.retrain_check_interval)
+    )]
+    if anomaly.detection_scheduler.enabled:
+        tasks.append(asyncio.create_task(anomaly.detection_scheduler.run_forever()))
+    if settings.archive.enabled:
+        tasks.append(asyncio.create_task(packet_archive.run_forever()))
+    llm.report_jobs.start()
+    live_hub.start()
     yield
+    for task in tasks:
+        task.cancel()
+    await write_behind.stop()
+    await llm.report_jobs.stop()
+    await live_hub.stop()
+    await llm.llm.close()
+    anomaly.detector_pool.shutdown()
 
 
 app = FastAPI(
@@ -35,6 +56,7 @@ app.include_router(traffic.router)
 app.include_router(anomaly.router)
 app.include_router(llm.router)
 app.include_router(system.router)
+app.include_router(ws.router)
 
 
 @app.get("/")
@@ -6,6 +6,7 @@ from typing import Optional, List
 from pydantic import BaseModel
 from sqlalchemy import Column, Integer, String, Float, Text, DateTime
 from app.database import Base
+from app.models.packet import PacketId
 
 
 # ---- SQLAlchemy ORM ----
@@ -14,6 +15,7 @@ class AnomalyEventORM(Base):
     __tablename__ = "anomaly_events"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
+    vehicle_id = Column(String(64), index=True)
     timestamp = Column(Float, nullable=False, index=True)
     anomaly_type = Column(String(64), nullable=False)
     severity = Column(String(16), nullable=False)
@@ -28,6 +30,21 @@ class AnomalyEventORM(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class DetectionCursorORM(Base):
+    """检测高水位游标：记录已检测到的最大报文ID
+
+    lease_owner / lease_until 为跨进程的检测租约，多个 API 进程中同一时刻只有持有者推进游标。
+    """
+    __tablename__ = "detection_cursors"
+
+    name = Column(String(32), primary_key=True)
+    last_packet_id = Column(PacketId, nullable=False, default=0)
+    last_timestamp = Column(Float)
+    lease_owner = Column(String(64))
+    lease_until = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 # ---- Pydantic Schema ----
 
 class AnomalyEvent(BaseModel):
@@ -41,10 +58,12 @@ class AnomalyEvent(BaseModel):
     description: str = ""
     detection_method: str = ""
     raw_packets: list = []
+    vehicle_id: str = ""
 
 
 class AnomalyEventResponse(BaseModel):
     id: int
+    vehicle_id: Optional[str] = None
     timestamp: float
     anomaly_type: str
     severity: str
@@ -1,29 +1,88 @@
 """流量数据模型"""
 
-from datetime import datetime
 from typing import Optional
 
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, Float, LargeBinary, Text, DateTime
+from sqlalchemy import (
+    BigInteger, Column, Integer, SmallInteger, String, Float, LargeBinary, Text, Index,
+    UniqueConstraint,
+)
 from app.database import Base
 
+# 未指定车辆时使用的车辆ID（单车部署）
+DEFAULT_VEHICLE_ID = "default"
+
+# 报文ID：PostgreSQL 上为 BIGINT；SQLite 的自增主键必须声明为 INTEGER
+PacketId = BigInteger().with_variant(Integer(), "sqlite")
+
 
 # ---- SQLAlchemy ORM 模型 ----
 
 class PacketORM(Base):
+    """紧凑报文表
+
+    重复字符串以 string_dict 中的小整数编码存储；元数据按画像去重；
+    可由负载重新推导的解码结果不落库（读取时惰性解码），
+    仅无法推导的解码内容（如V2X运动学字段）存入 payload_extra。
+    """
     __tablename__ = "packets"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(PacketId, primary_key=True, autoincrement=True)
     timestamp = Column(Float, nullable=False, index=True)
-    protocol = Column(String(16), nullable=False, index=True)
-    source = Column(String(64))
-    destination = Column(String(64))
-    msg_id = Column(String(32))
+    vehicle_code = Column(Integer, nullable=False)
+    protocol_code = Column(SmallInteger, nullable=False)
+    source_code = Column(Integer)
+    destination_code = Column(Integer)
+    msg_code = Column(Integer)
+    domain_code = Column(SmallInteger)
     payload = Column(LargeBinary)
-    payload_decoded = Column(Text)
-    domain = Column(String(32))
-    metadata_json = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    payload_extra = Column(Text)
+    profile_id = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_packets_vehicle_ts", "vehicle_code", "timestamp"),
+        # 报文ID单调递增且不复用，检测游标依赖该性质
+        {"sqlite_autoincrement": True},
+    )
+
+
+class StringDictORM(Base):
+    """报文重复字符串字典（协议、节点、报文ID、功能域、车辆ID）"""
+    __tablename__ = "string_dict"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(16), nullable=False)
+    value = Column(String(64), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("kind", "value", name="uq_string_dict_kind_value"),
+    )
+
+
+class MetadataProfileORM(Base):
+    """去重后的报文元数据画像"""
+    __tablename__ = "metadata_profiles"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    digest = Column(String(40), nullable=False, unique=True)
+    metadata_json = Column(Text, nullable=False)
+
+
+class ArchiveBlockORM(Base):
+    """冷归档块索引：每个块文件一行"""
+    __tablename__ = "archive_blocks"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    path = Column(String(255), nullable=False)
+    ts_min = Column(Float, nullable=False, index=True)
+    ts_max = Column(Float, nullable=False, index=True)
+    id_min = Column(PacketId, nullable=False)
+    id_max = Column(PacketId, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    codec = Column(String(8), nullable=False)
+    counts_json = Column(Text, nullable=False)     # {车辆编码: {协议编码: 帧数}}
+    msg_codes_json = Column(Text, nullable=False)  # 块内出现的报文ID编码
 
 
 # ---- Pydantic Schema ----
@@ -38,10 +97,12 @@ class UnifiedPacket(BaseModel):
     payload_decoded: dict = {}
     domain: str = ""       # powertrain / chassis / body / infotainment
     metadata: dict = {}
+    vehicle_id: str = DEFAULT_VEHICLE_ID
 
 
 class PacketResponse(BaseModel):
     id: int
+    vehicle_id: str = DEFAULT_VEHICLE_ID
     timestamp: float
     protocol: str
     source: str
@@ -49,7 +110,6 @@ class PacketResponse(BaseModel):
     msg_id: str
     payload_decoded: Optional[dict] = None
     domain: Optional[str] = None
-    created_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -32,3 +32,13 @@ class ChatHistoryORM(Base):
     content = Column(Text, nullable=False)
     tool_calls = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ChatSessionORM(Base):
+    """会话滚动摘要：summarized_upto 之前的消息已折叠进 summary"""
+    __tablename__ = "chat_sessions"
+
+    session_id = Column(String(64), primary_key=True)
+    summary = Column(Text, nullable=False, default="")
+    summarized_upto = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
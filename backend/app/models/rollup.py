@@ -0,0 +1,20 @@
+"""多分辨率时间桶汇总模型"""
+
+from sqlalchemy import BigInteger, Column, Integer, String
+
+from app.database import Base
+
+
+class RollupBucketORM(Base):
+    """时间桶计数：每 (桶宽, 维度, 桶起点, 取值, 车辆) 一行，入库时累加
+
+    取值与车辆均为 string_dict 编码；桶起点为按桶宽对齐的 Unix 秒。
+    """
+    __tablename__ = "rollup_buckets"
+
+    resolution = Column(Integer, primary_key=True)    # 桶宽（秒）：1 / 60 / 3600
+    dimension = Column(String(16), primary_key=True)  # protocol / msg_id / source / severity
+    bucket = Column(BigInteger, primary_key=True)
+    key_code = Column(Integer, primary_key=True)
+    vehicle_code = Column(Integer, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
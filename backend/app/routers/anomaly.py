@@ -1,33 +1,46 @@
 """异常检测相关API路由"""
 
 import json
-import time
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Request
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import settings
 from app.database import get_db
 from app.models.anomaly import AnomalyEventORM, AnomalyEventResponse, AnomalyEventList
-from app.models.packet import PacketORM, UnifiedPacket
-from app.services.anomaly_detector import AnomalyDetectorService
+from app.services.detection_pipeline import run_detection
+from app.services.detection_scheduler import DetectionScheduler
+from app.services.response_cache import GEN_EVENTS, response_cache
+from app.services.vehicle_registry import ShardedDetectorPool
 
 router = APIRouter(prefix="/api/anomaly", tags=["anomaly"])
 
-# 全局检测器实例
-detector = AnomalyDetectorService()
+# 全局检测器池：按车辆隔离检测状态
+detector_pool = ShardedDetectorPool.from_settings()
+# 后台持续检测调度器（由 lifespan 启动）
+detection_scheduler = DetectionScheduler(detector_pool)
 
 
 @router.get("/events")
 async def get_anomaly_events(
+    request: Request,
     severity: str = Query(None),
     status: str = Query(None),
+    vehicle_id: str = Query(None),
     limit: int = Query(50, le=200),
     offset: int = 0,
     db: AsyncSession = Depends(get_db),
 ):
     """查询异常事件列表"""
+    generations = response_cache.snapshot(GEN_EVENTS)
+    cached = response_cache.lookup(request, generations)
+    if cached is not None:
+        return cached
+
     stmt = select(AnomalyEventORM).order_by(AnomalyEventORM.timestamp.desc())
+    if vehicle_id:
+        stmt = stmt.where(AnomalyEventORM.vehicle_id == vehicle_id)
     if severity:
         stmt = stmt.where(AnomalyEventORM.severity == severity)
     if status:
@@ -40,11 +53,12 @@ async def get_anomaly_events(
     result = await db.execute(stmt)
     rows = result.scalars().all()
 
-    return {
+    return response_cache.store(request, generations, {
         "total": total or 0,
         "events": [
             {
                 "id": r.id,
+                "vehicle_id": r.vehicle_id,
                 "timestamp": r.timestamp,
                 "anomaly_type": r.anomaly_type,
                 "severity": r.severity,
@@ -58,23 +72,30 @@ async def get_anomaly_events(
             }
             for r in rows
         ],
-    }
+    })
 
 
 @router.get("/events/{event_id}")
 async def get_anomaly_event_detail(
+    request: Request,
     event_id: int,
     db: AsyncSession = Depends(get_db),
 ):
     """获取异常事件详情"""
+    generations = response_cache.snapshot(GEN_EVENTS)
+    cached = response_cache.lookup(request, generations)
+    if cached is not None:
+        return cached
+
     result = await db.execute(
         select(AnomalyEventORM).where(AnomalyEventORM.id == event_id)
     )
     row = result.scalar_one_or_none()
     if not row:
         return {"error": "Event not found"}
-    return {
+    return response_cache.store(request, generations, {
         "id": row.id,
+        "vehicle_id": row.vehicle_id,
         "timestamp": row.timestamp,
         "anomaly_type": row.anomaly_type,
         "severity": row.severity,
@@ -86,71 +107,33 @@ async def get_anomaly_event_detail(
         "raw_data": json.loads(row.raw_data) if row.raw_data else None,
         "detection_method": row.detection_method,
         "status": row.status,
-    }
+    })
 
 
 @router.post("/detect")
 async def trigger_detection(
-    limit: int = Query(500, le=2000),
+    limit: int = Query(500, le=2000, description="每块读取的报文数"),
+    max_chunks: int = Query(10, ge=1, le=100),
     db: AsyncSession = Depends(get_db),
 ):
-    """手动触发异常检测：读取最近的流量数据并执行检测"""
-    # 1. 读取最近的流量记录
-    stmt = (
-        select(PacketORM)
-        .order_by(PacketORM.timestamp.desc())
-        .limit(limit)
-    )
-    result = await db.execute(stmt)
-    rows = result.scalars().all()
+    """手动触发异常检测：只检测上次检测之后新到达的报文"""
+    if settings.ingest.shm_enabled:
+        return {"error": "已启用共享内存检测进程（ingest.shm_enabled），报文由检测进程检测"}
+    result = await run_detection(db, detector_pool, limit, max_chunks)
+    alerts = result["alerts"]
 
-    if not rows:
-        return {"detected": 0, "message": "No traffic data available"}
-
-    # 2. 转换为 UnifiedPacket
-    packets = []
-    for r in rows:
-        packets.append(UnifiedPacket(
-            timestamp=r.timestamp,
-            protocol=r.protocol,
-            source=r.source or "",
-            destination=r.destination or "",
-            msg_id=r.msg_id or "",
-            payload_hex=r.payload.hex() if r.payload else "",
-            payload_decoded=json.loads(r.payload_decoded) if r.payload_decoded else {},
-            domain=r.domain or "",
-        ))
-
-    # 3. 用正常流量训练（如果尚未训练）
-    if not detector.ml_detector.is_fitted:
-        normal = [p for p in packets if not p.metadata.get("attack")]
-        if len(normal) > 20:
-            detector.train(normal)
-
-    # 4. 执行检测
-    alerts = detector.detect(packets)
-
-    # 5. 存入数据库
-    for a in alerts:
-        orm = AnomalyEventORM(
-            timestamp=a.timestamp,
-            anomaly_type=a.anomaly_type,
-            severity=a.severity,
-            confidence=a.confidence,
-            protocol=a.protocol,
-            source_node=a.source_node,
-            target_node=a.target_node,
-            description=a.description,
-            detection_method=a.detection_method,
-            status="open",
-        )
-        db.add(orm)
-    await db.commit()
+    if result.get("busy"):
+        return {"detected": 0, "processed": 0, "message": "Detection is running in another worker"}
+    if result["processed"] == 0:
+        return {"detected": 0, "processed": 0, "message": "No new traffic data"}
 
     return {
         "detected": len(alerts),
+        "processed": result["processed"],
+        "cursor": result["cursor"],
         "alerts": [
             {
+                "vehicle_id": a.vehicle_id,
                 "anomaly_type": a.anomaly_type,
                 "severity": a.severity,
                 "confidence": a.confidence,
@@ -158,4 +141,4 @@ async def trigger_detection(
             }
             for a in alerts
         ],
-    }
\ No newline at end of file
+    }
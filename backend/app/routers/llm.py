@@ -4,18 +4,22 @@ import json
 import uuid
 from typing import Optional
 
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, Header, Query
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import get_db
 from app.models.anomaly import AnomalyEventORM, AnomalyEvent
-from app.models.report import AnalysisReportORM, ChatHistoryORM
+from app.models.report import AnalysisReportORM
+from app.services.chat_context import ChatContextCache
 from app.services.llm_engine import LLMEngine
+from app.services.report_jobs import ReportJobManager
 
 router = APIRouter(prefix="/api/llm", tags=["llm"])
 
 llm = LLMEngine()
+chat_contexts = ChatContextCache(summarizer=llm.summarize)
+report_jobs = ReportJobManager(llm)
 
 
 @router.post("/analyze")
@@ -60,44 +64,25 @@ async def analyze_event(
 
 @router.post("/report")
 async def generate_report(
-    limit: int = 10,
-    db: AsyncSession = Depends(get_db),
+    limit: int = Query(10, ge=1, le=10000),
+    idempotency_key: Optional[str] = Header(None, max_length=128),
 ):
-    """基于最近的异常事件生成预警报告"""
-    result = await db.execute(
-        select(AnomalyEventORM)
-        .order_by(AnomalyEventORM.timestamp.desc())
-        .limit(limit)
-    )
-    rows = result.scalars().all()
-    if not rows:
-        return {"error": "No anomaly events found"}
-
-    events = [
-        AnomalyEvent(
-            timestamp=r.timestamp,
-            anomaly_type=r.anomaly_type,
-            severity=r.severity,
-            confidence=r.confidence or 0,
-            protocol=r.protocol or "",
-            source_node=r.source_node or "",
-            description=r.description or "",
-            detection_method=r.detection_method or "",
-        )
-        for r in rows
-    ]
-
-    report_data = await llm.generate_report(events)
+    """提交预警报告任务，立即返回任务ID
+
+    报告在后台工作协程中生成（本地聚合后调用LLM）；携带相同 Idempotency-Key
+    的重复提交返回同一任务。结果通过 GET /api/llm/report/{job_id} 轮询，
+    或订阅 /ws/report/{job_id}。
+    """
+    return report_jobs.submit(limit, idempotency_key)
 
-    report = AnalysisReportORM(
-        report_type="alert_report",
-        content=json.dumps(report_data, ensure_ascii=False),
-        llm_model=llm.model,
-    )
-    db.add(report)
-    await db.commit()
 
-    return {"report": report_data}
+@router.get("/report/{job_id}")
+async def get_report_job(job_id: str):
+    """查询报告任务状态，完成后包含报告内容"""
+    job = report_jobs.get(job_id)
+    if job is None:
+        return {"error": "Report job not found"}
+    return job.to_dict()
 
 
 @router.post("/chat")
@@ -110,29 +95,12 @@ async def chat_endpoint(
     if not session_id:
         session_id = str(uuid.uuid4())[:8]
 
-    # 加载历史消息
-    result = await db.execute(
-        select(ChatHistoryORM)
-        .where(ChatHistoryORM.session_id == session_id)
-        .order_by(ChatHistoryORM.created_at)
-        .limit(20)
-    )
-    history_rows = result.scalars().all()
-    messages = [{"role": r.role, "content": r.content} for r in history_rows]
-    messages.append({"role": "user", "content": message})
-
-    # 调用LLM
-    resp = await llm.chat(messages)
-
-    # 保存对话
-    db.add(ChatHistoryORM(
-        session_id=session_id, role="user", content=message,
-    ))
-    db.add(ChatHistoryORM(
-        session_id=session_id, role="assistant", content=resp["content"],
-        tool_calls=json.dumps(resp["tool_calls"]) if resp["tool_calls"] else None,
-    ))
-    await db.commit()
+    # 摘要 + 预算内的最近消息，提示长度不随会话增长
+    ctx = await chat_contexts.get(db, session_id)
+    async with ctx.lock:
+        messages = chat_contexts.build_messages(ctx, message)
+        resp = await llm.chat(messages)
+        await chat_contexts.append(db, ctx, message, resp)
 
     return {
         "session_id": session_id,
@@ -3,13 +3,22 @@
 from typing import Optional
 
 from fastapi import APIRouter, Depends, Query
-from sqlalchemy import text, select, func
+from sqlalchemy import delete, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.database import get_db
+from app.database import database_stats, get_db
 from app.models.packet import PacketORM
-from app.models.anomaly import AnomalyEventORM
+from app.models.anomaly import AnomalyEventORM, DetectionCursorORM
+from app.models.report import AnalysisReportORM, ChatHistoryORM, ChatSessionORM
+from app.routers.anomaly import detector_pool, detection_scheduler
+from app.routers.llm import chat_contexts, llm, report_jobs
+from app.services.archive import packet_archive
+from app.services.bucket_rollups import bucket_rollups
+from app.services.live_hub import live_hub
+from app.services.packet_store import KIND_PROTOCOL, packet_store
+from app.services.response_cache import GEN_EVENTS, GEN_PACKETS, response_cache
+from app.services.write_behind import write_behind
 
 router = APIRouter(prefix="/api/system", tags=["system"])
 
@@ -29,19 +38,47 @@ async def get_system_status():
             "rule_enabled": settings.detector.rule_enabled,
             "ml_enabled": settings.detector.ml_enabled,
         },
+        "database": database_stats(),
+        "fleet": await detector_pool.stats(),
+        "scheduler": detection_scheduler.stats(),
+        "archive": packet_archive.stats(),
+        "chat": chat_contexts.stats(),
+        "bucket_rollups": bucket_rollups.stats(),
+        "report_jobs": report_jobs.stats(),
+        "llm_client": llm.client.stats(),
+        "live": live_hub.stats(),
+        "response_cache": response_cache.stats(),
+        "write_behind": write_behind.stats(),
     }
 
 
+@router.post("/archive")
+async def run_archive():
+    """立即执行一轮冷归档（将超过保留时长且已检测的报文移入块文件）"""
+    result = await packet_archive.archive_once()
+    return {**result, "message": f"已归档 {result['rows']} 条流量记录"}
+
+
 @router.delete("/clear-data")
 async def clear_all_data(db: AsyncSession = Depends(get_db)):
     """清空所有数据库数据"""
-    tables = ["chat_history", "analysis_reports", "anomaly_events", "packets"]
+    # 报告引用异常事件，须先于 anomaly_events 删除
+    models = [
+        ChatHistoryORM, ChatSessionORM, AnalysisReportORM, AnomalyEventORM, PacketORM,
+        DetectionCursorORM,
+    ]
     counts = {}
-    for table in tables:
-        result = await db.execute(text(f"SELECT COUNT(*) FROM {table}"))
-        counts[table] = result.scalar()
-        await db.execute(text(f"DELETE FROM {table}"))
+    for model in models:
+        result = await db.execute(delete(model))
+        counts[model.__tablename__] = result.rowcount
+    archived = await packet_archive.clear(db)
+    counts["archive_blocks"] = len(archived)
+    counts["rollup_buckets"] = await bucket_rollups.clear(db)
     await db.commit()
+    packet_archive.remove_files(archived)
+    chat_contexts.clear()
+    response_cache.bump(GEN_PACKETS, GEN_EVENTS)
+    live_hub.publish_reset()
     return {"cleared": counts, "message": "所有数据已清空"}
 
 
@@ -52,11 +89,12 @@ async def clear_packets_partial(
     db: AsyncSession = Depends(get_db),
 ):
     """按条件部分清理流量数据"""
-    # 清理前计数
-    count_q = select(func.count()).select_from(PacketORM)
+    protocol_code = None
     if protocol:
-        count_q = count_q.where(PacketORM.protocol == protocol.upper())
-    before = (await db.execute(count_q)).scalar()
+        protocol_code = await packet_store.code_of(db, KIND_PROTOCOL, protocol.upper())
+
+    # 清理前计数
+    before = (await db.execute(select(func.count()).select_from(PacketORM))).scalar()
 
     if keep_recent and keep_recent > 0:
         # 找到第N条的id作为分界线
@@ -68,19 +106,15 @@ async def clear_packets_partial(
         )
         cutoff_row = (await db.execute(cutoff_q)).scalar()
         if cutoff_row:
-            await db.execute(
-                text("DELETE FROM packets WHERE id <= :cutoff"),
-                {"cutoff": cutoff_row},
-            )
+            await db.execute(delete(PacketORM).where(PacketORM.id <= cutoff_row))
     elif protocol:
-        await db.execute(
-            text("DELETE FROM packets WHERE protocol = :proto"),
-            {"proto": protocol.upper()},
-        )
+        await db.execute(delete(PacketORM).where(PacketORM.protocol_code == protocol_code))
     else:
         return {"error": "请指定 protocol 或 keep_recent 参数"}
 
     await db.commit()
+    response_cache.bump(GEN_PACKETS)
+    live_hub.publish_reset()
 
     after = (await db.execute(
         select(func.count()).select_from(PacketORM)
@@ -93,6 +127,16 @@ async def clear_packets_partial(
     }
 
 
+async def _delete_events(db: AsyncSession, condition) -> None:
+    """删除满足条件的异常事件，引用它们的报告保留但解除关联（PostgreSQL 强制外键）"""
+    await db.execute(
+        update(AnalysisReportORM)
+        .where(AnalysisReportORM.event_id.in_(select(AnomalyEventORM.id).where(condition)))
+        .values(event_id=None)
+    )
+    await db.execute(delete(AnomalyEventORM).where(condition))
+
+
 @router.delete("/clear-anomalies")
 async def clear_anomalies_partial(
     severity: Optional[str] = Query(None, description="按严重程度删除: critical/high/medium/low"),
@@ -100,10 +144,7 @@ async def clear_anomalies_partial(
     db: AsyncSession = Depends(get_db),
 ):
     """按条件部分清理异常事件"""
-    count_q = select(func.count()).select_from(AnomalyEventORM)
-    if severity:
-        count_q = count_q.where(AnomalyEventORM.severity == severity)
-    before = (await db.execute(count_q)).scalar()
+    before = (await db.execute(select(func.count()).select_from(AnomalyEventORM))).scalar()
 
     if keep_recent and keep_recent > 0:
         cutoff_q = (
@@ -114,19 +155,15 @@ async def clear_anomalies_partial(
         )
         cutoff_row = (await db.execute(cutoff_q)).scalar()
         if cutoff_row:
-            await db.execute(
-                text("DELETE FROM anomaly_events WHERE id <= :cutoff"),
-                {"cutoff": cutoff_row},
-            )
+            await _delete_events(db, AnomalyEventORM.id <= cutoff_row)
     elif severity:
-        await db.execute(
-            text("DELETE FROM anomaly_events WHERE severity = :sev"),
-            {"sev": severity},
-        )
+        await _delete_events(db, AnomalyEventORM.severity == severity)
     else:
         return {"error": "请指定 severity 或 keep_recent 参数"}
 
     await db.commit()
+    response_cache.bump(GEN_EVENTS)
+    live_hub.publish_reset()
 
     after = (await db.execute(
         select(func.count()).select_from(AnomalyEventORM)
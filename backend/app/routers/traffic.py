@@ -1,58 +1,105 @@
 """流量相关API路由"""
 
-import json
 import time
-from typing import Optional
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Body, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import settings
 from app.database import get_db
-from app.models.packet import PacketORM, PacketResponse, TrafficStats, UnifiedPacket
+from app.models.packet import (
+    PacketORM, PacketResponse, TrafficStats, UnifiedPacket, DEFAULT_VEHICLE_ID,
+)
 from app.simulators.can_simulator import (
     generate_normal_can, generate_dos_attack,
     generate_fuzzy_attack, generate_spoofing_attack,
 )
+from app.routers.anomaly import detection_scheduler
+from app.services.archive import packet_archive
+from app.services.bucket_rollups import bucket_rollups
+from app.services.exporter import EXPORT_FORMATS, iter_export, pyarrow_available
+from app.services.live_hub import live_hub
+from app.services.packet_store import (
+    KIND_MSG, KIND_PROTOCOL, KIND_VEHICLE, PACKET_COLUMNS, packet_store,
+)
+from app.services.response_cache import GEN_EVENTS, GEN_PACKETS, response_cache
+from app.services.shm_ring import get_ingest_ring
+from app.services.traffic_parser import TrafficParserService
+from app.services.write_behind import write_behind
 from app.simulators.eth_simulator import generate_normal_eth
-from app.simulators.v2x_simulator import generate_normal_v2x
+from app.simulators.v2x_simulator import generate_normal_v2x, generate_sybil_attack
 
 router = APIRouter(prefix="/api/traffic", tags=["traffic"])
 
+traffic_parser = TrafficParserService()
 
-async def _save_packets(packets: list[UnifiedPacket], db: AsyncSession):
-    """将UnifiedPacket列表存入数据库"""
-    for p in packets:
-        orm = PacketORM(
-            timestamp=p.timestamp,
-            protocol=p.protocol,
-            source=p.source,
-            destination=p.destination,
-            msg_id=p.msg_id,
-            payload=bytes.fromhex(p.payload_hex) if p.payload_hex else b"",
-            payload_decoded=json.dumps(p.payload_decoded, ensure_ascii=False),
-            domain=p.domain,
-            metadata_json=json.dumps(p.metadata, ensure_ascii=False),
-        )
-        db.add(orm)
-    await db.commit()
+
+async def _save_packets(packets: list[UnifiedPacket]):
+    """经写后队列组提交入库，返回时报文已持久化"""
+    if not packets:
+        return
+    await write_behind.write(packets=packets)
+    response_cache.bump(GEN_PACKETS)
+    live_hub.publish_packets(packets)
+
+    # 开启共享内存时只分发给独立检测进程，否则唤醒进程内调度器
+    if settings.ingest.shm_enabled:
+        get_ingest_ring().write_packets(packets)
+    else:
+        detection_scheduler.notify_packets(len(packets))
 
 
 @router.get("/stats", response_model=TrafficStats)
-async def get_traffic_stats(db: AsyncSession = Depends(get_db)):
-    """获取流量统计概览"""
-    total = await db.scalar(select(func.count()).select_from(PacketORM))
-    can_count = await db.scalar(
-        select(func.count()).select_from(PacketORM).where(PacketORM.protocol == "CAN")
-    )
-    eth_count = await db.scalar(
-        select(func.count()).select_from(PacketORM).where(PacketORM.protocol == "ETH")
-    )
-    v2x_count = await db.scalar(
-        select(func.count()).select_from(PacketORM).where(PacketORM.protocol == "V2X")
-    )
-    ts_min = await db.scalar(select(func.min(PacketORM.timestamp)))
-    ts_max = await db.scalar(select(func.max(PacketORM.timestamp)))
+async def get_traffic_stats(
+    request: Request,
+    vehicle_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """获取流量统计概览（无新写入时由响应缓存直接返回或返回 304）"""
+    generations = response_cache.snapshot(GEN_PACKETS)
+    cached = response_cache.lookup(request, generations)
+    if cached is not None:
+        return cached
+    stats = await _compute_stats(db, vehicle_id)
+    return response_cache.store(request, generations, stats)
+
+
+async def _compute_stats(db: AsyncSession, vehicle_id: Optional[str]) -> TrafficStats:
+    def scoped(stmt):
+        if vehicle_id:
+            stmt = stmt.where(PacketORM.vehicle_code == vehicle_code)
+        return stmt
+
+    vehicle_code = None
+    if vehicle_id:
+        vehicle_code = await packet_store.code_of(db, KIND_VEHICLE, vehicle_id)
+        if vehicle_code is None:
+            return TrafficStats(
+                total_packets=0, can_count=0, eth_count=0, v2x_count=0,
+                packets_per_second=0.0,
+            )
+
+    by_protocol = dict((await db.execute(
+        scoped(select(PacketORM.protocol_code, func.count()).group_by(PacketORM.protocol_code))
+    )).all())
+    # 合并冷归档中的帧数（由块索引汇总，不打开块文件）
+    archived = await packet_archive.summary(db, vehicle_code)
+    for code, n in archived["by_protocol"].items():
+        by_protocol[code] = by_protocol.get(code, 0) + n
+    await packet_store.ensure_codes(db, by_protocol)
+    counts = {packet_store.value(code): n for code, n in by_protocol.items()}
+    total = sum(counts.values())
+    can_count = counts.get("CAN", 0)
+    eth_count = counts.get("ETH", 0)
+    v2x_count = counts.get("V2X", 0)
+    ts_min = await db.scalar(scoped(select(func.min(PacketORM.timestamp))))
+    ts_max = await db.scalar(scoped(select(func.max(PacketORM.timestamp))))
+    if archived["ts_min"] is not None:
+        ts_min = min(ts_min or archived["ts_min"], archived["ts_min"])
+        ts_max = max(ts_max or archived["ts_max"], archived["ts_max"])
 
     pps = 0.0
     if ts_min and ts_max and ts_max > ts_min:
@@ -72,37 +119,116 @@ async def get_traffic_stats(db: AsyncSession = Depends(get_db)):
 @router.get("/packets")
 async def get_packets(
     protocol: Optional[str] = None,
+    vehicle_id: Optional[str] = None,
+    msg_id: Optional[str] = None,
     limit: int = Query(50, le=500),
     offset: int = 0,
     db: AsyncSession = Depends(get_db),
 ):
-    """分页查询流量记录"""
-    stmt = select(PacketORM).order_by(PacketORM.timestamp.desc())
+    """分页查询流量记录（packets 表之后接续冷归档中的较旧报文）"""
+    stmt = select(*PACKET_COLUMNS).order_by(PacketORM.timestamp.desc())
+    count_stmt = select(func.count()).select_from(PacketORM)
+    vehicle_code = protocol_code = msg_code = None
+    if vehicle_id:
+        vehicle_code = await packet_store.code_of(db, KIND_VEHICLE, vehicle_id)
+        if vehicle_code is None:
+            return []
+        stmt = stmt.where(PacketORM.vehicle_code == vehicle_code)
+        count_stmt = count_stmt.where(PacketORM.vehicle_code == vehicle_code)
     if protocol:
-        stmt = stmt.where(PacketORM.protocol == protocol.upper())
+        protocol_code = await packet_store.code_of(db, KIND_PROTOCOL, protocol.upper())
+        if protocol_code is None:
+            return []
+        stmt = stmt.where(PacketORM.protocol_code == protocol_code)
+        count_stmt = count_stmt.where(PacketORM.protocol_code == protocol_code)
+    if msg_id:
+        msg_code = await packet_store.code_of(db, KIND_MSG, msg_id)
+        if msg_code is None:
+            return []
+        stmt = stmt.where(PacketORM.msg_code == msg_code)
+        count_stmt = count_stmt.where(PacketORM.msg_code == msg_code)
     stmt = stmt.offset(offset).limit(limit)
-    result = await db.execute(stmt)
-    rows = result.scalars().all()
+    rows = list((await db.execute(stmt)).all())
+
+    if len(rows) < limit:
+        live_total = await db.scalar(count_stmt) or 0
+        rows.extend(await packet_archive.fetch_recent(
+            db, max(0, offset - live_total), limit - len(rows),
+            vehicle_code, protocol_code, msg_code,
+        ))
+
+    await packet_store.prepare(db, rows)
     return [
-        {
-            "id": r.id,
-            "timestamp": r.timestamp,
-            "protocol": r.protocol,
-            "source": r.source,
-            "destination": r.destination,
-            "msg_id": r.msg_id,
-            "domain": r.domain,
-            "payload_decoded": json.loads(r.payload_decoded) if r.payload_decoded else {},
-        }
+        {**packet_store.row_fields(r), "payload_decoded": packet_store.decoded(r)}
         for r in rows
     ]
 
 
+@router.get("/aggregate")
+async def aggregate_traffic(
+    request: Request,
+    group_by: str = Query("protocol", enum=["protocol", "msg_id", "source", "severity"]),
+    start: Optional[float] = Query(None, description="起始时间戳（含），默认 end 前一小时"),
+    end: Optional[float] = Query(None, description="结束时间戳（不含），默认当前时间"),
+    bucket: int = Query(60, ge=1, description="桶宽（秒）"),
+    vehicle_id: Optional[str] = None,
+    top: int = Query(10, ge=1, le=50, description="返回计数最多的取值数，其余合并为 other"),
+    db: AsyncSession = Depends(get_db),
+):
+    """按时间桶聚合的报文 / 告警计数（由多分辨率汇总表计算，不扫描报文明细）"""
+    generations = response_cache.snapshot(GEN_EVENTS if group_by == "severity" else GEN_PACKETS)
+    cached = response_cache.lookup(request, generations)
+    if cached is not None:
+        return cached
+    end = time.time() if end is None else end
+    start = end - 3600 if start is None else start
+    result = await bucket_rollups.query(db, group_by, start, end, bucket, vehicle_id, top)
+    if "error" in result:
+        return result
+    return response_cache.store(request, generations, result)
+
+
+@router.get("/export")
+async def export_data(
+    kind: str = Query("packets", enum=["packets", "events"]),
+    format: str = Query("ndjson", enum=list(EXPORT_FORMATS)),
+    start: Optional[float] = Query(None, description="起始时间戳（含）"),
+    end: Optional[float] = Query(None, description="结束时间戳（不含）"),
+    vehicle_id: Optional[str] = None,
+    chunk_size: int = Query(5000, ge=100, le=50000),
+):
+    """按时间范围流式导出报文或异常事件（NDJSON / Arrow IPC / Parquet）"""
+    if format != "ndjson" and not pyarrow_available():
+        return {"error": f"{format} 格式导出需要安装 pyarrow"}
+
+    media_type, ext = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        iter_export(kind, format, start, end, vehicle_id, chunk_size),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{ext}"'},
+    )
+
+
+@router.post("/ingest")
+async def ingest_records(
+    records: List[dict] = Body(..., description="原始记录列表（CAN/ETH/V2X）"),
+):
+    """接入采集到的原始流量记录
+
+    ETH 记录若不含 service_id，payload_hex 视为原始 UDP/TCP 负载，
+    按二进制 SOME/IP 批量解析（一个数据报可包含多条报文）。
+    无法解析的记录与不完整的数据报计入 malformed，不影响同批其他记录入库。
+    """
+    packets, malformed = traffic_parser.parse_batch(records)
+    await _save_packets(packets)
+    return {"received": len(records), "ingested": len(packets), "malformed": malformed}
+
+
 @router.post("/simulate")
 async def simulate_traffic(
-    scenario: str = Query("normal", enum=["normal", "dos", "fuzzy", "spoofing", "mixed"]),
+    scenario: str = Query("normal", enum=["normal", "dos", "fuzzy", "spoofing", "sybil", "mixed"]),
     count: int = Query(100, le=1000),
-    db: AsyncSession = Depends(get_db),
+    vehicle_id: str = Query(DEFAULT_VEHICLE_ID, max_length=64),
 ):
     """生成模拟流量数据"""
     base_time = time.time()
@@ -121,6 +247,10 @@ async def simulate_traffic(
     elif scenario == "spoofing":
         packets.extend(generate_normal_can(count // 2, base_time))
         packets.extend(generate_spoofing_attack(count, base_time))
+    elif scenario == "sybil":
+        packets.extend(generate_normal_can(count // 2, base_time))
+        packets.extend(generate_normal_v2x(count // 2, base_time))
+        packets.extend(generate_sybil_attack(count // 2, base_time))
     elif scenario == "mixed":
         packets.extend(generate_normal_can(count, base_time))
         packets.extend(generate_dos_attack(count // 3, base_time))
@@ -128,6 +258,11 @@ async def simulate_traffic(
         packets.extend(generate_spoofing_attack(count // 3, base_time))
         packets.extend(generate_normal_eth(count // 3, base_time))
         packets.extend(generate_normal_v2x(count // 4, base_time))
+        packets.extend(generate_sybil_attack(count // 6, base_time))
+
+    for p in packets:
+        p.vehicle_id = vehicle_id
+
+    await _save_packets(packets)
+    return {"generated": len(packets), "scenario": scenario, "vehicle_id": vehicle_id}
 
-    await _save_packets(packets, db)
-    return {"generated": len(packets), "scenario": scenario}
@@ -0,0 +1,52 @@
+"""WebSocket 推送路由（前端开发服务器将 /ws 代理到后端）"""
+
+import asyncio
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+
+from app.config import settings
+from app.routers.llm import report_jobs
+from app.services.live_hub import live_hub
+
+router = APIRouter(prefix="/ws", tags=["ws"])
+
+
+@router.websocket("/report/{job_id}")
+async def report_job_updates(websocket: WebSocket, job_id: str):
+    """推送报告任务状态，任务结束（done / failed）后关闭连接"""
+    await websocket.accept()
+    job = report_jobs.get(job_id)
+    if job is None:
+        await websocket.send_json({"error": "Report job not found"})
+        await websocket.close()
+        return
+
+    # 先订阅再发送当前状态，避免两者之间的状态变化丢失
+    queue = report_jobs.subscribe(job_id)
+    try:
+        state = job.to_dict()
+        await websocket.send_json(state)
+        while state["status"] not in ("done", "failed"):
+            state = await queue.get()
+            await websocket.send_json(state)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        report_jobs.unsubscribe(job_id, queue)
+
+
+@router.websocket("/live")
+async def live_updates(websocket: WebSocket):
+    """推送新告警、统计增量与每秒速率（按 live.max_fps 合并）"""
+    await websocket.accept()
+    sub = live_hub.subscribe()
+    try:
+        while True:
+            frame = await sub.next_frame()
+            # 发送超时说明客户端过慢，断开后由前端重连并重新加载
+            await asyncio.wait_for(websocket.send_json(frame), settings.live.send_timeout)
+    except (WebSocketDisconnect, asyncio.TimeoutError):
+        pass
+    finally:
+        live_hub.unsubscribe(sub)
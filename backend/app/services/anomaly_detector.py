@@ -1,19 +1,87 @@
 """异常检测引擎
 
 两级检测架构：
-1. 规则引擎：频率异常、ID越界、负载异常
-2. ML模型：Isolation Forest 无监督异常检测
+1. 规则引擎：频率异常、ID越界、负载异常；SOME/IP 服务白名单、流速率、请求/响应配对；
+   V2X 位置跳变、运动学一致性与 Sybil 聚集
+2. 学习型检测：CAN ID 序列转移概率、按ID负载画像、Isolation Forest 无监督异常检测
+   （滑动窗口 + 漂移触发重训练）
 """
 
+import math
 import time
+import zlib
 from collections import Counter, defaultdict
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 
 from app.models.packet import UnifiedPacket
 from app.models.anomaly import AnomalyEvent
 from app.config import settings
+from app.services import someip
+from app.services.packet_batch import PacketBatch, CAN_STD_ID_SPACE, parse_can_id
+
+_UINT32_MAX = 0xFFFFFFFF
+
+
+class NoveltyTracker:
+    """未知CAN ID的跨批次新颖性状态（定长内存，随检测器状态持久化）
+
+    - 11 位标准帧 ID 直接映射到 2048 个槽位；29 位扩展帧及无法解析的 ID
+      哈希到 extended_slots 个槽位（冲突只会少报，不会重复告警）
+    - reported 位图记录本窗口内已告警的槽位，counts 记录本窗口各槽位出现次数
+    - 窗口到期后位图清零，仍在出现的 ID 在新窗口再告警一次，并附带上一窗口的累计次数
+    """
+
+    def __init__(self, window: float, extended_slots: int):
+        self.window = window
+        self.slots = CAN_STD_ID_SPACE + extended_slots
+        self.reported = np.zeros((self.slots + 7) // 8, dtype=np.uint8)
+        self.counts = np.zeros(self.slots, dtype=np.uint32)
+        self.prev_counts = np.zeros(self.slots, dtype=np.uint32)
+        self.window_start: Optional[float] = None
+
+    @classmethod
+    def from_settings(cls) -> "NoveltyTracker":
+        cfg = settings.detector
+        return cls(cfg.novelty_window, cfg.novelty_extended_slots)
+
+    def slot(self, msg_id: str) -> int:
+        can_id = parse_can_id(msg_id)
+        if 0 <= can_id < CAN_STD_ID_SPACE:
+            return can_id
+        extended = self.slots - CAN_STD_ID_SPACE
+        return CAN_STD_ID_SPACE + zlib.crc32(msg_id.encode("utf-8")) % extended
+
+    def _roll(self, now: float) -> None:
+        if self.window_start is None:
+            self.window_start = now
+            return
+        elapsed = now - self.window_start
+        if elapsed < self.window:
+            return
+        if elapsed < 2 * self.window:
+            self.prev_counts, self.counts = self.counts, self.prev_counts
+        else:
+            # 中间有整窗口无活动，上一窗口计数为 0
+            self.prev_counts[:] = 0
+        self.counts[:] = 0
+        self.reported[:] = 0
+        self.window_start = now - elapsed % self.window
+
+    def observe(self, id_counts: Dict[str, int], now: float) -> List[Tuple[str, int, int]]:
+        """累加出现次数，返回本窗口首次出现的 (ID, 本批次数, 上一窗口累计次数)"""
+        self._roll(now)
+        novel = []
+        for msg_id, n in id_counts.items():
+            s = self.slot(msg_id)
+            self.counts[s] = min(int(self.counts[s]) + n, _UINT32_MAX)
+            byte, bit = s >> 3, 1 << (s & 7)
+            if self.reported[byte] & bit:
+                continue
+            self.reported[byte] |= bit
+            novel.append((msg_id, n, int(self.prev_counts[s])))
+        return novel
 
 
 class RuleBasedDetector:
@@ -27,6 +95,7 @@ class RuleBasedDetector:
     def __init__(self):
         self.freq_threshold = settings.detector.frequency_threshold
         self.baseline_freq = {}  # msg_id -> 基线频率
+        self.novelty = NoveltyTracker.from_settings()
 
     def check(self, packets: List[UnifiedPacket]) -> List[AnomalyEvent]:
         alerts = []
@@ -73,24 +142,59 @@ class RuleBasedDetector:
         return alerts
 
     def _check_unknown_id(self, packets: List[UnifiedPacket]) -> List[AnomalyEvent]:
-        """检测未知CAN ID（Fuzzy攻击特征）"""
-        alerts = []
-        seen_unknown = set()
+        """检测未知CAN ID（Fuzzy攻击特征）
+
+        同一ID在 novelty_window 内只告警一次；单批新出现的ID超过
+        novelty_max_alerts 个时，其余ID合并为一条汇总告警。
+        """
+        id_counts: Counter = Counter()
+        first: Dict[str, UnifiedPacket] = {}
         for p in packets:
-            if p.protocol != "CAN":
+            if p.protocol != "CAN" or p.msg_id in self.VALID_CAN_IDS:
                 continue
-            if p.msg_id not in self.VALID_CAN_IDS and p.msg_id not in seen_unknown:
-                seen_unknown.add(p.msg_id)
-                alerts.append(AnomalyEvent(
-                    timestamp=p.timestamp,
-                    anomaly_type="unknown_can_id",
-                    severity="high",
-                    confidence=0.8,
-                    protocol="CAN",
-                    source_node=p.source,
-                    description=f"检测到未知CAN ID: {p.msg_id}, 来源: {p.source}",
-                    detection_method="rule_id_whitelist",
-                ))
+            id_counts[p.msg_id] += 1
+            first.setdefault(p.msg_id, p)
+        if not id_counts:
+            return []
+
+        now = max(p.timestamp for p in first.values())
+        novel = self.novelty.observe(id_counts, now)
+        max_alerts = settings.detector.novelty_max_alerts
+
+        alerts = []
+        for msg_id, n, previous in novel[:max_alerts]:
+            p = first[msg_id]
+            description = f"检测到未知CAN ID: {msg_id}, 来源: {p.source}, 本批出现 {n} 次"
+            if previous:
+                description += f", 上一窗口累计 {previous} 次"
+            alerts.append(AnomalyEvent(
+                timestamp=p.timestamp,
+                anomaly_type="unknown_can_id",
+                severity="high",
+                confidence=0.8,
+                protocol="CAN",
+                source_node=p.source,
+                target_node=msg_id,
+                description=description,
+                detection_method="rule_id_whitelist",
+            ))
+
+        rest = novel[max_alerts:]
+        if rest:
+            frames = sum(n for _, n, _ in rest)
+            sources = Counter(first[msg_id].source for msg_id, _, _ in rest)
+            examples = ", ".join(msg_id for msg_id, _, _ in rest[:5])
+            alerts.append(AnomalyEvent(
+                timestamp=now,
+                anomaly_type="unknown_can_id",
+                severity="critical" if len(rest) >= max_alerts else "high",
+                confidence=0.9,
+                protocol="CAN",
+                source_node=sources.most_common(1)[0][0],
+                description=f"另有 {len(rest)} 个未知CAN ID 首次出现（共 {frames} 帧，"
+                            f"如 {examples}），疑似Fuzzy攻击",
+                detection_method="rule_id_whitelist",
+            ))
         return alerts
 
     def _check_payload(self, packets: List[UnifiedPacket]) -> List[AnomalyEvent]:
@@ -125,124 +229,871 @@ class RuleBasedDetector:
         return alerts
 
 
+class SomeIpServiceDetector:
+    """SOME/IP 服务级规则检测（车载以太网）
+
+    对批内 ETH 报文单次遍历，只做字典与数组查表：
+    - 白名单：(报文ID, 客户端, 服务端) 流，响应/错误/通知按反方向归属到请求流；
+      预置已知通信关系，训练时并入正常流量中出现的流
+    - 速率：流哈希到定长计数数组，按固定窗口计数，
+      超过 someip_rate_limit 的流每窗口告警一次（哈希冲突只会合并计数）
+    - 请求/响应配对：按 (流, Client ID, Session ID) 记录待应答请求，超过
+      someip_response_timeout 未应答或收到无对应请求的响应时告警
+    """
+
+    VALID_FLOWS = {
+        ("0x0100.0x0001", "HU", "ADAS"),
+        ("0x0100.0x0002", "HU", "ADAS"),
+        ("0x0200.0x0001", "ADAS", "GW"),
+        ("0x0300.0x0001", "TBOX", "GW"),
+        ("0x0300.0x0002", "TBOX", "CLOUD"),
+        ("0x0400.0x0001", "GW", "BCM"),
+        ("0x0500.0x0001", "DIAG_ETH", "GW"),
+    }
+
+    REQUEST = 0x00
+    REQUEST_NO_RETURN = 0x01
+    NOTIFICATION = 0x02
+    RESPONSE_TYPES = (0x80, 0x81)
+
+    def __init__(self):
+        cfg = settings.detector
+        self.rate_window = cfg.someip_rate_window
+        self.rate_limit = cfg.someip_rate_limit
+        self.response_timeout = cfg.someip_response_timeout
+        self.max_pending = cfg.someip_max_pending
+        self.flows = set(self.VALID_FLOWS)
+        self.counts = np.zeros(cfg.someip_flow_slots, dtype=np.uint32)
+        self.reported = np.zeros(cfg.someip_flow_slots, dtype=bool)
+        self.window_id = -1
+        self.pending: Dict[tuple, float] = {}  # 插入顺序即请求时间顺序
+
+    def _flow(self, p: UnifiedPacket) -> Tuple[tuple, Optional[int], Optional[tuple]]:
+        """返回 (流, 去除 TP 标志的报文类型, 头部字段)，旧数据无头部时按请求处理"""
+        fields = someip.header_from_hex(p.payload_hex, p.msg_id)
+        mtype = fields[7] & ~someip.TP_FLAG if fields else None
+        if mtype in self.RESPONSE_TYPES or mtype == self.NOTIFICATION:
+            return (p.msg_id, p.destination, p.source), mtype, fields
+        return (p.msg_id, p.source, p.destination), mtype, fields
+
+    def fit(self, packets: List[UnifiedPacket]):
+        for p in packets:
+            if p.protocol == "ETH":
+                self.flows.add(self._flow(p)[0])
+
+    def check(self, packets: List[UnifiedPacket]) -> List[AnomalyEvent]:
+        flows: Dict[tuple, int] = {}
+        first: List[UnifiedPacket] = []
+        flow_idx: List[int] = []
+        times: List[float] = []
+        unsolicited: Counter = Counter()
+        pending = self.pending
+
+        for p in packets:
+            if p.protocol != "ETH":
+                continue
+            key, mtype, fields = self._flow(p)
+            j = flows.get(key)
+            if j is None:
+                j = flows[key] = len(first)
+                first.append(p)
+            flow_idx.append(j)
+            times.append(p.timestamp)
+
+            if mtype == self.REQUEST:
+                pending[key + (fields[3], fields[4])] = p.timestamp
+                if len(pending) > self.max_pending:
+                    del pending[next(iter(pending))]
+            elif mtype in self.RESPONSE_TYPES:
+                if pending.pop(key + (fields[3], fields[4]), None) is None:
+                    unsolicited[j] += 1
+        if not flow_idx:
+            return []
+
+        keys = list(flows)
+        counts = np.bincount(flow_idx, minlength=len(keys))
+        alerts = []
+        for j, key in enumerate(keys):
+            if key not in self.flows:
+                alerts.append(self._alert(
+                    first[j], key, "someip_unknown_service", "high", 0.8,
+                    f"未登记的SOME/IP通信: {key[1]} -> {key[2]} 服务方法 {key[0]}, "
+                    f"本批 {int(counts[j])} 帧",
+                    "rule_someip_whitelist",
+                ))
+        alerts.extend(self._check_rate(keys, first, flow_idx, times))
+        for j, n in unsolicited.items():
+            key = keys[j]
+            alerts.append(self._alert(
+                first[j], key, "someip_unsolicited_response", "high", 0.75,
+                f"SOME/IP 响应无对应请求: {key[2]} -> {key[1]} 服务方法 {key[0]}, "
+                f"本批 {n} 帧",
+                "rule_someip_pairing",
+            ))
+        alerts.extend(self._check_unanswered(max(times)))
+        return alerts
+
+    def _check_rate(self, keys, first, flow_idx, times) -> List[AnomalyEvent]:
+        slot_of = np.array(
+            [zlib.crc32("|".join(k).encode("utf-8")) % len(self.counts) for k in keys],
+            dtype=np.int64,
+        )
+        idx = np.asarray(flow_idx, dtype=np.int64)
+        slots = slot_of[idx]
+        windows = np.floor(np.asarray(times) / self.rate_window).astype(np.int64)
+
+        violations: Dict[int, int] = {}  # 流下标 -> 窗口内计数
+        for w in np.unique(windows):
+            if w > self.window_id:
+                self.counts[:] = 0
+                self.reported[:] = False
+                self.window_id = int(w)
+            sel = windows == w
+            np.add.at(self.counts, slots[sel], 1)
+            hot, at = np.unique(slots[sel], return_index=True)
+            over = (self.counts[hot] > self.rate_limit) & ~self.reported[hot]
+            self.reported[hot[over]] = True
+            for s, i in zip(hot[over], at[over]):
+                violations[int(idx[sel][i])] = int(self.counts[s])
+
+        alerts = []
+        for j, count in violations.items():
+            key = keys[j]
+            ratio = count / max(self.rate_limit, 1)
+            alerts.append(self._alert(
+                first[j], key, "someip_rate_anomaly",
+                "critical" if ratio > 3.0 else "high" if ratio > 1.5 else "medium",
+                round(min(1.0, 0.5 + ratio / 10), 3),
+                f"SOME/IP 流 {key[1]} -> {key[2]} 服务方法 {key[0]} 速率超限: "
+                f"{self.rate_window:g}s 窗口内 {count} 帧, 上限 {self.rate_limit}",
+                "rule_someip_rate",
+            ))
+        return alerts
+
+    def _check_unanswered(self, now: float) -> List[AnomalyEvent]:
+        cutoff = now - self.response_timeout
+        stale = []
+        for req, ts in self.pending.items():
+            if ts >= cutoff:
+                break
+            stale.append((req, ts))
+        expired: Dict[tuple, List[float]] = {}
+        for req, ts in stale:
+            del self.pending[req]
+            expired.setdefault(req[:3], []).append(ts)
+
+        alerts = []
+        for key, stamps in expired.items():
+            alerts.append(AnomalyEvent(
+                timestamp=stamps[0],
+                anomaly_type="someip_unanswered_request",
+                severity="high" if len(stamps) > 10 else "medium",
+                confidence=0.7,
+                protocol="ETH",
+                source_node=key[1],
+                target_node=key[0],
+                description=f"SOME/IP 请求未应答: {key[1]} -> {key[2]} 服务方法 {key[0]}, "
+                            f"{len(stamps)} 个请求超过 {self.response_timeout:g}s 无响应",
+                detection_method="rule_someip_pairing",
+            ))
+        return alerts
+
+    @staticmethod
+    def _alert(p: UnifiedPacket, key: tuple, anomaly_type: str, severity: str,
+               confidence: float, description: str, method: str) -> AnomalyEvent:
+        return AnomalyEvent(
+            timestamp=p.timestamp,
+            anomaly_type=anomaly_type,
+            severity=severity,
+            confidence=confidence,
+            protocol="ETH",
+            source_node=p.source,
+            target_node=key[0],
+            description=description,
+            detection_method=method,
+        )
+
+
+class V2XPlausibilityDetector:
+    """V2X 运动学合理性检测
+
+    保存每个发送者最近一次的位置、速度与航向，以及活跃发送者的均匀网格索引
+    （格边长 v2x_sybil_radius 米），逐帧检查：
+    - 位置跳变：位移超过最大车速在间隔内可达的距离
+    - 运动学不一致：短间隔内位移与上报速度不符，或位移方向与上报航向不符
+    - Sybil 聚集：多个身份同时出现在同一位置，只查询相邻 3x3 个格子，
+      开销与活跃发送者数量近似线性
+    """
+
+    M_PER_DEG = 111320.0
+    MIN_HEADING_SPEED = 10.0  # km/h，低于该速度不比较航向
+
+    def __init__(self):
+        cfg = settings.detector
+        self.max_speed = cfg.v2x_max_speed_kmh / 3.6
+        self.position_tolerance = cfg.v2x_position_tolerance
+        self.speed_tolerance = cfg.v2x_speed_tolerance_kmh / 3.6
+        self.heading_tolerance = cfg.v2x_heading_tolerance
+        self.max_gap = cfg.v2x_consistency_max_gap
+        self.sender_ttl = cfg.v2x_sender_ttl
+        self.max_senders = cfg.v2x_max_senders
+        self.cell = cfg.v2x_sybil_radius
+        self.sybil_min = cfg.v2x_sybil_min_senders
+        self.sybil_window = cfg.v2x_sybil_window
+        self.cos_ref: Optional[float] = None
+        # 发送者 -> [时间戳, x, y, 速度km/h, 航向, 格子]，按最近更新排序
+        self.senders: Dict[str, list] = {}
+        self.grid: Dict[Tuple[int, int], set] = defaultdict(set)
+        self.sybil_reported: Dict[str, float] = {}
+
+    def _project(self, lat: float, lon: float) -> Tuple[float, float]:
+        """局部等距投影（米），以首次出现的纬度为参考"""
+        if self.cos_ref is None:
+            self.cos_ref = math.cos(math.radians(lat))
+        return lon * self.M_PER_DEG * self.cos_ref, lat * self.M_PER_DEG
+
+    def _remove(self, sender: str) -> None:
+        state = self.senders.pop(sender)
+        cell = self.grid.get(state[5])
+        if cell is not None:
+            cell.discard(sender)
+            if not cell:
+                del self.grid[state[5]]
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.sender_ttl
+        while self.senders:
+            sender, state = next(iter(self.senders.items()))
+            if state[0] >= cutoff and len(self.senders) <= self.max_senders:
+                break
+            self._remove(sender)
+        for sender in [s for s, ts in self.sybil_reported.items() if ts < cutoff]:
+            del self.sybil_reported[sender]
+
+    @staticmethod
+    def _angle_diff(a: float, b: float) -> float:
+        return abs((a - b + 180.0) % 360.0 - 180.0)
+
+    def _kinematics(self, prev: list, ts: float, x: float, y: float,
+                    speed: float, heading: float) -> Optional[Tuple[str, str]]:
+        """与上一状态比较，返回 (告警类型, 说明) 或 None"""
+        dt = ts - prev[0]
+        if dt <= 0:
+            return None
+        dx, dy = x - prev[1], y - prev[2]
+        dist = math.hypot(dx, dy)
+        if dist > self.max_speed * dt + self.position_tolerance:
+            return ("v2x_position_jump",
+                    f"{dt:.1f}s 内位移 {dist:.0f}m, 折合 {dist / dt * 3.6:.0f} km/h")
+        if dt > self.max_gap:
+            return None
+        avg_speed = (prev[3] + speed) / 2
+        expected = avg_speed / 3.6 * dt
+        if abs(dist - expected) > max(self.speed_tolerance * dt, self.position_tolerance):
+            return ("v2x_kinematic_inconsistency",
+                    f"上报速度 {avg_speed:.0f} km/h, 位移折合 {dist / dt * 3.6:.0f} km/h")
+        if avg_speed >= self.MIN_HEADING_SPEED and dist > 2 * self.position_tolerance:
+            # 两次上报航向的圆周平均值即两点连线方向（匀速圆周与直线运动均成立）
+            h1, h2 = math.radians(prev[4]), math.radians(heading)
+            mean = math.degrees(math.atan2(math.sin(h1) + math.sin(h2), math.cos(h1) + math.cos(h2)))
+            bearing = math.degrees(math.atan2(dx, dy))
+            diff = self._angle_diff(bearing, mean)
+            if diff > self.heading_tolerance:
+                return ("v2x_kinematic_inconsistency",
+                        f"上报航向 {mean % 360:.0f}°, 位移方向 {bearing % 360:.0f}°")
+        return None
+
+    def _neighbors(self, sender: str, state: list) -> List[str]:
+        ts, x, y, _, _, (cx, cy) = state
+        found = []
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for other in self.grid.get((gx, gy), ()):
+                    if other == sender:
+                        continue
+                    o = self.senders[other]
+                    if (abs(o[0] - ts) <= self.sybil_window
+                            and (o[1] - x) ** 2 + (o[2] - y) ** 2 <= self.cell ** 2):
+                        found.append(other)
+        return found
+
+    def check(self, packets: List[UnifiedPacket]) -> List[AnomalyEvent]:
+        findings: Dict[Tuple[str, str], list] = {}  # (发送者, 类型) -> [首帧, 次数, 说明]
+        updated: Dict[str, UnifiedPacket] = {}
+        now = None
+        for p in packets:
+            if p.protocol != "V2X":
+                continue
+            d = p.payload_decoded
+            lat, lon = d.get("latitude"), d.get("longitude")
+            if lat is None or lon is None:
+                continue
+            x, y = self._project(lat, lon)
+            speed, heading = float(d.get("speed_kmh", 0.0)), float(d.get("heading", 0.0))
+            ts = p.timestamp
+            now = ts if now is None else max(now, ts)
+
+            prev = self.senders.get(p.source)
+            if prev is not None:
+                result = self._kinematics(prev, ts, x, y, speed, heading)
+                if result is not None:
+                    entry = findings.setdefault((p.source, result[0]), [p, 0, result[1]])
+                    entry[1] += 1
+                self._remove(p.source)
+            cell = (int(x // self.cell), int(y // self.cell))
+            self.senders[p.source] = [ts, x, y, speed, heading, cell]
+            self.grid[cell].add(p.source)
+            updated[p.source] = p
+        if now is None:
+            return []
+
+        alerts = []
+        for (sender, kind), (p, n, detail) in findings.items():
+            jump = kind == "v2x_position_jump"
+            alerts.append(AnomalyEvent(
+                timestamp=p.timestamp,
+                anomaly_type=kind,
+                severity="high" if jump or n > 3 else "medium",
+                confidence=0.85 if jump else 0.7,
+                protocol="V2X",
+                source_node=sender,
+                target_node=p.msg_id,
+                description=f"V2X {'位置跳变' if jump else '运动学不一致'}: {sender} {detail}"
+                            + (f", 本批 {n} 次" if n > 1 else ""),
+                detection_method="v2x_plausibility",
+            ))
+        alerts.extend(self._check_sybil(updated))
+        self._expire(now)
+        return alerts
+
+    def _check_sybil(self, updated: Dict[str, UnifiedPacket]) -> List[AnomalyEvent]:
+        alerts = []
+        clustered = set()
+        for sender, p in updated.items():
+            if sender in clustered or sender not in self.senders:
+                continue
+            members = {sender, *self._neighbors(sender, self.senders[sender])}
+            if len(members) < self.sybil_min:
+                continue
+            clustered |= members
+            if all(m in self.sybil_reported for m in members):
+                continue
+            ts = self.senders[sender][0]
+            for m in members:
+                self.sybil_reported[m] = ts
+            names = sorted(members)
+            alerts.append(AnomalyEvent(
+                timestamp=ts,
+                anomaly_type="v2x_sybil",
+                severity="critical" if len(members) >= 2 * self.sybil_min else "high",
+                confidence=round(min(1.0, 0.6 + 0.05 * len(members)), 3),
+                protocol="V2X",
+                source_node=sender,
+                target_node=p.msg_id,
+                description=f"疑似Sybil攻击: {len(members)} 个身份同时位于半径 {self.cell:g}m 内 "
+                            f"({', '.join(names[:6])}{' 等' if len(names) > 6 else ''})",
+                detection_method="v2x_plausibility",
+            ))
+        return alerts
+
+
+class CANSequenceDetector:
+    """CAN ID 序列检测（一阶转移概率表）
+
+    ECU 周期调度使 ID 出现顺序高度规律。训练时只为出现过的 ID 分配紧凑下标，
+    学习 (K+1)x(K+1) 的对数转移概率表（最后一行/列代表其余 ID）；
+    检测时对整批相邻 ID 对做一次数组查表，低于阈值的转移按 ID 对聚合告警。
+    未知 ID 由白名单规则负责，此处只评估两端均为已知 ID 的转移。
+    """
+
+    SMOOTHING = 0.01
+    MAX_LINK_GAP = 1.0  # 与上一批次间隔超过该秒数时不衔接
+
+    def __init__(self):
+        self.min_logp = float(np.log(settings.detector.sequence_min_prob))
+        self.id_index = np.full(CAN_STD_ID_SPACE, -1, dtype=np.int32)
+        self.vocab = np.array([], dtype=np.int32)
+        self.log_prob: Optional[np.ndarray] = None
+        self._last_id = -1  # 跨批次衔接的上一帧 CAN ID 与时间戳
+        self._last_ts = 0.0
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.log_prob is not None
+
+    def _lookup(self, can_ids: np.ndarray) -> np.ndarray:
+        """CAN ID -> 紧凑下标，未知或扩展帧映射到 K"""
+        k = len(self.vocab)
+        idx = np.full(len(can_ids), k, dtype=np.int32)
+        in_range = (can_ids >= 0) & (can_ids < CAN_STD_ID_SPACE)
+        mapped = self.id_index[can_ids[in_range]]
+        idx[in_range] = np.where(mapped >= 0, mapped, k)
+        return idx
+
+    def fit(self, batch: PacketBatch):
+        ids = batch.can_ids[batch.can_indices()]
+        ids = ids[(ids >= 0) & (ids < CAN_STD_ID_SPACE)]
+        if len(ids) < 2:
+            return
+        self.vocab = np.unique(ids).astype(np.int32)
+        self.id_index[:] = -1
+        self.id_index[self.vocab] = np.arange(len(self.vocab), dtype=np.int32)
+
+        k = len(self.vocab) + 1
+        idx = self._lookup(ids)
+        counts = np.zeros((k, k), dtype=np.float64)
+        np.add.at(counts, (idx[:-1], idx[1:]), 1.0)
+        counts += self.SMOOTHING
+        self.log_prob = np.log(counts / counts.sum(axis=1, keepdims=True)).astype(np.float32)
+
+    def check(self, batch: PacketBatch) -> List[AnomalyEvent]:
+        if not self.is_fitted:
+            return []
+        can_pos = batch.can_indices()
+        if len(can_pos) == 0:
+            return []
+
+        last_id = self._last_id
+        if batch.timestamps[can_pos[0]] - self._last_ts > self.MAX_LINK_GAP:
+            last_id = -1
+        ids = np.concatenate(([last_id], batch.can_ids[can_pos])).astype(np.int32)
+        self._last_id = int(ids[-1])
+        self._last_ts = float(batch.timestamps[can_pos[-1]])
+        idx = self._lookup(ids)
+        prev, cur = idx[:-1], idx[1:]
+        k = len(self.vocab)
+
+        logp = self.log_prob[prev, cur]
+        flagged = (logp < self.min_logp) & (prev < k) & (cur < k)
+        if not flagged.any():
+            return []
+
+        # 按 (前驱ID, 当前ID) 聚合，避免同一异常转移逐帧告警
+        hits = np.flatnonzero(flagged)
+        pair_keys = prev[hits].astype(np.int64) * (k + 1) + cur[hits]
+        _, first, counts = np.unique(pair_keys, return_index=True, return_counts=True)
+
+        alerts = []
+        for j, count in zip(first, counts):
+            i = hits[j]
+            p = batch.packets[can_pos[i]]
+            prev_id = f"0x{int(self.vocab[prev[i]]):03X}"
+            prob = float(np.exp(logp[i]))
+            ratio = count / max(len(can_pos), 1)
+            if ratio > 0.1:
+                severity = "high"
+            elif count > 1:
+                severity = "medium"
+            else:
+                severity = "low"
+            alerts.append(AnomalyEvent(
+                timestamp=p.timestamp,
+                anomaly_type="sequence_anomaly",
+                severity=severity,
+                confidence=round(min(1.0, -logp[i] / 20.0 + 0.3), 3),
+                protocol="CAN",
+                source_node=p.source,
+                target_node=p.msg_id,
+                description=f"CAN ID 序列异常: {prev_id} -> {p.msg_id} "
+                            f"转移概率 {prob:.2e}, 本批出现 {count} 次",
+                detection_method="sequence_transition",
+            ))
+        return alerts
+
+
+class PayloadProfileDetector:
+    """按 CAN ID 学习的负载字节/比特画像
+
+    每个已知 ID 一行紧凑数组：DLC、逐字节取值范围、常量位掩码及取值、
+    逐比特翻转率。检测时整批做掩码与范围比较，并指出偏离的字节和比特。
+    """
+
+    FLIP_MIN_PAIRS = 30  # 批内翻转率比较所需的最少相邻帧对
+
+    def __init__(self):
+        cfg = settings.detector
+        self.min_samples = cfg.payload_min_samples
+        self.flip_tolerance = cfg.payload_flip_tolerance
+        self.id_index = np.full(CAN_STD_ID_SPACE, -1, dtype=np.int32)
+        self.vocab = np.array([], dtype=np.int32)
+        self.dlc = np.zeros(0, dtype=np.uint8)               # (K,)
+        self.byte_min = np.zeros((0, 8), dtype=np.uint8)     # (K, 8)
+        self.byte_max = np.zeros((0, 8), dtype=np.uint8)     # (K, 8)
+        self.const_mask = np.zeros((0, 64), dtype=bool)      # (K, 64)
+        self.const_bits = np.zeros((0, 64), dtype=np.uint8)  # (K, 64)
+        self.flip_rate = np.zeros((0, 64), dtype=np.float32) # (K, 64)
+
+    @property
+    def is_fitted(self) -> bool:
+        return len(self.vocab) > 0
+
+    @staticmethod
+    def _segments(idx: np.ndarray):
+        """按ID稳定排序，返回 (排序下标, 各段起点, 各段ID)"""
+        order = np.argsort(idx, kind="stable")
+        si = idx[order]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(si)) + 1))
+        return order, starts, si[starts]
+
+    @staticmethod
+    def _flip_stats(bits: np.ndarray, order: np.ndarray, starts: np.ndarray):
+        """同一ID相邻帧间逐比特翻转次数与帧对数（按段聚合）"""
+        sb = bits[order]
+        flips = np.zeros_like(sb)
+        # 第 r 行记录第 r 与 r+1 帧的翻转，段尾行与下一段无关，置零
+        flips[:-1] = sb[1:] != sb[:-1]
+        flips[starts[1:] - 1] = 0
+        counts = np.diff(np.append(starts, len(sb)))
+        return np.add.reduceat(flips, starts, axis=0, dtype=np.float64), counts - 1
+
+    def fit(self, batch: PacketBatch):
+        pos = batch.can_indices()
+        ids = batch.can_ids[pos]
+        valid = (ids >= 0) & (ids < CAN_STD_ID_SPACE)
+        pos, ids = pos[valid], ids[valid]
+        if len(ids) == 0:
+            return
+
+        uniq, counts = np.unique(ids, return_counts=True)
+        vocab = uniq[counts >= self.min_samples].astype(np.int32)
+        if len(vocab) == 0:
+            return
+        id_index = np.full(CAN_STD_ID_SPACE, -1, dtype=np.int32)
+        id_index[vocab] = np.arange(len(vocab), dtype=np.int32)
+        idx = id_index[ids]
+        keep = idx >= 0
+        pos, idx = pos[keep], idx[keep]
+
+        # vocab 已排序，各段ID恰为 0..K-1
+        order, starts, _ = self._segments(idx)
+        payload = batch.payload[pos]
+        bits = np.unpackbits(payload, axis=1)
+        sp, sbits = payload[order], bits[order]
+
+        byte_min = np.minimum.reduceat(sp, starts, axis=0)
+        byte_max = np.maximum.reduceat(sp, starts, axis=0)
+        # 预留取值跨度 5% 的余量，避免训练样本未覆盖边界值造成误报
+        margin = np.ceil((byte_max.astype(np.int16) - byte_min) * 0.05).astype(np.int16)
+        byte_min = np.clip(byte_min - margin, 0, 255).astype(np.uint8)
+        byte_max = np.clip(byte_max + margin, 0, 255).astype(np.uint8)
+
+        seen_one = np.maximum.reduceat(sbits, starts, axis=0).astype(bool)
+        seen_zero = ~np.minimum.reduceat(sbits, starts, axis=0).astype(bool)
+        flips, pairs = self._flip_stats(bits, order, starts)
+
+        self.id_index, self.vocab = id_index, vocab
+        self.dlc = np.maximum.reduceat(batch.dlc[pos][order], starts)
+        self.byte_min, self.byte_max = byte_min, byte_max
+        self.const_mask = ~(seen_one & seen_zero)
+        self.const_bits = seen_one.astype(np.uint8)
+        self.flip_rate = (flips / np.maximum(pairs, 1)[:, None]).astype(np.float32)
+
+    def check(self, batch: PacketBatch) -> List[AnomalyEvent]:
+        if not self.is_fitted:
+            return []
+        pos = batch.can_indices()
+        ids = batch.can_ids[pos]
+        in_range = (ids >= 0) & (ids < CAN_STD_ID_SPACE)
+        pos, ids = pos[in_range], ids[in_range]
+        idx = self.id_index[ids]
+        known = idx >= 0
+        pos, idx = pos[known], idx[known]
+        if len(pos) == 0:
+            return []
+
+        payload = batch.payload[pos]
+        bits = np.unpackbits(payload, axis=1)
+        prof_dlc = self.dlc[idx]
+        byte_valid = np.arange(8) < prof_dlc[:, None]
+        bit_valid = np.repeat(byte_valid, 8, axis=1)
+
+        dlc_bad = batch.dlc[pos] != prof_dlc
+        byte_bad = byte_valid & (
+            (payload < self.byte_min[idx]) | (payload > self.byte_max[idx])
+        )
+        bit_bad = bit_valid & self.const_mask[idx] & (bits != self.const_bits[idx])
+        frame_bad = dlc_bad | byte_bad.any(axis=1) | bit_bad.any(axis=1)
+
+        # 批内翻转率与画像偏离较大的比特（需要足够的帧对）
+        order, starts, seg_ids = self._segments(idx)
+        flips, pairs = self._flip_stats(bits, order, starts)
+        observed = flips / np.maximum(pairs, 1)[:, None]
+        bit_valid_k = np.repeat(np.arange(8) < self.dlc[seg_ids, None], 8, axis=1)
+        flip_bad = (
+            (pairs >= self.FLIP_MIN_PAIRS)[:, None] & bit_valid_k
+            & ~self.const_mask[seg_ids]
+            & (np.abs(observed - self.flip_rate[seg_ids]) > self.flip_tolerance)
+        )
+        flip_bad_by_id = dict(zip(seg_ids.tolist(), flip_bad))
+
+        alerts = []
+        flagged_ids = np.concatenate((idx[frame_bad], seg_ids[flip_bad.any(axis=1)]))
+        for j in np.unique(flagged_ids):
+            rows = np.flatnonzero(idx == j)
+            bad_rows = rows[frame_bad[rows]]
+            first = bad_rows[0] if len(bad_rows) else rows[0]
+            p = batch.packets[pos[first]]
+            bad_bytes = np.flatnonzero(byte_bad[bad_rows].any(axis=0)).tolist()
+            bad_bits = np.flatnonzero(bit_bad[bad_rows].any(axis=0)).tolist()
+            drift_bits = np.flatnonzero(flip_bad_by_id[int(j)]).tolist()
+
+            parts = []
+            if dlc_bad[bad_rows].any():
+                parts.append(f"DLC 与画像({int(self.dlc[j])})不符")
+            if bad_bytes:
+                parts.append(f"字节 {bad_bytes} 超出学习范围")
+            if bad_bits:
+                parts.append(f"常量位 {bad_bits[:16]} 被改变")
+            if drift_bits:
+                parts.append(f"比特 {drift_bits[:16]} 翻转率偏离画像")
+
+            if bad_bits or dlc_bad[bad_rows].any():
+                severity, confidence = "high", 0.85
+            elif bad_bytes:
+                severity, confidence = "medium", 0.7
+            else:
+                severity, confidence = "low", 0.5
+            alerts.append(AnomalyEvent(
+                timestamp=p.timestamp,
+                anomaly_type="payload_profile_anomaly",
+                severity=severity,
+                confidence=confidence,
+                protocol="CAN",
+                source_node=p.source,
+                target_node=p.msg_id,
+                description=f"报文 {p.msg_id} 负载偏离画像: " + "; ".join(parts)
+                            + f" (本批异常帧 {len(bad_rows)}/{len(rows)})",
+                detection_method="payload_profile",
+            ))
+        return alerts
+
+
 class IsolationForestDetector:
-    """基于Isolation Forest的无监督异常检测"""
+    """基于Isolation Forest的无监督异常检测
+
+    模型在最近的正常特征窗口上周期性重建：窗口为定长环形缓冲区，
+    每批只追加本模型与其他检测器均未告警的帧，并维护窗口特征的累计和；
+    后台任务以累计和 O(1) 计算漂移，超过阈值时在窗口快照上训练新模型并原子替换。
+    窗口只在检测所在线程读写：retrain_snapshot 与 swap 须与 predict 在同一线程调用，
+    只有纯函数 build 可以放到其他线程执行。
+    """
 
     def __init__(self):
+        cfg = settings.detector
+        # (model, ref_mean, ref_std)，整体替换以保证读取方看到一致的模型
+        self._fitted: Optional[Tuple[object, np.ndarray, np.ndarray]] = None
+        self.window_size = max(1, cfg.retrain_window)
+        self._window: Optional[np.ndarray] = None  # (window_size, 特征数)，首次追加时分配
+        self._window_sum: Optional[np.ndarray] = None
+        self._window_pos = 0
+        self.window_count = 0
+        self.generation = 0
+        self.trained_at = 0.0
+
+    @property
+    def is_fitted(self) -> bool:
+        return self._fitted is not None
+
+    @property
+    def model(self):
+        return self._fitted[0] if self._fitted else None
+
+    @staticmethod
+    def build(features: np.ndarray):
+        """在特征矩阵上训练新模型，返回可整体替换的模型状态"""
         from sklearn.ensemble import IsolationForest
-        self.model = IsolationForest(
+        model = IsolationForest(
             contamination=settings.detector.iforest_contamination,
             random_state=42,
             n_estimators=100,
         )
-        self.is_fitted = False
+        model.fit(features)
+        return model, features.mean(axis=0), features.std(axis=0)
 
-    def extract_features(self, packets: List[UnifiedPacket]) -> np.ndarray:
-        """从报文列表提取数值特征向量"""
-        if not packets:
-            return np.array([]).reshape(0, 5)
+    def swap(self, fitted) -> None:
+        self._fitted = fitted
+        self.generation += 1
+        self.trained_at = time.time()
 
-        features = []
-        for p in packets:
-            try:
-                if "." not in p.msg_id and p.msg_id.startswith("0x"):
-                    msg_id_num = int(p.msg_id, 16)
-                else:
-                    msg_id_num = hash(p.msg_id) % 0xFFF
-            except ValueError:
-                msg_id_num = hash(p.msg_id) % 0xFFF
-            payload_len = len(p.payload_hex) // 2 if p.payload_hex else 0
-            payload_entropy = self._byte_entropy(p.payload_hex)
-            proto_num = {"CAN": 0, "ETH": 1, "V2X": 2}.get(p.protocol, 3)
-            domain_num = {
-                "powertrain": 0, "chassis": 1,
-                "body": 2, "infotainment": 3, "v2x": 4,
-            }.get(p.domain, 5)
-            features.append([
-                msg_id_num, payload_len, payload_entropy,
-                proto_num, domain_num,
-            ])
-        return np.array(features)
+    def _append(self, rows: np.ndarray) -> None:
+        """追加到环形窗口，被覆盖的旧行从累计和中扣除"""
+        if not len(rows):
+            return
+        if self._window is None:
+            self._window = np.zeros((self.window_size, rows.shape[1]), dtype=np.float64)
+            self._window_sum = np.zeros(rows.shape[1], dtype=np.float64)
+        rows = rows[-self.window_size:]
+        index = (self._window_pos + np.arange(len(rows))) % self.window_size
+        # 未写入的槽位为 0，扣除不影响累计和
+        self._window_sum += rows.sum(axis=0) - self._window[index].sum(axis=0)
+        self._window[index] = rows
+        self._window_pos = int(index[-1] + 1) % self.window_size
+        self.window_count = min(self.window_size, self.window_count + len(rows))
 
-    @staticmethod
-    def _byte_entropy(hex_str: str) -> float:
-        if not hex_str or len(hex_str) < 2:
-            return 0.0
-        byte_vals = [int(hex_str[i:i+2], 16) for i in range(0, len(hex_str), 2)]
-        counts = Counter(byte_vals)
-        total = len(byte_vals)
-        entropy = 0.0
-        for c in counts.values():
-            p = c / total
-            if p > 0:
-                entropy -= p * np.log2(p)
-        return entropy
-
-    def fit(self, normal_packets: List[UnifiedPacket]):
-        """用正常流量训练模型"""
-        features = self.extract_features(normal_packets)
+    def window_snapshot(self) -> np.ndarray:
+        if self._window is None:
+            return np.zeros((0, 0), dtype=np.float64)
+        return self._window[:self.window_count].copy()
+
+    def fit(self, batch: PacketBatch):
+        """用正常流量训练模型，并以其作为初始基线窗口"""
+        features = batch.features()
         if len(features) > 0:
-            self.model.fit(features)
-            self.is_fitted = True
+            self._append(features)
+            self.swap(self.build(features))
 
-    def predict(self, packets: List[UnifiedPacket]) -> List[AnomalyEvent]:
-        """检测异常报文"""
-        if not self.is_fitted or not packets:
+    def drift_score(self) -> float:
+        """窗口特征均值相对训练基线的最大标准化偏移"""
+        fitted = self._fitted
+        if fitted is None or not self.window_count:
+            return 0.0
+        _, ref_mean, ref_std = fitted
+        current = self._window_sum / self.window_count
+        shift = np.abs(current - ref_mean) / (ref_std + 1e-6)
+        return float(shift.max())
+
+    def retrain_snapshot(self) -> Optional[np.ndarray]:
+        """漂移超过阈值且窗口样本充足时返回用于重建的窗口快照，否则返回 None"""
+        cfg = settings.detector
+        if self.window_count < cfg.retrain_min_samples:
+            return None
+        if self.is_fitted and self.drift_score() < cfg.drift_threshold:
+            return None
+        snapshot = self.window_snapshot()
+        self._window_sum = snapshot.sum(axis=0)  # 顺带校正累计和的浮点误差
+        return snapshot
+
+    def maybe_retrain(self) -> bool:
+        """在当前线程内完成漂移检查与重建，返回是否已替换"""
+        snapshot = self.retrain_snapshot()
+        if snapshot is None:
+            return False
+        self.swap(self.build(snapshot))
+        return True
+
+    def predict(self, batch: PacketBatch,
+                flagged: Optional[np.ndarray] = None) -> List[AnomalyEvent]:
+        """检测异常报文；本模型与其他检测器（flagged 为 True 的行）均未告警的帧并入基线窗口"""
+        fitted = self._fitted
+        if fitted is None or not len(batch):
             return []
+        model = fitted[0]
+        packets = batch.packets
 
-        features = self.extract_features(packets)
-        scores = self.model.decision_function(features)
-        preds = self.model.predict(features)
+        features = batch.features()
+        # decision_function < 0 即 predict == -1，只需计算一次
+        scores = model.decision_function(features)
+        is_anomaly = scores < 0
+        learn = ~is_anomaly if flagged is None else ~(is_anomaly | flagged)
+        self._append(features[learn])
 
         alerts = []
-        for i, (pred, score) in enumerate(zip(preds, scores)):
-            if pred == -1:
-                p = packets[i]
-                if score < -0.05:
-                    ml_severity = "critical"
-                elif score < -0.03:
-                    ml_severity = "high"
-                elif score < -0.02:
-                    ml_severity = "medium"
-                else:
-                    ml_severity = "low"
-                alerts.append(AnomalyEvent(
-                    timestamp=p.timestamp,
-                    anomaly_type="ml_anomaly",
-                    severity=ml_severity,
-                    confidence=round(min(abs(score), 1.0), 3),
-                    protocol=p.protocol,
-                    source_node=p.source,
-                    target_node=p.msg_id,
-                    description=(
-                        f"ML模型检测到异常: {p.protocol} "
-                        f"报文 {p.msg_id}, 异常分数 {score:.3f}"
-                    ),
-                    detection_method="isolation_forest",
-                ))
+        for i in np.flatnonzero(is_anomaly):
+            score = scores[i]
+            p = packets[i]
+            if score < -0.05:
+                ml_severity = "critical"
+            elif score < -0.03:
+                ml_severity = "high"
+            elif score < -0.02:
+                ml_severity = "medium"
+            else:
+                ml_severity = "low"
+            alerts.append(AnomalyEvent(
+                timestamp=p.timestamp,
+                anomaly_type="ml_anomaly",
+                severity=ml_severity,
+                confidence=round(min(abs(score), 1.0), 3),
+                protocol=p.protocol,
+                source_node=p.source,
+                target_node=p.msg_id,
+                description=(
+                    f"ML模型检测到异常: {p.protocol} "
+                    f"报文 {p.msg_id}, 异常分数 {score:.3f}"
+                ),
+                detection_method="isolation_forest",
+            ))
         return alerts
 
 
 class AnomalyDetectorService:
     """统一异常检测入口"""
 
+    # 持久化状态版本：检测器增删属性时递增，版本不符的状态文件在恢复时丢弃
+    STATE_VERSION = 2
+
     def __init__(self):
+        self.state_version = self.STATE_VERSION
         self.rule_detector = RuleBasedDetector()
+        self.someip_detector = SomeIpServiceDetector()
+        self.v2x_detector = V2XPlausibilityDetector()
+        self.sequence_detector = CANSequenceDetector()
+        self.payload_detector = PayloadProfileDetector()
         self.ml_detector = IsolationForestDetector()
 
-    def train(self, normal_packets: List[UnifiedPacket]):
-        """用正常流量训练ML模型"""
-        self.ml_detector.fit(normal_packets)
+    def train(self, normal_packets: List[UnifiedPacket], batch: Optional[PacketBatch] = None):
+        """用正常流量训练学习型检测器"""
+        if batch is None:
+            batch = PacketBatch.from_packets(normal_packets)
+        self.someip_detector.fit(normal_packets)
+        self.sequence_detector.fit(batch)
+        self.payload_detector.fit(batch)
+        self.ml_detector.fit(batch)
 
-    def detect(self, packets: List[UnifiedPacket]) -> List[AnomalyEvent]:
-        """执行两级检测"""
+    def maintain(self) -> bool:
+        """后台维护：特征漂移超过阈值时重建ML模型"""
+        if not settings.detector.ml_enabled:
+            return False
+        return self.ml_detector.maybe_retrain()
+
+    def retrain_snapshot(self) -> Optional[np.ndarray]:
+        """需要重建ML模型时返回窗口快照（由调用方在其他线程 build 后 swap 回来）"""
+        if not settings.detector.ml_enabled:
+            return None
+        return self.ml_detector.retrain_snapshot()
+
+    @staticmethod
+    def _flagged(packets: List[UnifiedPacket], alerts: List[AnomalyEvent]) -> np.ndarray:
+        """已被规则类检测器告警的帧，不并入ML基线窗口
+
+        告警以报文ID为粒度：同一协议下告警涉及的报文ID本批全部视为已告警；
+        白名单之外的CAN ID（含汇总告警中未逐个列出的ID）同样视为已告警。
+        """
+        keys = {(a.protocol, node) for a in alerts for node in (a.source_node, a.target_node) if node}
+        check_ids = settings.detector.rule_enabled
+        valid = RuleBasedDetector.VALID_CAN_IDS
+        return np.fromiter(
+            ((p.protocol, p.msg_id) in keys
+             or (check_ids and p.protocol == "CAN" and p.msg_id not in valid)
+             for p in packets),
+            dtype=bool, count=len(packets),
+        )
+
+    def detect(self, packets: List[UnifiedPacket],
+               batch: Optional[PacketBatch] = None) -> List[AnomalyEvent]:
+        """执行两级检测；batch 为与 packets 对应的列式批次（检测读取路径直接构造）"""
         alerts = []
+        if batch is None:
+            batch = PacketBatch.from_packets(packets)
 
         if settings.detector.rule_enabled:
             alerts.extend(self.rule_detector.check(packets))
 
+        if settings.detector.someip_enabled:
+            alerts.extend(self.someip_detector.check(packets))
+
+        if settings.detector.v2x_enabled:
+            alerts.extend(self.v2x_detector.check(packets))
+
+        if settings.detector.sequence_enabled:
+            alerts.extend(self.sequence_detector.check(batch))
+
+        if settings.detector.payload_profile_enabled:
+            alerts.extend(self.payload_detector.check(batch))
+
         if settings.detector.ml_enabled and self.ml_detector.is_fitted:
-            alerts.extend(self.ml_detector.predict(packets))
+            flagged = self._flagged(packets, alerts)
+            alerts.extend(self.ml_detector.predict(batch, flagged))
 
         # 按置信度降序排列
         alerts.sort(key=lambda a: a.confidence, reverse=True)
@@ -0,0 +1,452 @@
+"""压缩冷归档
+
+定期将超过保留时长且已完成检测的报文移出 packets 表，按时间排序写入
+列式块文件，并在 archive_blocks 表中登记块的时间范围、ID范围、帧数和
+出现的报文ID。读取时按索引只打开时间范围匹配的块，以 mmap 方式解压。
+
+块文件格式：
+    MAGIC(8) | 头部长度 uint32 | 头部 JSON | 各列压缩数据
+
+每列独立压缩（优先 zstd，未安装 zstandard 时回退 zlib）；定长数值列压缩前
+按字节重排（同一字节位的数据相邻），变长列拆分为偏移数组与数据区两列。
+"""
+
+import asyncio
+import json
+import logging
+import mmap
+import struct
+import time
+import zlib
+from collections import namedtuple
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import async_session
+from app.models.packet import ArchiveBlockORM, PacketORM
+from app.services.detection_pipeline import get_cursor
+from app.services.packet_store import PACKET_COLUMNS
+from app.services.response_cache import GEN_PACKETS, response_cache
+
+logger = logging.getLogger("gatewayguard.archive")
+
+MAGIC = b"GGARCH01"
+_HEADER_LEN = struct.Struct("<I")
+
+# 定长列：(列名, NumPy 类型)，空值以 -1 表示
+NUMERIC_COLUMNS = [
+    ("id", "<i8"),
+    ("timestamp", "<f8"),
+    ("vehicle_code", "<i4"),
+    ("protocol_code", "<i2"),
+    ("source_code", "<i4"),
+    ("destination_code", "<i4"),
+    ("msg_code", "<i4"),
+    ("domain_code", "<i2"),
+    ("profile_id", "<i4"),
+]
+VARLEN_COLUMNS = ["payload", "payload_extra"]
+
+# 与 packets 表查询结果同名的只读行，可直接交给 packet_store 还原
+ArchivedRow = namedtuple("ArchivedRow", [c.name for c in PACKET_COLUMNS])
+
+# SQLite 单条语句的绑定参数上限较低，按批删除
+_DELETE_BATCH = 500
+
+
+def available_codec() -> str:
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return "zlib"
+    return "zstd"
+
+
+def _compress(data: bytes, codec: str, level: int) -> bytes:
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, min(max(level, 1), 9))
+
+
+def _decompress(data, codec: str, raw_length: int) -> bytes:
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=raw_length)
+    return zlib.decompress(data)
+
+
+def _shuffle(arr: np.ndarray) -> bytes:
+    """字节重排：(N, itemsize) 转置为 (itemsize, N)"""
+    return arr.view(np.uint8).reshape(-1, arr.dtype.itemsize).T.tobytes()
+
+
+def _unshuffle(raw: bytes, dtype: str) -> np.ndarray:
+    dt = np.dtype(dtype)
+    planes = np.frombuffer(raw, dtype=np.uint8).reshape(dt.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dt).ravel()
+
+
+def write_block(path: Path, rows, codec: str, level: int) -> int:
+    """将按时间排序的报文行写为块文件，返回文件字节数"""
+    n = len(rows)
+    columns = []
+    blobs = []
+    offset = 0
+
+    def add(name, raw: bytes, dtype: Optional[str]):
+        nonlocal offset
+        comp = _compress(raw, codec, level)
+        columns.append({
+            "name": name, "dtype": dtype, "offset": offset,
+            "length": len(comp), "raw_length": len(raw),
+        })
+        blobs.append(comp)
+        offset += len(comp)
+
+    for name, dtype in NUMERIC_COLUMNS:
+        values = np.fromiter(
+            (-1 if getattr(r, name) is None else getattr(r, name) for r in rows),
+            dtype=dtype, count=n,
+        )
+        add(name, _shuffle(values), dtype)
+
+    for name in VARLEN_COLUMNS:
+        items = []
+        for r in rows:
+            value = getattr(r, name)
+            if value is None:
+                value = b""
+            elif isinstance(value, str):
+                value = value.encode("utf-8")
+            items.append(value)
+        offsets = np.zeros(n + 1, dtype="<u4")
+        np.cumsum([len(v) for v in items], out=offsets[1:])
+        add(f"{name}.offsets", _shuffle(offsets), "<u4")
+        add(f"{name}.data", b"".join(items), None)
+
+    header = json.dumps({"codec": codec, "rows": n, "columns": columns}).encode("utf-8")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    tmp.replace(path)
+    return path.stat().st_size
+
+
+def read_block(
+    path: Path,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    vehicle_code: Optional[int] = None,
+    protocol_code: Optional[int] = None,
+    msg_code: Optional[int] = None,
+) -> List[ArchivedRow]:
+    """以 mmap 打开块文件，先按时间/车辆/协议/报文ID列筛选，再只解压命中的行"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"不是有效的归档块文件: {path}")
+        (header_len,) = _HEADER_LEN.unpack_from(mm, len(MAGIC))
+        base = len(MAGIC) + _HEADER_LEN.size
+        header = json.loads(mm[base:base + header_len])
+        base += header_len
+        codec, n = header["codec"], header["rows"]
+        specs = {c["name"]: c for c in header["columns"]}
+
+        view = memoryview(mm)
+        try:
+            def raw(name):
+                c = specs[name]
+                begin = base + c["offset"]
+                return _decompress(view[begin:begin + c["length"]], codec, c["raw_length"])
+
+            def numeric(name):
+                return _unshuffle(raw(name), specs[name]["dtype"])
+
+            cols = {"timestamp": numeric("timestamp")}
+            mask = np.ones(n, dtype=bool)
+            if start is not None:
+                mask &= cols["timestamp"] >= start
+            if end is not None:
+                mask &= cols["timestamp"] < end
+            filters = (
+                ("vehicle_code", vehicle_code), ("protocol_code", protocol_code),
+                ("msg_code", msg_code),
+            )
+            for name, code in filters:
+                if code is not None and mask.any():
+                    cols[name] = numeric(name)
+                    mask &= cols[name] == code
+            idx = np.flatnonzero(mask)
+            if len(idx) == 0:
+                return []
+
+            for name, _ in NUMERIC_COLUMNS:
+                if name not in cols:
+                    cols[name] = numeric(name)
+            varlen = {}
+            for name in VARLEN_COLUMNS:
+                offsets = numeric(f"{name}.offsets")
+                varlen[name] = (offsets, raw(f"{name}.data"))
+        finally:
+            view.release()
+
+    picked = {name: cols[name][idx].tolist() for name, _ in NUMERIC_COLUMNS}
+    payload_off, payload_data = varlen["payload"]
+    extra_off, extra_data = varlen["payload_extra"]
+    rows = []
+    for k, i in enumerate(idx):
+        extra = extra_data[extra_off[i]:extra_off[i + 1]]
+        source, destination = picked["source_code"][k], picked["destination_code"][k]
+        profile = picked["profile_id"][k]
+        rows.append(ArchivedRow(
+            id=picked["id"][k],
+            timestamp=picked["timestamp"][k],
+            vehicle_code=picked["vehicle_code"][k],
+            protocol_code=picked["protocol_code"][k],
+            source_code=None if source < 0 else source,
+            destination_code=None if destination < 0 else destination,
+            msg_code=picked["msg_code"][k],
+            domain_code=picked["domain_code"][k],
+            payload=payload_data[payload_off[i]:payload_off[i + 1]],
+            payload_extra=extra.decode("utf-8") if extra else None,
+            profile_id=None if profile < 0 else profile,
+        ))
+    return rows
+
+
+def _block_counts(rows) -> Tuple[Dict[str, Dict[str, int]], List[int]]:
+    counts: Dict[str, Dict[str, int]] = {}
+    msg_codes = set()
+    for r in rows:
+        per_vehicle = counts.setdefault(str(r.vehicle_code), {})
+        key = str(r.protocol_code)
+        per_vehicle[key] = per_vehicle.get(key, 0) + 1
+        msg_codes.add(r.msg_code)
+    return counts, sorted(msg_codes)
+
+
+class PacketArchive:
+    """冷归档：写入块文件、维护索引、透明读取归档区间"""
+
+    def __init__(self):
+        cfg = settings.archive
+        self.dir = Path(cfg.archive_dir)
+        self.max_age = cfg.max_age
+        self.interval = cfg.interval
+        self.block_rows = cfg.block_rows
+        self.max_blocks_per_run = cfg.max_blocks_per_run
+        self.level = cfg.compression_level
+        self._lock = asyncio.Lock()
+
+        self.runs = 0
+        self.blocks_written = 0
+        self.rows_archived = 0
+        self.bytes_written = 0
+        self.last_run_at = 0.0
+
+    def _path(self, block: ArchiveBlockORM) -> Path:
+        return self.dir / block.path
+
+    async def archive_once(self) -> dict:
+        """将超过保留时长且已检测的报文写入块文件，返回本轮写入统计"""
+        codec = available_codec()
+        blocks = rows_moved = 0
+        async with self._lock:
+            cutoff = time.time() - self.max_age
+            while blocks < self.max_blocks_per_run:
+                async with async_session() as db:
+                    cursor = await get_cursor(db)
+                    # 未检测的报文留在表中，避免归档后漏检
+                    rows = (await db.execute(
+                        select(*PACKET_COLUMNS)
+                        .where(PacketORM.timestamp < cutoff)
+                        .where(PacketORM.id <= (cursor.last_packet_id or 0))
+                        .order_by(PacketORM.timestamp)
+                        .limit(self.block_rows)
+                    )).all()
+                    if not rows:
+                        break
+
+                    name = f"blk_{int(rows[0].timestamp * 1000)}_{rows[0].id}_{len(rows)}.gga"
+                    # 先落盘再删除源数据，中途失败最多留下未登记的孤立文件
+                    size = await asyncio.to_thread(
+                        write_block, self.dir / name, rows, codec, self.level,
+                    )
+                    counts, msg_codes = _block_counts(rows)
+                    ids = [r.id for r in rows]
+                    db.add(ArchiveBlockORM(
+                        path=name,
+                        ts_min=rows[0].timestamp,
+                        ts_max=rows[-1].timestamp,
+                        id_min=min(ids),
+                        id_max=max(ids),
+                        row_count=len(rows),
+                        size_bytes=size,
+                        codec=codec,
+                        counts_json=json.dumps(counts),
+                        msg_codes_json=json.dumps(msg_codes),
+                    ))
+                    for i in range(0, len(ids), _DELETE_BATCH):
+                        await db.execute(
+                            delete(PacketORM).where(PacketORM.id.in_(ids[i:i + _DELETE_BATCH]))
+                        )
+                    await db.commit()
+                    response_cache.bump(GEN_PACKETS)
+
+                blocks += 1
+                rows_moved += len(rows)
+                self.bytes_written += size
+                if len(rows) < self.block_rows:
+                    break
+
+            self.runs += 1
+            self.blocks_written += blocks
+            self.rows_archived += rows_moved
+            self.last_run_at = time.time()
+        return {"blocks": blocks, "rows": rows_moved}
+
+    async def run_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.archive_once()
+            except Exception:
+                logger.exception("冷归档失败")
+
+    async def blocks(
+        self,
+        db: AsyncSession,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        vehicle_code: Optional[int] = None,
+        newest_first: bool = False,
+        msg_code: Optional[int] = None,
+    ) -> List[ArchiveBlockORM]:
+        """按索引筛选与时间范围重叠、且包含指定车辆与报文ID的块"""
+        stmt = select(ArchiveBlockORM)
+        if start is not None:
+            stmt = stmt.where(ArchiveBlockORM.ts_max >= start)
+        if end is not None:
+            stmt = stmt.where(ArchiveBlockORM.ts_min < end)
+        if newest_first:
+            stmt = stmt.order_by(ArchiveBlockORM.ts_max.desc())
+        else:
+            stmt = stmt.order_by(ArchiveBlockORM.ts_min)
+        blocks = (await db.execute(stmt)).scalars().all()
+        if vehicle_code is not None:
+            key = str(vehicle_code)
+            blocks = [b for b in blocks if key in json.loads(b.counts_json)]
+        if msg_code is not None:
+            blocks = [b for b in blocks if msg_code in json.loads(b.msg_codes_json)]
+        return blocks
+
+    async def read_rows(
+        self,
+        block: ArchiveBlockORM,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        vehicle_code: Optional[int] = None,
+        protocol_code: Optional[int] = None,
+        msg_code: Optional[int] = None,
+    ) -> List[ArchivedRow]:
+        """在后台线程读取单个块中符合条件的行，不访问数据库"""
+        return await asyncio.to_thread(
+            read_block, self._path(block), start, end, vehicle_code, protocol_code, msg_code,
+        )
+
+    async def iter_rows(
+        self,
+        db: AsyncSession,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        vehicle_code: Optional[int] = None,
+        protocol_code: Optional[int] = None,
+        newest_first: bool = False,
+        msg_code: Optional[int] = None,
+    ) -> AsyncIterator[List[ArchivedRow]]:
+        """逐块产出归档行（块内按时间排序，newest_first 时倒序）
+
+        按报文ID查询时先由块索引的 msg_codes_json 跳过不含该ID的块，不打开块文件。
+        """
+        for block in await self.blocks(db, start, end, vehicle_code, newest_first, msg_code):
+            rows = await self.read_rows(block, start, end, vehicle_code, protocol_code, msg_code)
+            if newest_first:
+                rows.reverse()
+            if rows:
+                yield rows
+
+    async def fetch_recent(
+        self,
+        db: AsyncSession,
+        skip: int,
+        limit: int,
+        vehicle_code: Optional[int] = None,
+        protocol_code: Optional[int] = None,
+        msg_code: Optional[int] = None,
+    ) -> List[ArchivedRow]:
+        """按时间倒序分页读取归档行（接在 packets 表的分页结果之后）"""
+        result: List[ArchivedRow] = []
+        async for rows in self.iter_rows(
+            db, vehicle_code=vehicle_code, protocol_code=protocol_code, newest_first=True,
+            msg_code=msg_code,
+        ):
+            if skip >= len(rows):
+                skip -= len(rows)
+                continue
+            result.extend(rows[skip:skip + limit - len(result)])
+            skip = 0
+            if len(result) >= limit:
+                break
+        return result
+
+    async def summary(self, db: AsyncSession, vehicle_code: Optional[int] = None) -> dict:
+        """由索引汇总归档帧数（按协议编码）与时间范围，不打开块文件"""
+        by_protocol: Dict[int, int] = {}
+        ts_min = ts_max = None
+        for block in await self.blocks(db, vehicle_code=vehicle_code):
+            counts = json.loads(block.counts_json)
+            vehicles = [str(vehicle_code)] if vehicle_code is not None else list(counts)
+            for v in vehicles:
+                for code, n in counts.get(v, {}).items():
+                    by_protocol[int(code)] = by_protocol.get(int(code), 0) + n
+            ts_min = block.ts_min if ts_min is None else min(ts_min, block.ts_min)
+            ts_max = block.ts_max if ts_max is None else max(ts_max, block.ts_max)
+        return {"by_protocol": by_protocol, "ts_min": ts_min, "ts_max": ts_max}
+
+    async def clear(self, db: AsyncSession) -> List[Path]:
+        """删除全部块索引，返回待删除的块文件路径
+
+        文件须在调用方提交后再由 remove_files 删除：提交失败时索引仍指向完好的文件。
+        """
+        blocks = (await db.execute(select(ArchiveBlockORM))).scalars().all()
+        await db.execute(delete(ArchiveBlockORM))
+        return [self._path(block) for block in blocks]
+
+    @staticmethod
+    def remove_files(paths: List[Path]) -> None:
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.archive.enabled,
+            "codec": available_codec(),
+            "runs": self.runs,
+            "blocks_written": self.blocks_written,
+            "rows_archived": self.rows_archived,
+            "bytes_written": self.bytes_written,
+            "last_run_at": self.last_run_at or None,
+        }
+
+
+packet_archive = PacketArchive()
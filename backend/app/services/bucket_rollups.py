@@ -0,0 +1,218 @@
+"""多分辨率时间桶汇总
+
+报文与告警在写后队列的同一事务中累加到 rollup_buckets 表（1 秒 / 1 分钟 / 1 小时三档），
+图表类查询按桶宽选取能整除它的最粗一档，在库内按桶宽重新分组，不扫描 packets 表：
+- 维度：protocol、msg_id、source（报文）与 severity（告警），取值以 string_dict 编码存储
+- 同一批次先用 NumPy 按 (桶, 取值, 车辆) 计数，再以 UPSERT 累加，每档每组合只写一行
+- 各档按 rollup.*_retention 定期清理；冷归档与按条件清理不回改已有的桶
+"""
+
+import math
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.anomaly import AnomalyEventORM
+from app.models.rollup import RollupBucketORM
+from app.services.packet_store import KIND_SEVERITY, KIND_VEHICLE, packet_store
+
+RESOLUTIONS = (1, 60, 3600)
+PRUNE_INTERVAL = 60.0  # 清理过期桶的最小间隔（秒）
+
+# 报文维度 -> encode_packets 行中的编码列
+PACKET_DIMENSIONS = {"protocol": "protocol_code", "msg_id": "msg_code", "source": "source_code"}
+DIMENSIONS = (*PACKET_DIMENSIONS, "severity")
+
+
+def _upsert(db: AsyncSession):
+    """按方言构造 INSERT ... ON CONFLICT DO UPDATE count = count + excluded.count"""
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(RollupBucketORM)
+    return stmt.on_conflict_do_update(
+        index_elements=[c.name for c in RollupBucketORM.__table__.primary_key],
+        set_={"count": RollupBucketORM.count + stmt.excluded["count"]},
+    )
+
+
+def _bucket_rows(dimension: str, ts: np.ndarray, keys: np.ndarray,
+                 vehicles: np.ndarray) -> List[dict]:
+    """按三档桶宽统计 (桶, 取值, 车辆) 的出现次数"""
+    rows = []
+    for resolution in RESOLUTIONS:
+        buckets = (ts // resolution).astype(np.int64) * resolution
+        uniq, counts = np.unique(
+            np.column_stack((buckets, keys, vehicles)), axis=0, return_counts=True,
+        )
+        rows.extend(
+            {"resolution": resolution, "dimension": dimension, "bucket": b,
+             "key_code": k, "vehicle_code": v, "count": c}
+            for (b, k, v), c in zip(uniq.tolist(), counts.tolist())
+        )
+    return rows
+
+
+class BucketRollups:
+    """rollup_buckets 表的累加、清理与查询"""
+
+    def __init__(self):
+        cfg = settings.rollup
+        self.retention = {
+            1: cfg.second_retention, 60: cfg.minute_retention, 3600: cfg.hour_retention,
+        }
+        self.max_buckets = cfg.max_buckets
+        self._last_prune = 0.0
+
+        self.upserted = 0
+        self.queries = 0
+
+    async def add(self, db: AsyncSession, packet_rows: List[dict] = (),
+                  alerts: Iterable[AnomalyEventORM] = ()) -> None:
+        """在写入报文 / 告警的同一事务中累加桶计数（packet_rows 为 encode_packets 的结果）"""
+        rows = []
+        n = len(packet_rows)
+        if n:
+            ts = np.fromiter((r["timestamp"] for r in packet_rows), dtype=np.float64, count=n)
+            vehicles = np.fromiter((r["vehicle_code"] for r in packet_rows), dtype=np.int64, count=n)
+            for dimension, column in PACKET_DIMENSIONS.items():
+                keys = np.fromiter((r[column] for r in packet_rows), dtype=np.int64, count=n)
+                rows.extend(_bucket_rows(dimension, ts, keys, vehicles))
+
+        alerts = list(alerts)
+        if alerts:
+            codes = await packet_store.intern(db, [
+                k for a in alerts
+                for k in ((KIND_SEVERITY, a.severity), (KIND_VEHICLE, a.vehicle_id))
+            ])
+            rows.extend(_bucket_rows(
+                "severity",
+                np.array([a.timestamp for a in alerts], dtype=np.float64),
+                np.array([codes[(KIND_SEVERITY, a.severity)] for a in alerts], dtype=np.int64),
+                np.array([codes[(KIND_VEHICLE, a.vehicle_id)] for a in alerts], dtype=np.int64),
+            ))
+
+        if rows:
+            await db.execute(_upsert(db), rows)
+            self.upserted += len(rows)
+        await self._prune(db)
+
+    async def _prune(self, db: AsyncSession) -> None:
+        now = time.time()
+        if now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        for resolution, keep in self.retention.items():
+            if keep > 0:
+                await db.execute(
+                    delete(RollupBucketORM)
+                    .where(RollupBucketORM.resolution == resolution)
+                    .where(RollupBucketORM.bucket < int(now - keep))
+                )
+
+    async def clear(self, db: AsyncSession) -> int:
+        result = await db.execute(delete(RollupBucketORM))
+        return result.rowcount
+
+    def _retained(self, resolution: int, start: float, now: float) -> bool:
+        keep = self.retention[resolution]
+        return keep <= 0 or start >= now - keep
+
+    def resolution_for(self, width: int, start: Optional[float] = None) -> Optional[int]:
+        """能整除桶宽、且保留时长覆盖 start 的最粗一档，没有时返回 None"""
+        now = time.time()
+        usable = [
+            r for r in RESOLUTIONS
+            if width % r == 0 and (start is None or self._retained(r, start, now))
+        ]
+        return max(usable) if usable else None
+
+    async def query(self, db: AsyncSession, dimension: str, start: float, end: float,
+                    width: int, vehicle_id: Optional[str] = None, top: int = 10) -> dict:
+        """[start, end) 内按桶宽分组的计数序列；取值按总数取前 top 个，其余合并为 other"""
+        if dimension not in DIMENSIONS:
+            return {"error": f"不支持的维度: {dimension}"}
+        if width < 1 or end <= start:
+            return {"error": "时间范围或桶宽无效"}
+        first = int(start // width) * width
+        last = int(math.ceil(end))
+        count = math.ceil((last - first) / width)
+        if count > self.max_buckets:
+            return {"error": f"桶数 {count} 超过上限 {self.max_buckets}，请增大桶宽或缩小时间范围"}
+
+        resolution = self.resolution_for(width, first)
+        if resolution is None:
+            # 能整除桶宽的各档在 start 处均已被清理，补零返回会被误读为没有流量
+            now = time.time()
+            finest = min((r for r in RESOLUTIONS if self._retained(r, first, now)), default=None)
+            hint = f"请使用 {finest} 秒整数倍的桶宽或缩小时间范围" if finest else "请缩小时间范围"
+            return {"error": f"起始时间早于桶宽 {width} 秒可用汇总的保留时长，{hint}"}
+        self.queries += 1
+
+        ts = (RollupBucketORM.bucket // width * width).label("ts")
+        stmt = (
+            select(ts, RollupBucketORM.key_code, func.sum(RollupBucketORM.count))
+            .where(RollupBucketORM.resolution == resolution)
+            .where(RollupBucketORM.dimension == dimension)
+            .where(RollupBucketORM.bucket >= first)
+            .where(RollupBucketORM.bucket < last)
+            .group_by(ts, RollupBucketORM.key_code)
+        )
+        result = {
+            "dimension": dimension,
+            "bucket": width,
+            "resolution": resolution,
+            "start": first,
+            "end": last,
+            "vehicle_id": vehicle_id,
+        }
+        if vehicle_id:
+            vehicle_code = await packet_store.code_of(db, KIND_VEHICLE, vehicle_id)
+            if vehicle_code is None:
+                return {**result, "keys": [], "totals": {},
+                        "series": self._series(first, width, count, {})}
+            stmt = stmt.where(RollupBucketORM.vehicle_code == vehicle_code)
+        rows = (await db.execute(stmt)).all()
+        await packet_store.ensure_codes(db, {r[1] for r in rows})
+
+        totals: Dict[str, int] = {}
+        for _, code, n in rows:
+            key = packet_store.value(code)
+            totals[key] = totals.get(key, 0) + int(n)
+        keys = sorted(totals, key=totals.get, reverse=True)[:top]
+        shown = set(keys)
+        cells: Dict[int, Dict[str, int]] = {}
+        for bucket, code, n in rows:
+            key = packet_store.value(code)
+            if key not in shown:
+                key = "other"
+            counts = cells.setdefault(int(bucket), {})
+            counts[key] = counts.get(key, 0) + int(n)
+        other = sum(v for k, v in totals.items() if k not in shown)
+        totals = {k: totals[k] for k in keys}
+        if other:
+            keys.append("other")
+            totals["other"] = other
+        return {**result, "keys": keys, "totals": totals,
+                "series": self._series(first, width, count, cells)}
+
+    @staticmethod
+    def _series(first: int, width: int, count: int, cells: Dict[int, Dict[str, int]]) -> List[dict]:
+        """补齐空桶，图表横轴连续"""
+        series = []
+        for i in range(count):
+            t = first + i * width
+            counts = cells.get(t, {})
+            series.append({"ts": t, "counts": counts, "total": sum(counts.values())})
+        return series
+
+    def stats(self) -> dict:
+        return {"upserted_rows": self.upserted, "queries": self.queries}
+
+
+bucket_rollups = BucketRollups()
@@ -0,0 +1,236 @@
+"""对话上下文缓存
+
+每个会话在内存中保存滚动摘要与最近的消息，避免每条消息都从数据库
+重新加载历史：
+- TTL + LRU 淘汰，过期会话在下次访问时由 chat_sessions / chat_history 重建
+- 新消息写穿到 chat_history，摘要写穿到 chat_sessions
+- 历史消息超过 Token 预算时，把较早的消息折叠进滚动摘要（后台执行，
+  不阻塞当前请求），请求的提示长度与会话长度无关
+"""
+
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, List, Optional
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import async_session
+from app.models.report import ChatHistoryORM, ChatSessionORM
+from app.utils.prompt_templates import CHAT_SUMMARY_CONTEXT
+
+logger = logging.getLogger("gatewayguard.chat_context")
+
+_CJK = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+Summarizer = Callable[[str, List[dict], int], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 Token 数：中日韩字符按 1 个计，其余按 4 字符 1 个计"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4 + 4  # 每条消息约 4 个格式开销
+
+
+@dataclass
+class ChatTurn:
+    id: int
+    role: str
+    content: str
+    tokens: int
+
+
+@dataclass
+class ChatContext:
+    session_id: str
+    summary: str = ""
+    summarized_upto: int = 0
+    turns: Deque[ChatTurn] = field(default_factory=deque)
+    expires_at: float = 0.0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    folding: bool = False
+
+    @property
+    def history_tokens(self) -> int:
+        return sum(t.tokens for t in self.turns)
+
+
+def _fallback_summary(summary: str, turns: List[dict], max_chars: int) -> str:
+    """模型不可用时的抽取式摘要：保留每条消息的开头，超长时保留最新部分"""
+    role_names = {"user": "用户", "assistant": "助手"}
+    parts = [summary] if summary else []
+    parts += [f"{role_names.get(t['role'], t['role'])}: {t['content'][:80]}" for t in turns]
+    text = "；".join(parts)
+    return text[-max_chars:]
+
+
+class ChatContextCache:
+    """会话上下文的进程内缓存（TTL + LRU，写穿数据库）"""
+
+    def __init__(self, summarizer: Optional[Summarizer] = None):
+        cfg = settings.chat
+        self.ttl = cfg.context_ttl
+        self.max_sessions = cfg.max_sessions
+        self.history_budget = cfg.history_token_budget
+        self.summary_budget = cfg.summary_token_budget
+        self.min_recent = cfg.min_recent_turns
+        self.summarizer = summarizer
+        self._sessions: "OrderedDict[str, ChatContext]" = OrderedDict()
+        self._tasks = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.folds = 0
+
+    def _evict(self, now: float) -> None:
+        for sid in [s for s, ctx in self._sessions.items() if ctx.expires_at <= now]:
+            del self._sessions[sid]
+            self.evictions += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    async def _load(self, db, session_id: str) -> ChatContext:
+        ctx = ChatContext(session_id=session_id)
+        row = await db.get(ChatSessionORM, session_id)
+        if row is not None:
+            ctx.summary = row.summary or ""
+            ctx.summarized_upto = row.summarized_upto or 0
+        # 只加载尚未折叠的消息，数量受折叠策略约束
+        result = await db.execute(
+            select(ChatHistoryORM.id, ChatHistoryORM.role, ChatHistoryORM.content)
+            .where(ChatHistoryORM.session_id == session_id)
+            .where(ChatHistoryORM.id > ctx.summarized_upto)
+            .order_by(ChatHistoryORM.id)
+        )
+        for hid, role, content in result:
+            ctx.turns.append(ChatTurn(hid, role, content, estimate_tokens(content)))
+        return ctx
+
+    async def get(self, db, session_id: str) -> ChatContext:
+        now = time.monotonic()
+        self._evict(now)
+        ctx = self._sessions.get(session_id)
+        if ctx is not None:
+            self.hits += 1
+            self._sessions.move_to_end(session_id)
+        else:
+            self.misses += 1
+            ctx = await self._load(db, session_id)
+            self._sessions[session_id] = ctx
+        ctx.expires_at = now + self.ttl
+        return ctx
+
+    def build_messages(self, ctx: ChatContext, message: str) -> List[dict]:
+        """摘要 + 预算内的最近消息 + 当前消息（系统提示由 LLMEngine 前置）"""
+        budget = self.history_budget - estimate_tokens(message)
+        recent: List[dict] = []
+        for turn in reversed(ctx.turns):
+            if turn.tokens > budget and len(recent) >= self.min_recent:
+                break
+            budget -= turn.tokens
+            recent.append({"role": turn.role, "content": turn.content})
+        recent.reverse()
+
+        messages = []
+        if ctx.summary:
+            messages.append({
+                "role": "system",
+                "content": CHAT_SUMMARY_CONTEXT.format(summary=ctx.summary),
+            })
+        messages.extend(recent)
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    async def append(self, db, ctx: ChatContext, message: str, resp: dict) -> None:
+        """写穿保存本轮问答，超出预算时调度后台折叠"""
+        user = ChatHistoryORM(session_id=ctx.session_id, role="user", content=message)
+        assistant = ChatHistoryORM(
+            session_id=ctx.session_id, role="assistant", content=resp["content"],
+            tool_calls=json.dumps(resp["tool_calls"]) if resp["tool_calls"] else None,
+        )
+        db.add_all([user, assistant])
+        await db.commit()
+
+        for row in (user, assistant):
+            ctx.turns.append(ChatTurn(row.id, row.role, row.content, estimate_tokens(row.content)))
+
+        if ctx.history_tokens > self.history_budget and not ctx.folding:
+            ctx.folding = True
+            task = asyncio.create_task(self._fold(ctx))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fold(self, ctx: ChatContext) -> None:
+        """将较早的消息折叠进摘要，保留的历史降到预算的一半以下
+
+        只在选取待折叠消息与应用摘要时持有会话锁；模型生成摘要期间不持锁，
+        同一会话的新消息无需等待摘要完成。
+        """
+        try:
+            async with ctx.lock:
+                folded: List[ChatTurn] = []
+                target = self.history_budget // 2
+                remaining = ctx.history_tokens
+                turns = list(ctx.turns)
+                while len(turns) - len(folded) > self.min_recent and remaining > target:
+                    turn = turns[len(folded)]
+                    folded.append(turn)
+                    remaining -= turn.tokens
+                if not folded:
+                    return
+                previous = ctx.summary
+
+            dialogue = [{"role": t.role, "content": t.content} for t in folded]
+            max_chars = self.summary_budget
+            summary = None
+            if self.summarizer is not None:
+                try:
+                    summary = await self.summarizer(previous, dialogue, max_chars)
+                except Exception:
+                    logger.warning("会话 %s 摘要生成失败，使用抽取式摘要", ctx.session_id)
+            if not summary:
+                summary = _fallback_summary(previous, dialogue, max_chars)
+
+            upto = folded[-1].id
+            async with ctx.lock:
+                if ctx.summarized_upto >= upto:
+                    return
+                async with async_session() as db:
+                    row = await db.get(ChatSessionORM, ctx.session_id)
+                    if row is None:
+                        row = ChatSessionORM(session_id=ctx.session_id)
+                        db.add(row)
+                    row.summary = summary
+                    row.summarized_upto = upto
+                    await db.commit()
+
+                ctx.summary = summary
+                ctx.summarized_upto = upto
+                while ctx.turns and ctx.turns[0].id <= upto:
+                    ctx.turns.popleft()
+                self.folds += 1
+        except Exception:
+            logger.exception("会话 %s 折叠失败", ctx.session_id)
+        finally:
+            ctx.folding = False
+
+    def clear(self) -> None:
+        self._sessions.clear()
+
+    def stats(self) -> dict:
+        return {
+            "cached_sessions": len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "folds": self.folds,
+        }
@@ -0,0 +1,177 @@
+"""异常检测流水线
+
+基于高水位游标的增量检测：每次只读取游标之后新到达的报文，
+按块检测并在同一事务中写入告警与新游标，同一报文不会被重复检测。
+告警与游标经写后队列组提交：上一块提交的同时检测下一块，
+提交确认后才发布告警并提交下一块，失败时游标不会越过未落库的告警。
+
+以多 worker 运行时各进程共用同一游标行：检测前以条件 UPDATE 取得游标租约，
+每块检测前续期，全部块落库后释放；租约被其他进程持有时本轮跳过。
+持有进程异常退出后，租约在 scheduler.lease_ttl 秒后到期，由其他进程接管。
+"""
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import List
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+
+from app.models.anomaly import AnomalyEvent, AnomalyEventORM, DetectionCursorORM
+from app.models.packet import PacketORM
+from app.services.live_hub import live_hub
+from app.services.packet_store import PACKET_COLUMNS, _insert_ignore, packet_store
+from app.services.response_cache import GEN_EVENTS, response_cache
+from app.services.vehicle_registry import ShardedDetectorPool
+from app.services.write_behind import write_behind
+
+
+CURSOR_NAME = "default"
+
+# 同一进程内的检测串行执行，避免并发请求读到同一游标
+_detect_lock = asyncio.Lock()
+# 本进程的租约持有者标识
+LEASE_OWNER = f"{socket.gethostname()[:32]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def alert_to_orm(a: AnomalyEvent) -> AnomalyEventORM:
+    return AnomalyEventORM(
+        vehicle_id=a.vehicle_id,
+        timestamp=a.timestamp,
+        anomaly_type=a.anomaly_type,
+        severity=a.severity,
+        confidence=a.confidence,
+        protocol=a.protocol,
+        source_node=a.source_node,
+        target_node=a.target_node,
+        description=a.description,
+        detection_method=a.detection_method,
+        status="open",
+    )
+
+
+async def get_cursor(db: AsyncSession) -> DetectionCursorORM:
+    """读取游标的最新值（游标由写后队列更新，不使用会话中缓存的对象）"""
+    cursor = await db.get(DetectionCursorORM, CURSOR_NAME, populate_existing=True)
+    if cursor is None:
+        # 调度器与检测请求可能同时创建，由主键冲突去重
+        await db.execute(
+            _insert_ignore(db, DetectionCursorORM),
+            [{"name": CURSOR_NAME, "last_packet_id": 0}],
+        )
+        await db.commit()
+        cursor = await db.get(DetectionCursorORM, CURSOR_NAME, populate_existing=True)
+    return cursor
+
+
+async def _claim(db: AsyncSession) -> bool:
+    """取得或续期游标租约：无人持有、已过期或本进程持有时成功"""
+    now = time.time()
+    result = await db.execute(
+        update(DetectionCursorORM)
+        .where(DetectionCursorORM.name == CURSOR_NAME)
+        .where(or_(
+            DetectionCursorORM.lease_owner.is_(None),
+            DetectionCursorORM.lease_owner == LEASE_OWNER,
+            DetectionCursorORM.lease_until < now,
+        ))
+        .values(lease_owner=LEASE_OWNER, lease_until=now + settings.scheduler.lease_ttl)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def _release(db: AsyncSession) -> None:
+    await db.execute(
+        update(DetectionCursorORM)
+        .where(DetectionCursorORM.name == CURSOR_NAME)
+        .where(DetectionCursorORM.lease_owner == LEASE_OWNER)
+        .values(lease_owner=None, lease_until=None)
+    )
+    await db.commit()
+
+
+async def _publish(future, orms: List[AnomalyEventORM]) -> None:
+    """等待告警落库后再使缓存失效并推送（推送需要告警ID）"""
+    await future
+    response_cache.bump(GEN_EVENTS)
+    live_hub.publish_alerts(orms)
+
+
+async def run_detection(
+    db: AsyncSession,
+    pool: ShardedDetectorPool,
+    chunk_size: int,
+    max_chunks: int,
+) -> dict:
+    """从游标处按块检测新报文，返回本次处理统计与告警"""
+    processed = 0
+    chunks = 0
+    alerts: List[AnomalyEvent] = []
+
+    async with _detect_lock:
+        await get_cursor(db)
+        if not await _claim(db):
+            return {"processed": 0, "chunks": 0, "cursor": None, "alerts": [], "busy": True}
+        pending = None
+        try:
+            # 取得租约后再读游标，其他进程此前提交的进度均已可见
+            cursor = await get_cursor(db)
+            last_packet_id = cursor.last_packet_id
+            while chunks < max_chunks:
+                # 续期失败说明租约已过期被接管，停止推进游标
+                if chunks and not await _claim(db):
+                    break
+                result = await db.execute(
+                    select(*PACKET_COLUMNS)
+                    .where(PacketORM.id > last_packet_id)
+                    .order_by(PacketORM.id)
+                    .limit(chunk_size)
+                )
+                rows = result.all()
+                if not rows:
+                    break
+
+                # 查询行直接转为列式批次，可推导的解码结果无需还原
+                await packet_store.prepare(db, rows)
+                batch = packet_store.detection_batch(rows)
+                chunk_alerts = await pool.detect(batch.packets, batch)
+                orms = [alert_to_orm(a) for a in chunk_alerts]
+                last_packet_id = rows[-1].id
+                # 告警与游标同一事务提交，中途失败不会丢帧或重复检测；
+                # 上一块确认落库后才提交本块，保证游标不越过失败的块
+                if pending is not None:
+                    await _publish(*pending)
+                pending = (
+                    await write_behind.submit(
+                        alerts=orms, cursor=(CURSOR_NAME, last_packet_id, rows[-1].timestamp),
+                    ),
+                    orms,
+                )
+
+                alerts.extend(chunk_alerts)
+                processed += len(rows)
+                chunks += 1
+                if len(rows) < chunk_size:
+                    break
+
+            if pending is not None:
+                await _publish(*pending)
+        finally:
+            # 最后一块落库（或失败）后才释放，其他进程不会读到落后的游标
+            if pending is not None and not pending[0].done():
+                await asyncio.wait([pending[0]])
+            await _release(db)
+
+    alerts.sort(key=lambda a: a.confidence, reverse=True)
+    return {
+        "processed": processed,
+        "chunks": chunks,
+        "cursor": last_packet_id,
+        "alerts": alerts,
+    }
@@ -0,0 +1,167 @@
+"""后台持续检测调度器
+
+由 lifespan 启动，按固定间隔或新报文数达到阈值时运行增量检测流水线：
+- 根据积压量与实测吞吐自适应调整每轮的块大小和块数
+- 单任务串行执行，上一轮未结束时不会开始下一轮（超时只计数）
+- 运行延迟与吞吐通过 stats() 暴露给 /api/system/status
+- 其他进程持有检测租约时本进程待机，按间隔重试，不因积压或新报文反复唤醒
+- 开启 ingest.shm_enabled 时报文由共享内存检测进程检测，调度器不启用，避免重复检测
+"""
+
+import asyncio
+import logging
+import math
+import time
+
+from sqlalchemy import select, func
+
+from app.config import settings
+from app.database import async_session
+from app.models.packet import PacketORM
+from app.services.detection_pipeline import get_cursor, run_detection
+from app.services.vehicle_registry import ShardedDetectorPool
+
+logger = logging.getLogger("gatewayguard.scheduler")
+
+
+class DetectionScheduler:
+    """间隔 / 报文数阈值双触发的检测调度器"""
+
+    def __init__(self, pool: ShardedDetectorPool):
+        cfg = settings.scheduler
+        self.pool = pool
+        self.enabled = cfg.enabled and not settings.ingest.shm_enabled
+        self.interval = cfg.interval
+        self.packet_threshold = cfg.packet_threshold
+        self.min_batch = cfg.min_batch
+        self.max_batch = cfg.max_batch
+        self.max_chunks = cfg.max_chunks
+
+        self._wake = asyncio.Event()
+        self._pending = 0
+        self._running = False
+        self._standby = False
+
+        self.runs = 0
+        self.standby_rounds = 0
+        self.overruns = 0
+        self.total_processed = 0
+        self.total_detected = 0
+        self.backlog = 0
+        self.throughput = 0.0        # 报文/秒（指数滑动平均）
+        self.last_run_at = 0.0
+        self.last_duration = 0.0
+        self.last_processed = 0
+        self.lag_seconds = 0.0       # 最新已检测报文距当前的时间
+
+    def notify_packets(self, count: int) -> None:
+        """入库路径调用：累计新报文数，达到阈值时立即唤醒调度器"""
+        if not self.enabled:
+            return
+        self._pending += count
+        if self._pending >= self.packet_threshold:
+            self._wake.set()
+
+    async def _measure_backlog(self) -> int:
+        # 按行计数而非 max(id) - 游标：清空数据或归档后报文ID不连续
+        async with async_session() as db:
+            cursor = await get_cursor(db)
+            return await db.scalar(
+                select(func.count()).select_from(PacketORM)
+                .where(PacketORM.id > (cursor.last_packet_id or 0))
+            ) or 0
+
+    def _plan(self, backlog: int):
+        """按积压量和上一轮吞吐确定块大小与块数，单轮目标耗时为间隔的一半"""
+        if self.throughput > 0:
+            budget = int(self.throughput * self.interval * 0.5)
+        else:
+            budget = self.max_batch
+        to_process = min(backlog, max(budget, self.min_batch))
+        chunk_size = min(max(to_process, self.min_batch), self.max_batch)
+        chunks = min(self.max_chunks, max(1, math.ceil(to_process / chunk_size)))
+        return chunk_size, chunks
+
+    async def run_once(self) -> dict:
+        if self._running:
+            self.overruns += 1
+            return {}
+        self._running = True
+        try:
+            self._pending = 0
+            backlog = await self._measure_backlog()
+            if backlog == 0:
+                self.backlog = 0
+                return {}
+
+            chunk_size, chunks = self._plan(backlog)
+            started = time.perf_counter()
+            async with async_session() as db:
+                result = await run_detection(db, self.pool, chunk_size, chunks)
+                if result.get("busy"):
+                    # 租约被其他进程持有：本轮没有进展，不计入运行次数
+                    self.standby_rounds += 1
+                    self.backlog = backlog
+                    return result
+                cursor = await get_cursor(db)
+                last_ts = cursor.last_timestamp
+            duration = time.perf_counter() - started
+
+            processed = result["processed"]
+            self.runs += 1
+            self.last_run_at = time.time()
+            self.last_duration = duration
+            self.last_processed = processed
+            self.total_processed += processed
+            self.total_detected += len(result["alerts"])
+            self.backlog = max(0, backlog - processed)
+            if last_ts:
+                self.lag_seconds = max(0.0, self.last_run_at - last_ts)
+            if processed and duration > 0:
+                rate = processed / duration
+                self.throughput = rate if self.throughput == 0 else 0.7 * self.throughput + 0.3 * rate
+            if duration > self.interval:
+                self.overruns += 1
+            return result
+        finally:
+            self._running = False
+
+    async def run_forever(self) -> None:
+        while True:
+            if self._standby:
+                # 待机时忽略唤醒，按正常间隔重试取租约
+                await asyncio.sleep(self.interval)
+            else:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wake.clear()
+            try:
+                result = await self.run_once()
+                self._standby = bool(result.get("busy"))
+                # 仍有积压时立即进入下一轮
+                if result and not self._standby and self.backlog > 0:
+                    self._wake.set()
+            except Exception:
+                logger.exception("后台检测失败")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._running,
+            "standby": self._standby,
+            "runs": self.runs,
+            "standby_rounds": self.standby_rounds,
+            "overruns": self.overruns,
+            "interval": self.interval,
+            "pending_packets": self._pending,
+            "backlog_packets": self.backlog,
+            "lag_seconds": round(self.lag_seconds, 3),
+            "throughput_pps": round(self.throughput, 1),
+            "last_run_at": self.last_run_at or None,
+            "last_duration": round(self.last_duration, 4),
+            "last_processed": self.last_processed,
+            "total_processed": self.total_processed,
+            "total_detected": self.total_detected,
+        }
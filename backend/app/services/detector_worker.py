@@ -0,0 +1,118 @@
+"""共享内存检测进程
+
+从 ShmRing 读取定长记录，按 vehicle_id 哈希只处理本分片的车辆，
+由记录列直接构造检测批次，检测结果直接写入数据库。
+检测器状态换出到 ingest.state_dir，与 API 进程的 fleet.state_dir 互不覆盖。
+启动方式（每个分片一个进程）：
+
+    python -m app.services.detector_worker --index 0 --count 2
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.database import async_session, init_db
+from app.services.bucket_rollups import bucket_rollups
+from app.services.detection_pipeline import alert_to_orm
+from app.services.shm_ring import ShmRing, detection_batch
+from app.services.vehicle_registry import VehicleDetectorRegistry
+
+logger = logging.getLogger("gatewayguard.detector_worker")
+
+
+class RingDetectorWorker:
+    """单个检测分片：消费环形缓冲区中属于本分片的记录"""
+
+    def __init__(self, index: int, count: int):
+        cfg = settings.ingest
+        self.index = index
+        self.count = max(1, count)
+        self.ring = ShmRing(cfg.shm_name, cfg.shm_capacity)
+        self.registry = VehicleDetectorRegistry(
+            max(1, settings.fleet.max_cached_vehicles // self.count),
+            cfg.state_dir,
+        )
+        # 从当前写入位置开始消费，不回放历史
+        self.cursor = self.ring.write_seq
+        self.processed = 0
+        self.dropped = 0
+
+    def _owned(self, records: np.ndarray) -> np.ndarray:
+        if self.count == 1:
+            return records
+        mask = (records["vehicle_hash"] % self.count) == self.index
+        return records[mask]
+
+    def poll(self):
+        """读取并检测一批新记录，返回告警列表"""
+        chunks, self.cursor, dropped = self.ring.read(
+            self.cursor, settings.ingest.read_batch,
+        )
+        if dropped:
+            self.dropped += dropped
+            logger.warning("分片 %d 落后于写入方，丢弃 %d 条记录", self.index, dropped)
+
+        alerts = []
+        for records in chunks:
+            owned = self._owned(records)
+            if len(owned) == 0:
+                continue
+            batch = detection_batch(owned)
+            self.processed += len(batch)
+            vehicles = owned["vehicle_id"]
+            for vehicle in np.unique(vehicles):
+                index = np.flatnonzero(vehicles == vehicle)
+                index = index[np.argsort(batch.timestamps[index], kind="stable")]
+                sub = batch.take(index)
+                alerts.extend(self.registry.detect(
+                    vehicle.decode("utf-8", "replace"), sub.packets, sub,
+                ))
+        return alerts
+
+    async def run(self):
+        await init_db()
+        interval = settings.ingest.poll_interval
+        check_interval = settings.detector.retrain_check_interval
+        next_check = time.monotonic() + check_interval
+        try:
+            while True:
+                if time.monotonic() >= next_check:
+                    self.registry.maintain()
+                    next_check = time.monotonic() + check_interval
+                alerts = self.poll()
+                if not alerts:
+                    await asyncio.sleep(interval)
+                    continue
+                async with async_session() as db:
+                    orms = [alert_to_orm(a) for a in alerts]
+                    db.add_all(orms)
+                    await bucket_rollups.add(db, alerts=orms)
+                    await db.commit()
+        finally:
+            self.registry.flush()
+            self.ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GatewayGuard 共享内存检测进程")
+    parser.add_argument("--index", type=int, default=0, help="本进程分片序号")
+    parser.add_argument("--count", type=int, default=settings.ingest.detector_workers,
+                        help="检测进程总数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    worker = RingDetectorWorker(args.index, args.count)
+    logger.info("检测分片 %d/%d 已启动", args.index, worker.count)
+    try:
+        asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
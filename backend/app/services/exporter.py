@@ -0,0 +1,216 @@
+"""流式批量导出
+
+按时间范围以 (timestamp, id) 键集分页分块读取报文/异常事件，逐块编码为
+NDJSON、Arrow IPC 流或 Parquet 行组输出，内存占用与导出总量无关。
+每页使用独立的短会话，读事务不跨越向客户端输出的等待：下载缓慢的客户端
+不会长时间持有 SQLite 读锁而阻塞入库与告警写入。导出期间新写入、
+时间戳在当前位置之后的行也会被输出。
+报文导出先读取时间范围内的冷归档块，再读取 packets 表。
+Arrow/Parquet 依赖 pyarrow（可选依赖，未安装时仅支持 NDJSON）。
+"""
+
+import io
+import json
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import and_, or_, select
+
+from app.database import async_session
+from app.models.anomaly import AnomalyEventORM
+from app.models.packet import PacketORM
+from app.services.archive import packet_archive
+from app.services.packet_store import (
+    KIND_VEHICLE, PACKET_COLUMNS, packet_store,
+)
+
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# 导出列：(列名, 列对象, Arrow 类型名)
+# 报文的字符串列以字典编码存储，导出时按 row_fields 还原，列对象为 None
+PACKET_EXPORT_COLUMNS = [
+    ("id", None, "int64"),
+    ("vehicle_id", None, "string"),
+    ("timestamp", None, "float64"),
+    ("protocol", None, "string"),
+    ("source", None, "string"),
+    ("destination", None, "string"),
+    ("msg_id", None, "string"),
+    ("domain", None, "string"),
+    ("payload", None, "binary"),
+]
+
+EVENT_EXPORT_COLUMNS = [
+    ("id", AnomalyEventORM.id, "int64"),
+    ("vehicle_id", AnomalyEventORM.vehicle_id, "string"),
+    ("timestamp", AnomalyEventORM.timestamp, "float64"),
+    ("anomaly_type", AnomalyEventORM.anomaly_type, "string"),
+    ("severity", AnomalyEventORM.severity, "string"),
+    ("confidence", AnomalyEventORM.confidence, "float64"),
+    ("protocol", AnomalyEventORM.protocol, "string"),
+    ("source_node", AnomalyEventORM.source_node, "string"),
+    ("target_node", AnomalyEventORM.target_node, "string"),
+    ("description", AnomalyEventORM.description, "string"),
+    ("detection_method", AnomalyEventORM.detection_method, "string"),
+    ("status", AnomalyEventORM.status, "string"),
+]
+
+
+def pyarrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的内存输出：按块取走已写入的字节，tell() 返回累计偏移"""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _iter_rows(columns, model, start, end, vehicle_id, chunk_size):
+    """键集分页分块读取，每次产出一个列字典；每页一个短会话，产出前已结束读事务"""
+    names = [name for name, _, _ in columns]
+    is_packets = model is PacketORM
+    if is_packets:
+        stmt = select(*PACKET_COLUMNS)
+    else:
+        stmt = select(*[col for _, col, _ in columns])
+    stmt = stmt.order_by(model.timestamp, model.id)
+    if start is not None:
+        stmt = stmt.where(model.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(model.timestamp < end)
+
+    def packet_block(rows):
+        records = [{**packet_store.row_fields(r), "payload": r.payload} for r in rows]
+        return {name: [rec[name] for rec in records] for name in names}
+
+    vehicle_code = None
+    blocks = []
+    async with async_session() as db:
+        if vehicle_id:
+            if is_packets:
+                vehicle_code = await packet_store.code_of(db, KIND_VEHICLE, vehicle_id)
+                if vehicle_code is None:
+                    return
+                stmt = stmt.where(model.vehicle_code == vehicle_code)
+            else:
+                stmt = stmt.where(model.vehicle_id == vehicle_id)
+        if is_packets:
+            blocks = await packet_archive.blocks(db, start, end, vehicle_code)
+
+    # 已归档的较旧报文先于 packets 表输出，逐块读取
+    for block in blocks:
+        rows = await packet_archive.read_rows(block, start, end, vehicle_code)
+        if not rows:
+            continue
+        async with async_session() as db:
+            await packet_store.prepare(db, rows)
+        for i in range(0, len(rows), chunk_size):
+            yield packet_block(rows[i:i + chunk_size])
+
+    last = None
+    while True:
+        page = stmt
+        if last is not None:
+            ts, row_id = last
+            page = page.where(or_(
+                model.timestamp > ts, and_(model.timestamp == ts, model.id > row_id),
+            ))
+        async with async_session() as db:
+            rows = (await db.execute(page.limit(chunk_size))).all()
+            if is_packets and rows:
+                await packet_store.prepare(db, rows)
+        if not rows:
+            return
+        last = (rows[-1].timestamp, rows[-1].id)
+        if is_packets:
+            yield packet_block(rows)
+        else:
+            yield {name: [row[i] for row in rows] for i, name in enumerate(names)}
+        if len(rows) < chunk_size:
+            return
+
+
+def _ndjson_chunk(block: dict) -> bytes:
+    names = list(block)
+    lines = []
+    for values in zip(*block.values()):
+        record = dict(zip(names, values))
+        if "payload" in record:
+            payload = record.pop("payload")
+            record["payload_hex"] = payload.hex() if payload else ""
+        lines.append(json.dumps(record, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+async def iter_export(
+    kind: str,
+    fmt: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    vehicle_id: Optional[str] = None,
+    chunk_size: int = 5000,
+) -> AsyncIterator[bytes]:
+    """按格式逐块产出导出字节流"""
+    if kind == "events":
+        columns, model = EVENT_EXPORT_COLUMNS, AnomalyEventORM
+    else:
+        columns, model = PACKET_EXPORT_COLUMNS, PacketORM
+    blocks = _iter_rows(columns, model, start, end, vehicle_id, chunk_size)
+
+    if fmt == "ndjson":
+        async for block in blocks:
+            yield _ndjson_chunk(block)
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, _, type_name in columns])
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        write = writer.write_table
+        wrap = pa.Table.from_pydict
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+        wrap = pa.RecordBatch.from_pydict
+
+    try:
+        async for block in blocks:
+            write(wrap(block, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    tail = sink.drain()
+    if tail:
+        yield tail
@@ -0,0 +1,256 @@
+"""实时推送中心
+
+入库与检测路径把新报文、新告警发布到本模块，由后台任务按固定帧率
+合并后推送给所有 /ws/live 订阅者：
+- 帧内容是自上一帧以来的增量（各协议帧数、新告警、最近报文）与每秒速率，
+  前端在初次加载的结果上累加，查看者数量不影响数据库负载
+- 两帧之间的发布合并为一帧，推送频率不超过 live.max_fps
+- 每个订阅者只保留一帧待发送：消费慢时新帧与未发送的帧合并，
+  旧的速率与报文快照被丢弃，增量计数与告警不丢失
+- 数据被清理时推送 reset 帧，前端重新加载
+"""
+
+import asyncio
+import time
+from collections import Counter, deque
+from typing import Deque, Iterable, List, Optional, Set
+
+from app.config import settings
+from app.models.anomaly import AnomalyEventORM
+from app.models.packet import UnifiedPacket
+
+RATE_WINDOW = 5  # 速率统计窗口（秒）
+
+
+def _alert_dict(r: AnomalyEventORM) -> dict:
+    """与 /api/anomaly/events 的事件字段一致"""
+    return {
+        "id": r.id,
+        "vehicle_id": r.vehicle_id,
+        "timestamp": r.timestamp,
+        "anomaly_type": r.anomaly_type,
+        "severity": r.severity,
+        "confidence": r.confidence,
+        "protocol": r.protocol,
+        "source_node": r.source_node,
+        "target_node": r.target_node,
+        "description": r.description,
+        "detection_method": r.detection_method,
+        "status": r.status,
+    }
+
+
+def _packet_dict(p: UnifiedPacket) -> dict:
+    return {
+        "vehicle_id": p.vehicle_id,
+        "timestamp": p.timestamp,
+        "protocol": p.protocol,
+        "source": p.source,
+        "destination": p.destination,
+        "msg_id": p.msg_id,
+        "domain": p.domain,
+    }
+
+
+def merge_frames(old: dict, new: dict, max_alerts: int, max_packets: int) -> dict:
+    """合并两帧：增量相加、告警与报文拼接截断，速率取新帧"""
+    if new["type"] == "reset" or old["type"] == "reset":
+        return new if new["type"] == "reset" else {**new, "type": "reset"}
+    delta = Counter(old["delta"]["by_protocol"])
+    delta.update(new["delta"]["by_protocol"])
+    return {
+        **new,
+        "delta": {
+            "packets": old["delta"]["packets"] + new["delta"]["packets"],
+            "by_protocol": dict(delta),
+            "alerts": old["delta"]["alerts"] + new["delta"]["alerts"],
+        },
+        "alerts": (new["alerts"] + old["alerts"])[:max_alerts],
+        "packets": (new["packets"] + old["packets"])[:max_packets],
+        "coalesced": old.get("coalesced", 1) + new.get("coalesced", 1),
+    }
+
+
+class Subscriber:
+    """单个订阅者的待发送帧（最多一帧）"""
+
+    def __init__(self, hub: "LiveHub"):
+        self.hub = hub
+        self.pending: Optional[dict] = None
+        self.ready = asyncio.Event()
+        self.dropped = 0
+
+    def offer(self, frame: dict) -> None:
+        if self.pending is None:
+            self.pending = frame
+        else:
+            self.pending = merge_frames(
+                self.pending, frame, self.hub.max_alerts, self.hub.max_packets,
+            )
+            self.dropped += 1
+        self.ready.set()
+
+    async def next_frame(self) -> dict:
+        await self.ready.wait()
+        self.ready.clear()
+        frame, self.pending = self.pending, None
+        return frame
+
+
+class LiveHub:
+    """发布 / 订阅中心，按 live.max_fps 合并推送"""
+
+    def __init__(self):
+        cfg = settings.live
+        self.interval = 1.0 / max(0.1, cfg.max_fps)
+        self.max_alerts = cfg.max_alerts_per_frame
+        self.max_packets = cfg.recent_packets
+        self._subscribers: Set[Subscriber] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._seq = 0
+        self._reset = False
+        self._by_protocol: Counter = Counter()
+        self._alert_count = 0
+        self._alerts: Deque[dict] = deque(maxlen=self.max_alerts)
+        self._packets: Deque[dict] = deque(maxlen=self.max_packets)
+        # 每秒计数：秒 -> (报文数, 告警数)
+        self._seconds: Deque[list] = deque(maxlen=RATE_WINDOW + 1)
+        self._last_frame = 0.0
+        self._last_rates: dict = {}
+
+        self.frames = 0
+        self.published = 0
+
+    # ---- 发布 ----
+
+    def _tick(self, packets: int = 0, alerts: int = 0) -> None:
+        now = int(time.time())
+        if not self._seconds or self._seconds[-1][0] != now:
+            self._seconds.append([now, 0, 0])
+        self._seconds[-1][1] += packets
+        self._seconds[-1][2] += alerts
+
+    def publish_packets(self, packets: List[UnifiedPacket]) -> None:
+        if not packets:
+            return
+        for p in packets:
+            self._by_protocol[p.protocol] += 1
+        self._packets.extend(_packet_dict(p) for p in packets[-self.max_packets:])
+        self._tick(packets=len(packets))
+        self.published += 1
+        self._wakeup.set()
+
+    def publish_alerts(self, rows: Iterable[AnomalyEventORM]) -> None:
+        rows = list(rows)
+        if not rows:
+            return
+        self._alert_count += len(rows)
+        self._alerts.extend(_alert_dict(r) for r in rows[-self.max_alerts:])
+        self._tick(alerts=len(rows))
+        self.published += 1
+        self._wakeup.set()
+
+    def publish_reset(self) -> None:
+        """数据被清理，订阅者应丢弃累加状态并重新加载"""
+        self._reset = True
+        self._by_protocol.clear()
+        self._alert_count = 0
+        self._alerts.clear()
+        self._packets.clear()
+        self._wakeup.set()
+
+    # ---- 推送 ----
+
+    def _rates(self) -> dict:
+        """最近完整秒窗口内的平均每秒报文数与告警数"""
+        now = int(time.time())
+        window = [s for s in self._seconds if now - RATE_WINDOW <= s[0] < now]
+        return {
+            "packets_per_second": round(sum(s[1] for s in window) / RATE_WINDOW, 2),
+            "alerts_per_second": round(sum(s[2] for s in window) / RATE_WINDOW, 2),
+        }
+
+    def _take_frame(self) -> dict:
+        self._seq += 1
+        if self._reset:
+            self._reset = False
+            return {"type": "reset", "seq": self._seq, "ts": time.time(), "rates": self._rates()}
+        frame = {
+            "type": "update",
+            "seq": self._seq,
+            "ts": time.time(),
+            "delta": {
+                "packets": sum(self._by_protocol.values()),
+                "by_protocol": dict(self._by_protocol),
+                "alerts": self._alert_count,
+            },
+            "alerts": list(reversed(self._alerts)),
+            "packets": list(reversed(self._packets)),
+            "rates": self._rates(),
+        }
+        self._by_protocol.clear()
+        self._alert_count = 0
+        self._alerts.clear()
+        self._packets.clear()
+        return frame
+
+    @property
+    def _dirty(self) -> bool:
+        return self._reset or bool(self._by_protocol) or self._alert_count > 0
+
+    async def run_forever(self) -> None:
+        while True:
+            try:
+                # 无新数据时每秒检查一次速率，变化时推送，使前端速率能回落到 0
+                await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            wait = self._last_frame + self.interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if not self._dirty and (
+                time.monotonic() - self._last_frame < 1.0
+                or self._rates() == self._last_rates
+            ):
+                continue
+            self._last_frame = time.monotonic()
+            frame = self._take_frame()
+            self._last_rates = frame["rates"]
+            if not self._subscribers:
+                continue
+            for sub in self._subscribers:
+                sub.offer(frame)
+            self.frames += 1
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # ---- 订阅 ----
+
+    def subscribe(self) -> Subscriber:
+        sub = Subscriber(self)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self._subscribers.discard(sub)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "frames": self.frames,
+            "published": self.published,
+            "dropped": sum(s.dropped for s in self._subscribers),
+        }
+
+
+live_hub = LiveHub()
@@ -0,0 +1,270 @@
+"""LLM 调用的弹性客户端层
+
+在 OpenAI / Ollama 两个提供方之上统一管理：
+- 每个提供方独立的 httpx 连接池（keep-alive 复用连接）
+- 每个提供方的并发信号量，排队超时后转向备用提供方，慢提供方不会拖住所有请求
+- 以截止时间为准的超时：重试与故障转移共享同一个总时限
+- 带抖动的指数退避重试（仅对连接错误、超时、429 与 5xx）
+- 熔断器：连续失败达到阈值后打开，冷却期内直接跳到备用提供方，
+  冷却结束后放行一次试探请求
+- 每个提供方的延迟与错误统计（/api/system/status 展示）
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+import httpx
+from openai import (
+    APIConnectionError, APIStatusError, AsyncOpenAI, RateLimitError,
+)
+
+from app.config import LLMConfig
+
+logger = logging.getLogger("gatewayguard.llm_client")
+
+PROVIDERS = ("openai", "ollama")
+
+
+class LLMUnavailableError(RuntimeError):
+    """所有提供方均不可用或已超过截止时间"""
+
+
+class _ProviderFailed(Exception):
+    """单个提供方放弃，由调用方转向下一个提供方"""
+
+
+def _retryable(exc: Exception) -> bool:
+    if isinstance(exc, (APIConnectionError, RateLimitError, asyncio.TimeoutError)):
+        return True
+    return isinstance(exc, APIStatusError) and exc.status_code >= 500
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器：closed -> open -> half_open -> closed"""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def end_probe(self) -> None:
+        """试探请求未产生结果（排队超时、被取消）时释放试探名额"""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class LatencyStats:
+    """请求计数与最近请求的延迟分位数"""
+
+    def __init__(self, window: int = 256):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "latency_ms_p50": self.percentile(0.5),
+            "latency_ms_p95": self.percentile(0.95),
+        }
+
+
+class ProviderClient:
+    """单个提供方：连接池、并发限制、熔断器与统计"""
+
+    def __init__(self, name: str, cfg: LLMConfig):
+        self.name = name
+        if name == "ollama":
+            base_url, api_key, self.model = f"{cfg.ollama_base_url}/v1", "ollama", cfg.ollama_model
+        else:
+            base_url, api_key, self.model = cfg.openai_base_url, cfg.openai_api_key, cfg.openai_model
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=cfg.pool_connections,
+                max_keepalive_connections=cfg.pool_keepalive,
+                keepalive_expiry=cfg.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(cfg.request_deadline, connect=cfg.connect_timeout),
+        )
+        # 重试由本层按截止时间统一控制，关闭 SDK 自带重试
+        self.client = AsyncOpenAI(
+            base_url=base_url, api_key=api_key or "none",
+            http_client=self.http, max_retries=0,
+        )
+        self.semaphore = asyncio.Semaphore(cfg.max_concurrency)
+        self.breaker = CircuitBreaker(cfg.breaker_failures, cfg.breaker_cooldown)
+        self.stats = LatencyStats()
+        self.in_flight = 0
+
+    async def create(self, timeout: float, **kwargs):
+        started = time.monotonic()
+        self.stats.requests += 1
+        self.in_flight += 1
+        try:
+            resp = await self.client.chat.completions.create(
+                model=self.model, timeout=timeout, **kwargs,
+            )
+        finally:
+            self.in_flight -= 1
+        self.stats.observe(time.monotonic() - started)
+        return resp
+
+    def to_dict(self) -> dict:
+        return {
+            "model": self.model,
+            "circuit": self.breaker.state,
+            "circuit_trips": self.breaker.trips,
+            "in_flight": self.in_flight,
+            **self.stats.to_dict(),
+        }
+
+
+class ResilientLLMClient:
+    """按主 / 备顺序调用提供方，统一处理排队、重试、熔断与故障转移"""
+
+    def __init__(self, cfg: LLMConfig):
+        self.cfg = cfg
+        primary = cfg.provider if cfg.provider in PROVIDERS else "openai"
+        order = [primary]
+        if cfg.fallback_enabled:
+            order += [p for p in PROVIDERS if p != primary]
+        self.providers: List[ProviderClient] = [ProviderClient(p, cfg) for p in order]
+        self.failovers = 0
+
+    @property
+    def primary(self) -> ProviderClient:
+        return self.providers[0]
+
+    def _backoff(self, attempt: int) -> float:
+        """全抖动指数退避"""
+        cap = min(self.cfg.retry_backoff_max, self.cfg.retry_backoff * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    async def create(self, **kwargs):
+        """chat.completions.create 的弹性封装，kwargs 不含 model"""
+        deadline = time.monotonic() + self.cfg.request_deadline
+        last_error: Optional[Exception] = None
+
+        for index, provider in enumerate(self.providers):
+            probing = provider.breaker.state != "closed"
+            if not provider.breaker.allow():
+                provider.stats.rejected += 1
+                continue
+            if index > 0:
+                self.failovers += 1
+                logger.warning("LLM 故障转移至 %s", provider.name)
+
+            try:
+                resp = await self._attempt(provider, deadline, kwargs)
+            except _ProviderFailed as e:
+                last_error = e.__cause__
+                continue
+            finally:
+                if probing:
+                    provider.breaker.end_probe()
+            return resp
+
+        raise LLMUnavailableError("所有 LLM 提供方均不可用") from last_error
+
+    async def _attempt(self, provider: ProviderClient, deadline: float, kwargs: dict):
+        """在单个提供方上带退避重试，放弃该提供方时抛出 _ProviderFailed"""
+        last_error: Optional[Exception] = None
+        for attempt in range(self.cfg.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMUnavailableError("LLM 请求超过截止时间") from last_error
+            try:
+                # 并发槽位排队超时视为该提供方过载，转向备用提供方
+                await asyncio.wait_for(
+                    provider.semaphore.acquire(),
+                    min(self.cfg.queue_timeout, remaining),
+                )
+            except asyncio.TimeoutError as e:
+                provider.stats.rejected += 1
+                raise _ProviderFailed(provider.name) from e
+            try:
+                resp = await provider.create(
+                    timeout=deadline - time.monotonic(), **kwargs,
+                )
+            except Exception as e:
+                provider.stats.failures += 1
+                if not _retryable(e):
+                    # 请求本身有误（4xx），提供方可用，不计入熔断
+                    provider.breaker.record_success()
+                    raise
+                provider.breaker.record_failure()
+                last_error = e
+                logger.warning("LLM 提供方 %s 调用失败: %s", provider.name, e)
+                if provider.breaker.state != "closed" or attempt == self.cfg.max_retries:
+                    break
+                provider.stats.retries += 1
+                await asyncio.sleep(min(
+                    self._backoff(attempt),
+                    max(0.0, deadline - time.monotonic()),
+                ))
+                continue
+            finally:
+                provider.semaphore.release()
+            provider.breaker.record_success()
+            return resp
+        raise _ProviderFailed(provider.name) from last_error
+
+    async def close(self) -> None:
+        for provider in self.providers:
+            await provider.http.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "failovers": self.failovers,
+            "providers": {p.name: p.to_dict() for p in self.providers},
+        }
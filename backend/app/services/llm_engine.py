@@ -6,20 +6,115 @@
 3. 交互式安全问答（Function Calling）
 """
 
+import asyncio
 import json
 import re
+import time
 from typing import List, Optional
 
-from openai import AsyncOpenAI
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
+from app.database import async_session
 from app.utils.prompt_templates import (
     SYSTEM_PROMPT,
     ANOMALY_ANALYSIS_PROMPT,
     REPORT_GENERATION_PROMPT,
+    REPORT_MAP_PROMPT,
+    REPORT_REDUCE_PROMPT,
+    CHAT_SUMMARY_PROMPT,
 )
 from app.utils.tools import CHAT_TOOLS
-from app.models.anomaly import AnomalyEvent
+from app.models.anomaly import AnomalyEvent, AnomalyEventORM
+from app.services import report_builder
+from app.services.bucket_rollups import bucket_rollups
+from app.services.llm_client import ResilientLLMClient
+
+# 工具参数的取值范围，模型给出的越界值按边界处理
+TOOL_MAX_MINUTES = 1440
+TOOL_MAX_LIMIT = 50
+SEVERITIES = ("critical", "high", "medium", "low")
+
+
+def _int_arg(arguments: dict, key: str, default: int, upper: int) -> int:
+    """把工具参数转为 [1, upper] 内的整数，缺省时取 default；非数值抛出 ValueError"""
+    value = arguments.get(key)
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"{key} 必须为整数")
+    return max(1, min(int(float(value)), upper))
+
+
+async def _traffic_stats(db: AsyncSession, protocol: str, minutes: int) -> dict:
+    """最近 N 分钟的流量统计，由 rollup_buckets 的分钟桶计算（protocol=ALL 时汇总所有协议）"""
+    protocol = protocol.upper()
+    now = time.time()
+    result = await bucket_rollups.query(db, "protocol", now - minutes * 60, now, 60, top=20)
+    if "error" in result:
+        return result
+    by_protocol = result["totals"]
+    if protocol != "ALL":
+        by_protocol = {protocol: by_protocol.get(protocol, 0)}
+    per_minute = [
+        {
+            "minute": time.strftime("%H:%M", time.localtime(b["ts"])),
+            "packets": b["total"] if protocol == "ALL" else b["counts"].get(protocol, 0),
+        }
+        for b in result["series"]
+    ]
+    total = sum(by_protocol.values())
+    return {
+        "protocol": protocol,
+        "minutes": minutes,
+        "total_packets": total,
+        "by_protocol": by_protocol,
+        "packets_per_second": round(total / (minutes * 60), 2),
+        "per_minute": per_minute[-10:],
+    }
+
+
+async def _anomaly_events(db: AsyncSession, severity: str, limit: int) -> dict:
+    """最近 TOOL_MAX_MINUTES 分钟的事件计数（来自 rollup_buckets）与最近的事件列表"""
+    severity = severity.lower()
+    now = time.time()
+    since = now - TOOL_MAX_MINUTES * 60
+    counts = await bucket_rollups.query(db, "severity", since, now, 60, top=len(SEVERITIES))
+    if "error" in counts:
+        return counts
+
+    stmt = select(AnomalyEventORM).order_by(AnomalyEventORM.timestamp.desc()).limit(limit)
+    types = (
+        select(AnomalyEventORM.anomaly_type, func.count())
+        .where(AnomalyEventORM.timestamp >= since)
+        .group_by(AnomalyEventORM.anomaly_type)
+        .order_by(func.count().desc())
+        .limit(5)
+    )
+    if severity != "all":
+        stmt = stmt.where(AnomalyEventORM.severity == severity)
+        types = types.where(AnomalyEventORM.severity == severity)
+    rows = (await db.execute(stmt)).scalars().all()
+    return {
+        "severity": severity,
+        "counts_by_severity": {s: counts["totals"].get(s, 0) for s in SEVERITIES},
+        "top_types": {t: n for t, n in (await db.execute(types)).all()},
+        "events": [
+            {
+                "id": r.id,
+                "vehicle_id": r.vehicle_id,
+                "timestamp": r.timestamp,
+                "anomaly_type": r.anomaly_type,
+                "severity": r.severity,
+                "confidence": r.confidence,
+                "protocol": r.protocol,
+                "source_node": r.source_node,
+                "description": r.description,
+            }
+            for r in rows
+        ],
+    }
 
 
 class LLMEngine:
@@ -35,33 +130,20 @@ class LLMEngine:
         return json.loads(text)
 
     def __init__(self):
-        self._init_client()
+        self.client = ResilientLLMClient(settings.llm)
 
-    def _init_client(self):
-        cfg = settings.llm
-        if cfg.provider == "ollama":
-            self.client = AsyncOpenAI(
-                base_url=f"{cfg.ollama_base_url}/v1",
-                api_key="ollama",
-            )
-            self.model = cfg.ollama_model
-        else:
-            self.client = AsyncOpenAI(
-                base_url=cfg.openai_base_url,
-                api_key=cfg.openai_api_key,
-            )
-            self.model = cfg.openai_model
-
-    async def _call_llm(self, messages: list, **kwargs) -> str:
-        """统一的LLM调用入口"""
-        resp = await self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=settings.llm.temperature,
-            max_tokens=settings.llm.max_tokens,
-            **kwargs,
-        )
-        return resp
+    @property
+    def model(self) -> str:
+        return self.client.primary.model
+
+    async def _call_llm(self, messages: list, **kwargs):
+        """统一的LLM调用入口（连接池、并发限制、重试与故障转移由客户端层处理）"""
+        kwargs.setdefault("temperature", settings.llm.temperature)
+        kwargs.setdefault("max_tokens", settings.llm.max_tokens)
+        return await self.client.create(messages=messages, **kwargs)
+
+    async def close(self) -> None:
+        await self.client.close()
 
     async def analyze_anomaly(self, event: AnomalyEvent) -> dict:
         """对单个异常事件进行LLM语义分析"""
@@ -87,63 +169,157 @@ class LLMEngine:
         except (json.JSONDecodeError, ValueError):
             return {"analyze_raw": content}
 
-    async def generate_report(self, events: List[AnomalyEvent]) -> dict:
-        """基于多个异常事件生成预警报告"""
-        events_data = [
-            {
-                "timestamp": e.timestamp,
-                "anomaly_type": e.anomaly_type,
-                "severity": e.severity,
-                "protocol": e.protocol,
-                "source_node": e.source_node,
-                "description": e.description,
-            }
-            for e in events
-        ]
-        prompt = REPORT_GENERATION_PROMPT.format(
-            events_json=json.dumps(events_data, ensure_ascii=False, indent=2)
-        )
-
+    async def _complete(self, prompt: str) -> str:
         resp = await self._call_llm([
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ])
-        content = resp.choices[0].message.content
+        return resp.choices[0].message.content
+
+    async def generate_report(self, events: List[AnomalyEvent]) -> dict:
+        """基于多个异常事件生成预警报告
+
+        事件先在本地按 (类型, 来源, 严重程度) 聚合；分组较少时单次调用，
+        否则分块并发摘要后再归并，提示长度与事件数量无关。
+        """
+        cfg = settings.llm
+        groups = report_builder.group_events(events)
+        overview = report_builder.overview(events, groups)
+
+        if len(groups) <= cfg.report_direct_rows:
+            prompt = REPORT_GENERATION_PROMPT.format(
+                overview=overview, events_table=report_builder.table(groups),
+            )
+        else:
+            chunks = report_builder.partition(
+                groups, cfg.report_chunk_rows, cfg.report_max_chunks,
+            )
+            semaphore = asyncio.Semaphore(cfg.report_concurrency)
+
+            async def summarize_chunk(chunk):
+                async with semaphore:
+                    return await self._complete(REPORT_MAP_PROMPT.format(
+                        events_table=report_builder.table(chunk),
+                    ))
+
+            summaries = await asyncio.gather(*[summarize_chunk(c) for c in chunks])
+            prompt = REPORT_REDUCE_PROMPT.format(
+                overview=overview,
+                summaries="\n".join(
+                    f"{i + 1}. {(s or '').strip()}" for i, s in enumerate(summaries)
+                ),
+            )
+
+        content = await self._complete(prompt)
         try:
             return self._parse_json_response(content)
         except (json.JSONDecodeError, ValueError):
             return {"report_raw": content}
 
+    async def summarize(self, summary: str, turns: List[dict], max_chars: int) -> str:
+        """将已有摘要与新折叠的对话合并为新的滚动摘要"""
+        role_names = {"user": "用户", "assistant": "助手"}
+        dialogue = "\n".join(
+            f"{role_names.get(t['role'], t['role'])}: {t['content']}" for t in turns
+        )
+        prompt = CHAT_SUMMARY_PROMPT.format(
+            max_chars=max_chars, summary=summary or "（无）", dialogue=dialogue,
+        )
+        resp = await self._call_llm(
+            [{"role": "user", "content": prompt}],
+            temperature=0.0,
+            max_tokens=max_chars,
+        )
+        return (resp.choices[0].message.content or "").strip()
+
+    @staticmethod
+    async def _execute_tool(name: str, arguments: dict) -> dict:
+        """在服务端执行工具调用，计数来自 rollup_buckets 时间桶汇总
+
+        参数无效时返回 {"error": ...} 交给模型自行修正，不中断对话。
+        """
+        if not isinstance(arguments, dict):
+            return {"error": "工具参数必须为 JSON 对象"}
+        try:
+            if name == "query_traffic_stats":
+                protocol = str(arguments.get("protocol") or "ALL")
+                minutes = _int_arg(arguments, "minutes", 5, TOOL_MAX_MINUTES)
+                async with async_session() as db:
+                    return await _traffic_stats(db, protocol, minutes)
+            if name == "get_anomaly_events":
+                severity = str(arguments.get("severity") or "all")
+                limit = _int_arg(arguments, "limit", 10, TOOL_MAX_LIMIT)
+                async with async_session() as db:
+                    return await _anomaly_events(db, severity, limit)
+        except (TypeError, ValueError, OverflowError) as e:
+            return {"error": f"工具参数无效: {e}"}
+        return {"error": f"未知工具: {name}"}
+
     async def chat(self, messages: List[dict], use_tools: bool = True) -> dict:
-        """交互式安全分析对话"""
+        """交互式安全分析对话
+
+        模型请求工具时在服务端执行并把结果回传，直到给出最终回答，
+        客户端一次请求即可得到完整答复。
+        """
         full_messages = [
             {"role": "system", "content": SYSTEM_PROMPT},
             *messages,
         ]
 
-        kwargs = {}
-        if use_tools:
-            kwargs["tools"] = CHAT_TOOLS
-
-        resp = await self._call_llm(full_messages, **kwargs)
-        choice = resp.choices[0]
+        executed = []
+        usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        max_rounds = settings.chat.max_tool_rounds if use_tools else 0
+        for round_no in range(max_rounds + 1):
+            kwargs = {}
+            # 最后一轮不再提供工具，强制模型给出回答
+            if use_tools and round_no < max_rounds:
+                kwargs["tools"] = CHAT_TOOLS
 
-        result = {
-            "content": choice.message.content or "",
-            "tool_calls": None,
-            "usage": {
-                "prompt_tokens": resp.usage.prompt_tokens if resp.usage else 0,
-                "completion_tokens": resp.usage.completion_tokens if resp.usage else 0,
-            },
-        }
+            resp = await self._call_llm(full_messages, **kwargs)
+            if resp.usage:
+                usage["prompt_tokens"] += resp.usage.prompt_tokens
+                usage["completion_tokens"] += resp.usage.completion_tokens
+            message = resp.choices[0].message
+            if not message.tool_calls:
+                break
 
-        if choice.message.tool_calls:
-            result["tool_calls"] = [
-                {
-                    "name": tc.function.name,
-                    "arguments": json.loads(tc.function.arguments),
-                }
-                for tc in choice.message.tool_calls
-            ]
+            full_messages.append({
+                "role": "assistant",
+                "content": message.content or "",
+                "tool_calls": [
+                    {
+                        "id": tc.id,
+                        "type": "function",
+                        "function": {
+                            "name": tc.function.name,
+                            "arguments": tc.function.arguments,
+                        },
+                    }
+                    for tc in message.tool_calls
+                ],
+            })
+            for tc in message.tool_calls:
+                try:
+                    arguments = json.loads(tc.function.arguments or "{}")
+                except json.JSONDecodeError as e:
+                    # 不以默认参数执行，回传解析错误由模型修正调用
+                    arguments = tc.function.arguments
+                    result = {"error": f"工具参数不是有效的 JSON: {e}"}
+                else:
+                    try:
+                        result = await self._execute_tool(tc.function.name, arguments)
+                    except Exception as e:
+                        # 工具内部故障也以结果形式回传，由模型向用户说明
+                        result = {"error": f"工具执行失败: {e}"}
+                executed.append({"name": tc.function.name, "arguments": arguments})
+                full_messages.append({
+                    "role": "tool",
+                    "tool_call_id": tc.id,
+                    "content": json.dumps(result, ensure_ascii=False),
+                })
 
-        return result
+        return {
+            "content": message.content or "",
+            "tool_calls": executed or None,
+            "usage": usage,
+        }
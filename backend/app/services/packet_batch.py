@@ -0,0 +1,187 @@
+"""报文批次的列式表示
+
+向量化检测器共用的 NumPy 列：一次转换，多个检测器复用。
+检测读取路径由 packets 表的 Core 查询行直接构造（from_rows）：负载以原始字节
+拼接后按偏移聚合，学习型检测的特征列向量化计算，不经过十六进制往返与逐帧特征提取。
+"""
+
+import zlib
+from dataclasses import dataclass
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+
+from app.models.packet import DEFAULT_VEHICLE_ID, UnifiedPacket
+
+
+CAN_MAX_DLC = 8
+CAN_STD_ID_SPACE = 0x800  # 11 位标准帧 ID 空间
+
+# 学习型检测的类别编码，未列出的取值编码为 len(映射)
+PROTOCOL_NUMS = {"CAN": 0, "ETH": 1, "V2X": 2}
+DOMAIN_NUMS = {"powertrain": 0, "chassis": 1, "body": 2, "infotainment": 3, "v2x": 4}
+
+
+def parse_can_id(msg_id: str) -> int:
+    """解析 "0x0C0" 形式的CAN ID，无法解析返回 -1"""
+    if not msg_id.startswith("0x") or "." in msg_id:
+        return -1
+    try:
+        return int(msg_id, 16)
+    except ValueError:
+        return -1
+
+
+def msg_id_num(msg_id: str) -> int:
+    """报文ID的数值特征：CAN ID 取其数值，其余取哈希"""
+    can_id = parse_can_id(msg_id)
+    return can_id if can_id >= 0 else zlib.crc32(msg_id.encode()) % 0xFFF
+
+
+def byte_entropy(flat: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """按行计算拼接在一起的变长负载的字节熵（比特）"""
+    n = len(lengths)
+    if n == 0 or len(flat) == 0:
+        return np.zeros(n, dtype=np.float64)
+    rows = np.repeat(np.arange(n, dtype=np.int64), lengths)
+    # 只统计出现过的 (行, 字节值) 组合，避免 N x 256 的稠密矩阵
+    keys, counts = np.unique(rows * 256 + flat, return_counts=True)
+    owner = keys >> 8
+    p = counts / lengths[owner]
+    return -np.bincount(owner, weights=p * np.log2(p), minlength=n)
+
+
+class PacketRow(NamedTuple):
+    """检测读取路径使用的只读报文，字段与 UnifiedPacket 一致
+
+    由查询行直接构造，省去 pydantic 模型的构造开销；检测器只读取属性。
+    """
+
+    timestamp: float
+    protocol: str
+    source: str
+    destination: str
+    msg_id: str
+    payload_hex: str = ""
+    payload_decoded: dict = {}
+    domain: str = ""
+    metadata: dict = {}
+    vehicle_id: str = DEFAULT_VEHICLE_ID
+
+
+@dataclass
+class PacketBatch:
+    """按时间升序排列的一批报文的列式视图"""
+
+    packets: list           # UnifiedPacket 或 PacketRow，与各列一一对应
+    timestamps: np.ndarray  # float64 (N,)
+    is_can: np.ndarray      # bool (N,)
+    can_ids: np.ndarray     # int32 (N,)，非CAN或无法解析为 -1
+    dlc: np.ndarray         # uint8 (N,)
+    payload: np.ndarray     # uint8 (N, 8)，CAN 负载，不足部分补 0
+    protocol: np.ndarray    # int8 (N,)，PROTOCOL_NUMS 编码
+    domain: np.ndarray      # int8 (N,)，DOMAIN_NUMS 编码
+    msg_num: np.ndarray     # int64 (N,)，msg_id_num
+    payload_len: np.ndarray # int32 (N,)，完整负载长度
+    entropy: np.ndarray     # float64 (N,)，完整负载的字节熵
+
+    @classmethod
+    def _build(cls, packets: List[UnifiedPacket], timestamps: Sequence[float],
+               protocols: Sequence[str], msg_ids: Sequence[str],
+               domains: Sequence[str], payloads: Sequence[bytes]) -> "PacketBatch":
+        n = len(timestamps)
+        proto_num = np.fromiter(
+            (PROTOCOL_NUMS.get(p, len(PROTOCOL_NUMS)) for p in protocols), dtype=np.int8, count=n,
+        )
+        domain_num = np.fromiter(
+            (DOMAIN_NUMS.get(d, len(DOMAIN_NUMS)) for d in domains), dtype=np.int8, count=n,
+        )
+        # 同一批次中报文ID重复度很高，按取值缓存解析结果
+        nums, can = {}, {}
+        for m in set(msg_ids):
+            nums[m] = msg_id_num(m)
+            can[m] = parse_can_id(m)
+        msg_num = np.fromiter((nums[m] for m in msg_ids), dtype=np.int64, count=n)
+
+        is_can = proto_num == PROTOCOL_NUMS["CAN"]
+        can_ids = np.fromiter((can[m] for m in msg_ids), dtype=np.int32, count=n)
+        can_ids[~is_can] = -1
+
+        lengths = np.fromiter((len(b) for b in payloads), dtype=np.int32, count=n)
+        flat = np.frombuffer(b"".join(payloads), dtype=np.uint8)
+        offsets = np.zeros(n, dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+
+        # CAN 负载：取前 8 字节按偏移一次性聚合
+        dlc = np.where(is_can, np.minimum(lengths, CAN_MAX_DLC), 0).astype(np.uint8)
+        cols = np.arange(CAN_MAX_DLC)
+        valid = cols < dlc[:, None]
+        payload = np.zeros((n, CAN_MAX_DLC), dtype=np.uint8)
+        if valid.any():
+            payload[valid] = flat[(offsets[:, None] + cols)[valid]]
+
+        return cls(
+            packets=packets,
+            timestamps=np.asarray(timestamps, dtype=np.float64),
+            is_can=is_can,
+            can_ids=can_ids,
+            dlc=dlc,
+            payload=payload,
+            protocol=proto_num,
+            domain=domain_num,
+            msg_num=msg_num,
+            payload_len=lengths,
+            entropy=byte_entropy(flat, lengths),
+        )
+
+    @classmethod
+    def from_packets(cls, packets: List[UnifiedPacket]) -> "PacketBatch":
+        return cls._build(
+            packets,
+            [p.timestamp for p in packets],
+            [p.protocol for p in packets],
+            [p.msg_id for p in packets],
+            [p.domain for p in packets],
+            [bytes.fromhex(p.payload_hex) if p.payload_hex else b"" for p in packets],
+        )
+
+    @classmethod
+    def from_rows(cls, packets: List[PacketRow], payloads: List[bytes]) -> "PacketBatch":
+        """由查询行还原的报文与原始负载字节构造，无需十六进制往返"""
+        return cls._build(
+            packets,
+            [p.timestamp for p in packets],
+            [p.protocol for p in packets],
+            [p.msg_id for p in packets],
+            [p.domain for p in packets],
+            payloads,
+        )
+
+    def take(self, index: np.ndarray) -> "PacketBatch":
+        """按下标取子批次（保持原有顺序）"""
+        return PacketBatch(
+            packets=[self.packets[i] for i in index.tolist()],
+            timestamps=self.timestamps[index],
+            is_can=self.is_can[index],
+            can_ids=self.can_ids[index],
+            dlc=self.dlc[index],
+            payload=self.payload[index],
+            protocol=self.protocol[index],
+            domain=self.domain[index],
+            msg_num=self.msg_num[index],
+            payload_len=self.payload_len[index],
+            entropy=self.entropy[index],
+        )
+
+    def features(self) -> np.ndarray:
+        """Isolation Forest 特征矩阵 [msg_id_num, payload_len, byte_entropy, protocol, domain]"""
+        return np.column_stack((
+            self.msg_num, self.payload_len, self.entropy, self.protocol, self.domain,
+        )).astype(np.float64)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def can_indices(self) -> np.ndarray:
+        """CAN 报文在批次中的下标（保持时间顺序）"""
+        return np.flatnonzero(self.is_can)
@@ -0,0 +1,381 @@
+"""紧凑报文存储
+
+packets 表只保存定长数值列和原始负载：
+- 协议、节点、报文ID、功能域、车辆ID 等重复字符串编码为 string_dict 中的小整数
+- 元数据按内容去重为 metadata_profiles，报文只保存画像ID
+- 可由 (协议, 报文ID, 负载) 重新推导的解码结果不落库，读取时惰性解码并缓存；
+  仅与推导结果不一致的解码内容（如V2X运动学字段、模拟攻击标注）写入 payload_extra
+- 事务中新分配的编码与画像先记在该会话的待提交表中，事务提交后才并入进程内缓存，
+  回滚时丢弃，缓存中不会留下已回滚（编号可能被复用）的编码
+"""
+
+import asyncio
+import hashlib
+import json
+from collections import ChainMap
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.packet import (
+    MetadataProfileORM, PacketORM, StringDictORM, UnifiedPacket,
+)
+from app.services.packet_batch import PacketBatch, PacketRow
+from app.services.traffic_parser import CANParser, EthernetParser
+
+
+# 字典类别：源节点与目的节点共用 node
+KIND_PROTOCOL = "protocol"
+KIND_NODE = "node"
+KIND_MSG = "msg"
+KIND_DOMAIN = "domain"
+KIND_VEHICLE = "vehicle"
+KIND_SEVERITY = "severity"  # 仅时间桶汇总使用
+
+# 读取报文时选择的列（不含主键以外的冗余字段）
+PACKET_COLUMNS = (
+    PacketORM.id,
+    PacketORM.timestamp,
+    PacketORM.vehicle_code,
+    PacketORM.protocol_code,
+    PacketORM.source_code,
+    PacketORM.destination_code,
+    PacketORM.msg_code,
+    PacketORM.domain_code,
+    PacketORM.payload,
+    PacketORM.payload_extra,
+    PacketORM.profile_id,
+)
+
+
+# 报文插入事务的 PostgreSQL 咨询锁键（任意固定值，各进程一致即可）
+PACKET_INSERT_LOCK = 0x47475041
+
+# encode_packets 生成的行字典中的列，COPY 按此顺序导入
+ROW_COLUMNS = (
+    "timestamp", "vehicle_code", "protocol_code", "source_code", "destination_code",
+    "msg_code", "domain_code", "payload", "payload_extra", "profile_id",
+)
+
+
+@lru_cache(maxsize=65536)
+def derive_decoded(protocol: str, msg_id: str, payload: bytes) -> Optional[dict]:
+    """由负载推导解码结果，无法推导的协议返回 None（结果共享，调用方不得修改）"""
+    if protocol == "CAN":
+        return CANParser.decode(msg_id, payload.hex().upper())
+    if protocol == "ETH":
+        return EthernetParser.decode(msg_id, payload.hex().upper())
+    return None
+
+
+def _insert_ignore(db: AsyncSession, model):
+    """按方言构造 INSERT ... ON CONFLICT DO NOTHING"""
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model).on_conflict_do_nothing()
+
+
+async def _copy_rows(db: AsyncSession, rows: List[dict]) -> None:
+    """经 asyncpg copy_records_to_table 以 COPY 协议导入报文行"""
+    conn = await db.connection()
+    # asyncpg 适配器在首条语句执行时才开启事务，先执行一条语句使 COPY 落在当前事务中
+    await conn.execute(select(1))
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        PacketORM.__tablename__,
+        records=[tuple(r[c] for c in ROW_COLUMNS) for r in rows],
+        columns=ROW_COLUMNS,
+    )
+
+
+@dataclass
+class _Pending:
+    """单个事务内新分配、尚未提交的编码与画像"""
+
+    codes: Dict[Tuple[str, str], int] = field(default_factory=dict)
+    values: Dict[int, str] = field(default_factory=dict)
+    profile_ids: Dict[str, int] = field(default_factory=dict)
+    profiles: Dict[int, dict] = field(default_factory=dict)
+
+
+PENDING_KEY = "packet_store_pending"
+
+
+class PacketStore:
+    """字符串字典与元数据画像的进程内缓存，负责报文行的编码与还原"""
+
+    def __init__(self):
+        self._codes: Dict[Tuple[str, str], int] = {}
+        self._values: Dict[int, str] = {}
+        self._profile_ids: Dict[str, int] = {}
+        self._profiles: Dict[int, dict] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    async def _reload(self, db: AsyncSession) -> None:
+        rows = await db.execute(
+            select(StringDictORM.id, StringDictORM.kind, StringDictORM.value)
+        )
+        for code, kind, value in rows:
+            self._codes[(kind, value)] = code
+            self._values[code] = value
+        rows = await db.execute(
+            select(MetadataProfileORM.id, MetadataProfileORM.digest,
+                   MetadataProfileORM.metadata_json)
+        )
+        for pid, digest, meta in rows:
+            self._profile_ids[digest] = pid
+            self._profiles[pid] = json.loads(meta)
+        self._loaded = True
+
+    async def _ensure_loaded(self, db: AsyncSession) -> None:
+        if not self._loaded:
+            await self._reload(db)
+
+    @staticmethod
+    def _pending(db: AsyncSession) -> _Pending:
+        return db.info.setdefault(PENDING_KEY, _Pending())
+
+    def _codes_for(self, db: AsyncSession) -> ChainMap:
+        """已提交的编码与本事务待提交的编码"""
+        return ChainMap(self._pending(db).codes, self._codes)
+
+    def _publish(self, pending: _Pending) -> None:
+        self._codes.update(pending.codes)
+        self._values.update(pending.values)
+        self._profile_ids.update(pending.profile_ids)
+        self._profiles.update(pending.profiles)
+
+    async def _intern(self, db: AsyncSession, keys: Iterable[Tuple[str, str]]) -> None:
+        """为缺失的 (kind, value) 分配编码；并发写入由唯一约束去重"""
+        pending = self._pending(db)
+        missing = {k for k in keys if k not in self._codes and k not in pending.codes}
+        if not missing:
+            return
+        await db.execute(
+            _insert_ignore(db, StringDictORM),
+            [{"kind": kind, "value": value} for kind, value in missing],
+        )
+        rows = await db.execute(
+            select(StringDictORM.id, StringDictORM.kind, StringDictORM.value)
+            .where(StringDictORM.value.in_({value for _, value in missing}))
+        )
+        for code, kind, value in rows:
+            if (kind, value) in missing:
+                pending.codes[(kind, value)] = code
+                pending.values[code] = value
+
+    async def _intern_profiles(self, db: AsyncSession, profiles: Dict[str, str]) -> None:
+        pending = self._pending(db)
+        missing = {d: m for d, m in profiles.items()
+                   if d not in self._profile_ids and d not in pending.profile_ids}
+        if not missing:
+            return
+        await db.execute(
+            _insert_ignore(db, MetadataProfileORM),
+            [{"digest": d, "metadata_json": m} for d, m in missing.items()],
+        )
+        rows = await db.execute(
+            select(MetadataProfileORM.id, MetadataProfileORM.digest,
+                   MetadataProfileORM.metadata_json)
+            .where(MetadataProfileORM.digest.in_(missing))
+        )
+        for pid, digest, meta in rows:
+            pending.profile_ids[digest] = pid
+            pending.profiles[pid] = json.loads(meta)
+
+    async def encode_packets(self, db: AsyncSession, packets: List[UnifiedPacket]) -> List[dict]:
+        """将报文编码为 packets 表的行字典（新字符串/画像在同一事务中写入）"""
+        async with self._lock:
+            await self._ensure_loaded(db)
+
+            keys = set()
+            metas = []
+            profiles = {}
+            for p in packets:
+                keys.update((
+                    (KIND_PROTOCOL, p.protocol),
+                    (KIND_NODE, p.source),
+                    (KIND_NODE, p.destination),
+                    (KIND_MSG, p.msg_id),
+                    (KIND_DOMAIN, p.domain),
+                    (KIND_VEHICLE, p.vehicle_id),
+                ))
+                meta = json.dumps(p.metadata, ensure_ascii=False, sort_keys=True)
+                digest = hashlib.sha1(meta.encode("utf-8")).hexdigest()
+                metas.append(digest)
+                profiles[digest] = meta
+            await self._intern(db, keys)
+            await self._intern_profiles(db, profiles)
+
+        codes = self._codes_for(db)
+        profile_ids = ChainMap(self._pending(db).profile_ids, self._profile_ids)
+        rows = []
+        for p, digest in zip(packets, metas):
+            payload = bytes.fromhex(p.payload_hex) if p.payload_hex else b""
+            extra = None
+            if p.payload_decoded and p.payload_decoded != derive_decoded(p.protocol, p.msg_id, payload):
+                extra = json.dumps(p.payload_decoded, ensure_ascii=False)
+            rows.append({
+                "timestamp": p.timestamp,
+                "vehicle_code": codes[(KIND_VEHICLE, p.vehicle_id)],
+                "protocol_code": codes[(KIND_PROTOCOL, p.protocol)],
+                "source_code": codes[(KIND_NODE, p.source)],
+                "destination_code": codes[(KIND_NODE, p.destination)],
+                "msg_code": codes[(KIND_MSG, p.msg_id)],
+                "domain_code": codes[(KIND_DOMAIN, p.domain)],
+                "payload": payload,
+                "payload_extra": extra,
+                "profile_id": profile_ids[digest],
+            })
+        return rows
+
+    async def insert_rows(self, db: AsyncSession, rows: List[dict]) -> None:
+        """写入 encode_packets 生成的行；PostgreSQL 上行数较多时改用 COPY
+
+        检测游标按报文ID推进，要求报文ID按提交顺序可见。SQLite 写事务本身串行；
+        PostgreSQL 上多个进程的写协程并发插入时，序列号先分配、后提交的事务会让
+        游标越过尚未提交的较小ID。因此插入前取事务级咨询锁，持有到提交或回滚，
+        各进程的报文插入事务依次分配ID、依次提交。
+        """
+        if not rows:
+            return
+        if db.bind.dialect.name == "postgresql":
+            await db.execute(select(func.pg_advisory_xact_lock(PACKET_INSERT_LOCK)))
+            if len(rows) >= settings.database.copy_min_rows:
+                await _copy_rows(db, rows)
+                return
+        await db.execute(insert(PacketORM), rows)
+
+    async def intern(self, db: AsyncSession, keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+        """返回 (kind, value) 的编码，缺失的在当前事务中分配"""
+        keys = set(keys)
+        async with self._lock:
+            await self._ensure_loaded(db)
+            await self._intern(db, keys)
+        codes = self._codes_for(db)
+        return {k: codes[k] for k in keys}
+
+    async def code_of(self, db: AsyncSession, kind: str, value: str) -> Optional[int]:
+        """查询过滤条件用的编码，不存在返回 None（即不可能有匹配的报文）"""
+        async with self._lock:
+            await self._ensure_loaded(db)
+            code = self._codes.get((kind, value))
+            if code is None:
+                # 可能由其他进程新写入
+                await self._reload(db)
+                code = self._codes.get((kind, value))
+        return code
+
+    async def ensure_codes(self, db: AsyncSession, codes: Iterable[Optional[int]]) -> None:
+        """确保给定编码均可还原，存在未知编码（其他进程新写入）时重新加载"""
+        async with self._lock:
+            await self._ensure_loaded(db)
+            if any(c is not None and c not in self._values for c in codes):
+                await self._reload(db)
+
+    async def prepare(self, db: AsyncSession, rows) -> None:
+        """确保行中引用的编码与画像均可还原（读取前调用）"""
+        async with self._lock:
+            await self._ensure_loaded(db)
+            values = self._values
+            for r in rows:
+                if (any(c is not None and c not in values for c in (
+                        r.vehicle_code, r.protocol_code, r.source_code,
+                        r.destination_code, r.msg_code, r.domain_code))
+                        or (r.profile_id is not None and r.profile_id not in self._profiles)):
+                    await self._reload(db)
+                    return
+
+    def value(self, code: Optional[int]) -> str:
+        if code is None:
+            return ""
+        return self._values.get(code, "")
+
+    def row_fields(self, r) -> dict:
+        """还原报文行的字符串字段（不含解码结果）"""
+        return {
+            "id": r.id,
+            "vehicle_id": self.value(r.vehicle_code),
+            "timestamp": r.timestamp,
+            "protocol": self.value(r.protocol_code),
+            "source": self.value(r.source_code),
+            "destination": self.value(r.destination_code),
+            "msg_id": self.value(r.msg_code),
+            "domain": self.value(r.domain_code),
+        }
+
+    def metadata(self, r) -> dict:
+        return dict(self._profiles.get(r.profile_id, {}))
+
+    def decoded(self, r) -> dict:
+        """惰性解码：优先使用落库的解码内容，否则由负载推导"""
+        if r.payload_extra:
+            return json.loads(r.payload_extra)
+        derived = derive_decoded(
+            self.value(r.protocol_code), self.value(r.msg_code), r.payload or b"",
+        )
+        return dict(derived) if derived else {}
+
+    def to_packet(self, r, decode: bool = True) -> UnifiedPacket:
+        """还原为 UnifiedPacket；decode=False 时跳过可推导的解码以节省开销"""
+        fields = self.row_fields(r)
+        fields.pop("id")
+        if decode:
+            payload_decoded = self.decoded(r)
+        else:
+            payload_decoded = json.loads(r.payload_extra) if r.payload_extra else {}
+        return UnifiedPacket(
+            payload_hex=r.payload.hex().upper() if r.payload else "",
+            payload_decoded=payload_decoded,
+            metadata=self.metadata(r),
+            **fields,
+        )
+
+    def detection_batch(self, rows) -> PacketBatch:
+        """检测读取路径：查询行直接填充列式批次
+
+        报文以轻量的 PacketRow 表示，元数据共享画像缓存（检测器只读，不得修改）；
+        可推导的解码结果不还原，只有 payload_extra 非空的行（如V2X运动学字段）解析 JSON。
+        """
+        values, profiles = self._values, self._profiles
+        empty: dict = {}
+        packets = [
+            PacketRow(
+                r.timestamp,
+                values.get(r.protocol_code, ""),
+                values.get(r.source_code, ""),
+                values.get(r.destination_code, ""),
+                values.get(r.msg_code, ""),
+                r.payload.hex().upper() if r.payload else "",
+                json.loads(r.payload_extra) if r.payload_extra else empty,
+                values.get(r.domain_code, ""),
+                profiles.get(r.profile_id, empty),
+                values.get(r.vehicle_code, ""),
+            )
+            for r in rows
+        ]
+        return PacketBatch.from_rows(packets, [r.payload or b"" for r in rows])
+
+packet_store = PacketStore()
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session) -> None:
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending is not None:
+        packet_store._publish(pending)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_pending(session: Session, transaction) -> None:
+    # 提交时已由 after_commit 取走；此处只剩回滚或未提交即关闭的事务
+    if transaction.parent is None:
+        session.info.pop(PENDING_KEY, None)
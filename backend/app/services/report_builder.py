@@ -0,0 +1,118 @@
+"""预警报告的本地预聚合
+
+报告提示不再包含逐条事件，而是按 (类型, 来源, 严重程度) 聚合后的紧凑表格：
+- 分组数受事件种类约束，与事件总数无关
+- 分组过多时按攻击类型切分为若干块，先并发生成分块摘要（map），
+  再与全局概览一起做一次归并（reduce）
+"""
+
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from app.models.anomaly import AnomalyEvent
+
+SEVERITY_RANK = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+
+TABLE_HEADER = "类型|来源|严重程度|次数|首次|末次|协议|最高置信度|示例描述"
+
+
+@dataclass
+class EventGroup:
+    anomaly_type: str
+    source_node: str
+    severity: str
+    count: int = 0
+    first_ts: float = 0.0
+    last_ts: float = 0.0
+    max_confidence: float = 0.0
+    protocols: Counter = field(default_factory=Counter)
+    sample: str = ""
+
+    def row(self) -> str:
+        protocols = ",".join(p for p, _ in self.protocols.most_common(3))
+        return "|".join([
+            self.anomaly_type,
+            self.source_node or "-",
+            self.severity,
+            str(self.count),
+            _fmt_ts(self.first_ts),
+            _fmt_ts(self.last_ts),
+            protocols or "-",
+            f"{self.max_confidence:.2f}",
+            self.sample[:60],
+        ])
+
+
+def _fmt_ts(ts: float) -> str:
+    return time.strftime("%m-%d %H:%M:%S", time.localtime(ts))
+
+
+def group_events(events: List[AnomalyEvent]) -> List[EventGroup]:
+    """按 (类型, 来源, 严重程度) 聚合，按严重程度、次数排序"""
+    groups: Dict[tuple, EventGroup] = {}
+    for e in events:
+        key = (e.anomaly_type, e.source_node, e.severity)
+        g = groups.get(key)
+        if g is None:
+            g = groups[key] = EventGroup(
+                e.anomaly_type, e.source_node, e.severity,
+                first_ts=e.timestamp, last_ts=e.timestamp, sample=e.description,
+            )
+        g.count += 1
+        g.first_ts = min(g.first_ts, e.timestamp)
+        g.last_ts = max(g.last_ts, e.timestamp)
+        g.max_confidence = max(g.max_confidence, e.confidence or 0.0)
+        if e.protocol:
+            g.protocols[e.protocol] += 1
+    return sorted(
+        groups.values(),
+        key=lambda g: (SEVERITY_RANK.get(g.severity, 9), -g.count),
+    )
+
+
+def overview(events: List[AnomalyEvent], groups: List[EventGroup]) -> str:
+    """全局概览：总数、时间范围、按严重程度 / 类型 / 来源的计数"""
+    by_severity = Counter(e.severity for e in events)
+    by_type = Counter(e.anomaly_type for e in events)
+    by_source = Counter(e.source_node for e in events if e.source_node)
+    ts = [e.timestamp for e in events]
+    lines = [
+        f"事件总数: {len(events)}，分组数: {len(groups)}",
+        f"时间范围: {_fmt_ts(min(ts))} ~ {_fmt_ts(max(ts))}",
+        "严重程度: " + ", ".join(
+            f"{s}={by_severity[s]}" for s in SEVERITY_RANK if by_severity.get(s)
+        ),
+        "攻击类型: " + ", ".join(f"{t}={n}" for t, n in by_type.most_common(8)),
+        "主要来源: " + ", ".join(f"{s}={n}" for s, n in by_source.most_common(8)),
+    ]
+    return "\n".join(lines)
+
+
+def table(groups: List[EventGroup]) -> str:
+    return "\n".join([TABLE_HEADER, *(g.row() for g in groups)])
+
+
+def partition(groups: List[EventGroup], chunk_rows: int, max_chunks: int) -> List[List[EventGroup]]:
+    """按攻击类型切分为不超过 max_chunks 块，每块不超过 chunk_rows 行
+
+    同一类型的分组尽量放在同一块；超出块数上限的低优先级分组被丢弃，
+    其数量已体现在全局概览中。
+    """
+    by_type: Dict[str, List[EventGroup]] = {}
+    for g in groups:
+        by_type.setdefault(g.anomaly_type, []).append(g)
+
+    chunks: List[List[EventGroup]] = []
+    current: List[EventGroup] = []
+    for type_groups in by_type.values():
+        for i in range(0, len(type_groups), chunk_rows):
+            part = type_groups[i:i + chunk_rows]
+            if current and len(current) + len(part) > chunk_rows:
+                chunks.append(current)
+                current = []
+            current.extend(part)
+    if current:
+        chunks.append(current)
+    return chunks[:max_chunks]
@@ -0,0 +1,218 @@
+"""后台预警报告任务
+
+报告生成耗时取决于 LLM 调用，不再占用 HTTP 请求：
+- 提交后立即返回任务ID，客户端轮询状态或通过 WebSocket 订阅结果
+- 固定数量的工作协程从有界队列取任务，同时进行的生成数受 llm.report_workers 约束
+- 幂等键相同的重复提交（如客户端超时重试）复用已有任务，不会重复生成
+- 生成的报告照常写入 analysis_reports，任务状态只保存在内存中
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import async_session
+from app.models.anomaly import AnomalyEvent, AnomalyEventORM
+from app.models.report import AnalysisReportORM
+
+logger = logging.getLogger("gatewayguard.report_jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class ReportJob:
+    id: str
+    limit: int
+    idempotency_key: str
+    status: str = QUEUED
+    report: Optional[dict] = None
+    report_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "limit": self.limit,
+            "report": self.report,
+            "report_id": self.report_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ReportJobManager:
+    """报告任务队列与工作协程池"""
+
+    def __init__(self, engine):
+        cfg = settings.llm
+        self.engine = engine
+        self.workers = max(1, cfg.report_workers)
+        self.ttl = cfg.report_job_ttl
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=cfg.report_queue_size)
+        self._jobs: Dict[str, ReportJob] = {}
+        self._keys: Dict[str, str] = {}
+        self._watchers: Dict[str, Set[asyncio.Queue]] = {}
+        self._tasks: List[asyncio.Task] = []
+
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker(i)) for i in range(self.workers)
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _expire(self) -> None:
+        deadline = time.time() - self.ttl
+        for job in [j for j in self._jobs.values() if j.finished and j.finished_at < deadline]:
+            del self._jobs[job.id]
+            if self._keys.get(job.idempotency_key) == job.id:
+                del self._keys[job.idempotency_key]
+
+    def submit(self, limit: int, idempotency_key: Optional[str] = None) -> dict:
+        """提交报告任务；幂等键对应的任务未失败时直接返回该任务"""
+        self._expire()
+        key = idempotency_key or f"auto:{uuid.uuid4().hex}"
+        job_id = self._keys.get(key)
+        if job_id is not None:
+            job = self._jobs[job_id]
+            if job.status != FAILED:
+                self.deduplicated += 1
+                return {**job.to_dict(), "deduplicated": True}
+
+        job = ReportJob(id=uuid.uuid4().hex, limit=limit, idempotency_key=key)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return {"error": "报告任务队列已满，请稍后重试"}
+        self._jobs[job.id] = job
+        self._keys[key] = job.id
+        self.submitted += 1
+        return {**job.to_dict(), "deduplicated": False}
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        return self._jobs.get(job_id)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """订阅任务状态变化，返回接收 ReportJob.to_dict() 的队列"""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._watchers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        watchers = self._watchers.get(job_id)
+        if watchers is not None:
+            watchers.discard(queue)
+            if not watchers:
+                del self._watchers[job_id]
+
+    def _notify(self, job: ReportJob) -> None:
+        for queue in self._watchers.get(job.id, ()):
+            queue.put_nowait(job.to_dict())
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._notify(job)
+                job.report, job.report_id = await self._generate(job.limit)
+                job.status = DONE
+            except asyncio.CancelledError:
+                raise
+            except LookupError as e:
+                job.status = FAILED
+                job.error = str(e)
+            except Exception as e:
+                logger.exception("报告任务 %s 失败", job.id)
+                job.status = FAILED
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                self._notify(job)
+                self._queue.task_done()
+
+    async def _generate(self, limit: int):
+        async with async_session() as db:
+            result = await db.execute(
+                select(
+                    AnomalyEventORM.timestamp, AnomalyEventORM.anomaly_type,
+                    AnomalyEventORM.severity, AnomalyEventORM.confidence,
+                    AnomalyEventORM.protocol, AnomalyEventORM.source_node,
+                    AnomalyEventORM.description, AnomalyEventORM.detection_method,
+                )
+                .order_by(AnomalyEventORM.timestamp.desc())
+                .limit(limit)
+            )
+            rows = result.all()
+            if not rows:
+                raise LookupError("No anomaly events found")
+
+            events = [
+                AnomalyEvent(
+                    timestamp=r.timestamp,
+                    anomaly_type=r.anomaly_type,
+                    severity=r.severity,
+                    confidence=r.confidence or 0,
+                    protocol=r.protocol or "",
+                    source_node=r.source_node or "",
+                    description=r.description or "",
+                    detection_method=r.detection_method or "",
+                )
+                for r in rows
+            ]
+
+            report_data = await self.engine.generate_report(events)
+
+            report = AnalysisReportORM(
+                report_type="alert_report",
+                content=json.dumps(report_data, ensure_ascii=False),
+                llm_model=self.engine.model,
+            )
+            db.add(report)
+            await db.commit()
+            return report_data, report.id
+
+    def stats(self) -> dict:
+        by_status: Dict[str, int] = {}
+        for job in self._jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize(),
+            "jobs": by_status,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,138 @@
+"""读接口响应缓存
+
+按 (路径, 查询参数) 缓存序列化后的响应体，并以写入驱动失效：
+- 每类数据维护一个代计数器（packets / events），报文入库、告警写入、
+  归档与 /api/system/clear-* 写入后递增对应计数器
+- 缓存项记录生成时依赖的代号，代号变化即视为失效，无需扫描或主动删除
+- ETag 为响应体摘要；客户端携带 If-None-Match 且内容未变时返回 304
+- 缓存项最长保留 cache.ttl 秒，兜底其他进程（共享内存检测进程）直接写库的情况
+- 代计数器只在本进程内递增，多个 API 进程（uvicorn --workers）时无法感知
+  其他进程的写入，此时缓存自动关闭
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from app.config import settings
+
+GEN_PACKETS = "packets"
+GEN_EVENTS = "events"
+
+
+Generations = Tuple[Tuple[str, int], ...]
+
+
+@dataclass
+class CacheEntry:
+    generations: Generations
+    etag: str
+    body: bytes
+    created: float
+
+
+def api_workers() -> int:
+    """API 进程数：cache.api_workers 与 uvicorn 读取的 WEB_CONCURRENCY 取较大者"""
+    try:
+        env = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    except ValueError:
+        env = 1
+    return max(settings.cache.api_workers, env)
+
+
+class ResponseCache:
+    """进程内 LRU 响应缓存"""
+
+    def __init__(self):
+        cfg = settings.cache
+        self.api_workers = api_workers()
+        self.enabled = cfg.enabled and self.api_workers <= 1
+        self.ttl = cfg.ttl
+        self.max_entries = cfg.max_entries
+        self._generations: Dict[str, int] = {GEN_PACKETS: 0, GEN_EVENTS: 0}
+        self._entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def bump(self, *names: str) -> None:
+        """数据写入后调用，使依赖这些数据的缓存项失效"""
+        for name in names:
+            self._generations[name] += 1
+
+    @staticmethod
+    def _key(request: Request) -> tuple:
+        return request.url.path, tuple(sorted(request.query_params.multi_items()))
+
+    def snapshot(self, *deps: str) -> Generations:
+        """读取依赖数据的当前代号，须在查询数据库之前调用"""
+        return tuple((d, self._generations[d]) for d in deps)
+
+    @staticmethod
+    def _respond(request: Request, entry: CacheEntry) -> Response:
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == entry.etag:
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type="application/json", headers=headers)
+
+    def lookup(self, request: Request, generations: Generations) -> Optional[Response]:
+        """命中且未失效时返回响应（200 或 304），否则返回 None"""
+        if not self.enabled:
+            return None
+        key = self._key(request)
+        entry = self._entries.get(key)
+        if (entry is None or entry.generations != generations
+                or time.monotonic() - entry.created > self.ttl):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        response = self._respond(request, entry)
+        if response.status_code == 304:
+            self.not_modified += 1
+        return response
+
+    def store(self, request: Request, generations: Generations, result) -> Response:
+        """序列化结果并以计算前的代号缓存，计算期间发生的写入会使其立即失效"""
+        body = json.dumps(jsonable_encoder(result), ensure_ascii=False).encode("utf-8")
+        entry = CacheEntry(
+            generations=generations,
+            etag=f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"',
+            body=body,
+            created=time.monotonic(),
+        )
+        if self.enabled:
+            key = self._key(request)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        response = self._respond(request, entry)
+        if response.status_code == 304:
+            self.not_modified += 1
+        return response
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "api_workers": self.api_workers,
+            "entries": len(self._entries),
+            "generations": dict(self._generations),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+response_cache = ResponseCache()
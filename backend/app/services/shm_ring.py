@@ -0,0 +1,258 @@
+"""共享内存环形缓冲区
+
+多个 API 进程将解析后的报文写入定长记录组成的环形缓冲区，
+独立检测进程按槽位区间整块复制结构化记录，由各列直接构造检测批次，
+无需在进程间 pickle 报文列表，也不逐帧构造 pydantic 模型。
+
+内存布局：
+    [0, 64)      头部：write_seq(u8) | capacity(u8) | record_size(u8)
+    [64, ...)    capacity 个 RECORD_DTYPE 定长记录
+
+写入方通过文件锁互斥地申请序号区间，先写数据再写槽位 seq 作为提交标记；
+读取方各自维护游标，复制前后各校验一次槽位 seq，复制期间被覆盖的记录不会被消费。
+共享内存段在进程退出后保留，重启时复用；需要释放时调用 unlink()。
+"""
+
+import fcntl
+import os
+import tempfile
+import zlib
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.models.packet import UnifiedPacket
+from app.services.packet_batch import PROTOCOL_NUMS, PacketBatch, PacketRow
+
+
+HEADER_SIZE = 64
+PAYLOAD_SIZE = 64
+
+PROTOCOL_NAMES = {v: k for k, v in PROTOCOL_NUMS.items()}
+# 初始训练按 metadata["attack"] 排除标注的攻击流量，标记随记录传递
+ATTACK_METADATA = {"attack": True}
+
+RECORD_DTYPE = np.dtype([
+    ("seq", "<u8"),               # 提交标记：写入序号 + 1，0 表示空槽
+    ("timestamp", "<f8"),
+    ("vehicle_hash", "<u4"),      # crc32(vehicle_id)，用于分片
+    ("protocol", "u1"),
+    ("dlc", "u1"),
+    ("attack", "u1"),             # 1 表示 metadata 标注为攻击流量
+    ("vehicle_id", "S32"),
+    ("msg_id", "S16"),
+    ("source", "S16"),
+    ("destination", "S16"),
+    ("domain", "S16"),
+    ("latitude", "<f8"),          # V2X 运动学字段，其余协议为 0
+    ("longitude", "<f8"),
+    ("speed_kmh", "<f4"),
+    ("heading", "<f4"),
+    ("payload", "u1", (PAYLOAD_SIZE,)),
+], align=True)
+
+
+def vehicle_hash(vehicle_id: str) -> int:
+    """与 vehicle_registry.shard_of 一致的车辆哈希"""
+    return zlib.crc32(vehicle_id.encode("utf-8"))
+
+
+def encode_packets(packets: List[UnifiedPacket]) -> np.ndarray:
+    """将报文编码为定长记录数组（seq 字段留空，由写入方填写）"""
+    records = np.zeros(len(packets), dtype=RECORD_DTYPE)
+    for i, p in enumerate(packets):
+        rec = records[i]
+        payload = bytes.fromhex(p.payload_hex)[:PAYLOAD_SIZE] if p.payload_hex else b""
+        rec["timestamp"] = p.timestamp
+        rec["vehicle_hash"] = vehicle_hash(p.vehicle_id)
+        rec["protocol"] = PROTOCOL_NUMS.get(p.protocol, 255)
+        rec["dlc"] = len(payload)
+        rec["attack"] = bool(p.metadata.get("attack"))
+        rec["vehicle_id"] = p.vehicle_id.encode("utf-8")[:32]
+        rec["msg_id"] = p.msg_id.encode("utf-8")[:16]
+        rec["source"] = p.source.encode("utf-8")[:16]
+        rec["destination"] = p.destination.encode("utf-8")[:16]
+        rec["domain"] = p.domain.encode("utf-8")[:16]
+        rec["payload"][:len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+        if p.protocol == "V2X":
+            d = p.payload_decoded
+            rec["latitude"] = d.get("latitude", 0.0)
+            rec["longitude"] = d.get("longitude", 0.0)
+            rec["speed_kmh"] = d.get("speed_kmh", 0.0)
+            rec["heading"] = d.get("heading", 0.0)
+    return records
+
+
+def _text(records: np.ndarray, column: str) -> List[str]:
+    return [v.decode("utf-8", "replace") for v in records[column].tolist()]
+
+
+def detection_batch(records: np.ndarray) -> PacketBatch:
+    """检测进程：由记录的各列直接构造列式批次（报文以只读的 PacketRow 表示）"""
+    dlc = records["dlc"].tolist()
+    raw = records["payload"]
+    payloads = [raw[i, :n].tobytes() for i, n in enumerate(dlc)]
+    protocols = [PROTOCOL_NAMES.get(c, "UNKNOWN") for c in records["protocol"].tolist()]
+    empty: dict = {}
+    decoded = [empty] * len(records)
+    for i in np.flatnonzero(records["protocol"] == PROTOCOL_NUMS["V2X"]).tolist():
+        rec = records[i]
+        decoded[i] = {
+            "latitude": float(rec["latitude"]),
+            "longitude": float(rec["longitude"]),
+            "speed_kmh": float(rec["speed_kmh"]),
+            "heading": float(rec["heading"]),
+        }
+    metadata = [empty] * len(records)
+    for i in np.flatnonzero(records["attack"]).tolist():
+        metadata[i] = ATTACK_METADATA
+    packets = [
+        PacketRow(*fields)
+        for fields in zip(
+            records["timestamp"].tolist(), protocols,
+            _text(records, "source"), _text(records, "destination"), _text(records, "msg_id"),
+            [b.hex().upper() for b in payloads], decoded,
+            _text(records, "domain"), metadata, _text(records, "vehicle_id"),
+        )
+    ]
+    return PacketBatch.from_rows(packets, payloads)
+
+
+def _committed(seq: np.ndarray, expected: np.ndarray) -> int:
+    """seq 与期望序号连续一致的前缀长度"""
+    ready = seq == expected
+    return len(ready) if ready.all() else int(np.argmin(ready))
+
+
+class ShmRing:
+    """定长记录共享内存环形缓冲区（多写多读）"""
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        size = HEADER_SIZE + capacity * RECORD_DTYPE.itemsize
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.owner = True
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        # 共享内存段由多个互不相关的进程共用，不能随任一进程退出而被回收
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+
+        self._header = np.ndarray((3,), dtype="<u8", buffer=self._shm.buf)
+        if self.owner:
+            self._header[1] = capacity
+            self._header[2] = RECORD_DTYPE.itemsize
+        elif int(self._header[2]) != RECORD_DTYPE.itemsize:
+            raise RuntimeError(
+                f"共享内存 {name} 的记录格式不匹配: "
+                f"{int(self._header[2])} != {RECORD_DTYPE.itemsize}"
+            )
+        self.capacity = int(self._header[1])
+        self.records = np.ndarray(
+            (self.capacity,), dtype=RECORD_DTYPE,
+            buffer=self._shm.buf, offset=HEADER_SIZE,
+        )
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+    @contextmanager
+    def _write_lock(self):
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @property
+    def write_seq(self) -> int:
+        return int(self._header[0])
+
+    def _slices(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """将序号区间 [start, end) 映射为不跨越环尾的槽位区间"""
+        spans = []
+        while start < end:
+            pos = start % self.capacity
+            n = min(end - start, self.capacity - pos)
+            spans.append((pos, pos + n))
+            start += n
+        return spans
+
+    def write(self, records: np.ndarray) -> int:
+        """写入一批记录，返回本批起始序号；超出容量时只保留最新部分"""
+        if len(records) > self.capacity:
+            records = records[-self.capacity:]
+        with self._write_lock():
+            start = self.write_seq
+            end = start + len(records)
+            offset = 0
+            for lo, hi in self._slices(start, end):
+                n = hi - lo
+                self.records["seq"][lo:hi] = 0
+                self.records[lo:hi] = records[offset:offset + n]
+                # 数据写完后再写提交标记
+                self.records["seq"][lo:hi] = np.arange(
+                    start + offset + 1, start + offset + n + 1, dtype=np.uint64,
+                )
+                offset += n
+            self._header[0] = end
+        return start
+
+    def write_packets(self, packets: List[UnifiedPacket]) -> int:
+        return self.write(encode_packets(packets))
+
+    def read(self, cursor: int, max_records: int) -> Tuple[List[np.ndarray], int, int]:
+        """从游标处读取已提交记录
+
+        返回 (记录副本列表, 新游标, 被覆盖而丢弃的记录数)。
+        复制前确认槽位已提交，复制后再校验一次 seq：复制期间被写入方覆盖的
+        记录可能新旧混杂，连同其后的记录留给下一次读取按落后处理。
+        """
+        head = self.write_seq
+        dropped = 0
+        if head - cursor > self.capacity:
+            dropped = head - self.capacity - cursor
+            cursor = head - self.capacity
+        end = min(head, cursor + max_records)
+
+        chunks = []
+        pos = cursor
+        for lo, hi in self._slices(cursor, end):
+            view = self.records[lo:hi]
+            expected = np.arange(pos + 1, pos + (hi - lo) + 1, dtype=np.uint64)
+            n = _committed(view["seq"], expected)
+            chunk = view[:n].copy()
+            n = _committed(view["seq"][:n], expected[:n])
+            if n:
+                chunks.append(chunk[:n])
+            pos += n
+            if n < hi - lo:
+                break
+        return chunks, pos, dropped
+
+    def close(self) -> None:
+        self._header = None
+        self.records = None
+        self._shm.close()
+
+    def unlink(self) -> None:
+        # SharedMemory.unlink 会向 resource_tracker 注销，需先重新登记
+        resource_tracker.register(self._shm._name, "shared_memory")
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+_ingest_ring = None
+
+
+def get_ingest_ring() -> ShmRing:
+    """当前进程共用的写入端环形缓冲区（按配置懒加载）"""
+    global _ingest_ring
+    if _ingest_ring is None:
+        _ingest_ring = ShmRing(settings.ingest.shm_name, settings.ingest.shm_capacity)
+    return _ingest_ring
@@ -0,0 +1,182 @@
+"""SOME/IP 二进制解析
+
+直接解析 UDP/TCP 负载中的 SOME/IP 报文：
+- 头部按 AUTOSAR SOME/IP 协议定义（16 字节，大端）：
+  Message ID (Service ID + Method ID) | Length | Request ID (Client ID + Session ID) |
+  Protocol Version | Interface Version | Message Type | Return Code
+- 一个数据报可以包含多条首尾相接的 SOME/IP 报文
+- 批量解析时只在 Python 中沿 Length 字段跳转定位报文边界，
+  头部字段通过 NumPy 一次性按偏移聚合为列式数组，不逐条复制负载
+"""
+
+import struct
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+HEADER = struct.Struct(">HHIHHBBBB")
+HEADER_SIZE = HEADER.size        # 16
+LENGTH_COVERED = 8               # Length 字段覆盖 Request ID 起的 8 字节头部
+_LENGTH = struct.Struct(">I")
+
+# 头部的结构化 dtype（大端），用于按偏移聚合列
+HEADER_DTYPE = np.dtype([
+    ("service_id", ">u2"),
+    ("method_id", ">u2"),
+    ("length", ">u4"),
+    ("client_id", ">u2"),
+    ("session_id", ">u2"),
+    ("protocol_version", "u1"),
+    ("interface_version", "u1"),
+    ("message_type", "u1"),
+    ("return_code", "u1"),
+])
+
+TP_FLAG = 0x20
+
+MESSAGE_TYPES = {
+    0x00: "REQUEST",
+    0x01: "REQUEST_NO_RETURN",
+    0x02: "NOTIFICATION",
+    0x80: "RESPONSE",
+    0x81: "ERROR",
+}
+
+RETURN_CODES = {
+    0x00: "E_OK",
+    0x01: "E_NOT_OK",
+    0x02: "E_UNKNOWN_SERVICE",
+    0x03: "E_UNKNOWN_METHOD",
+    0x04: "E_NOT_READY",
+    0x05: "E_NOT_REACHABLE",
+    0x06: "E_TIMEOUT",
+    0x07: "E_WRONG_PROTOCOL_VERSION",
+    0x08: "E_WRONG_INTERFACE_VERSION",
+    0x09: "E_MALFORMED_MESSAGE",
+    0x0A: "E_WRONG_MESSAGE_TYPE",
+}
+
+
+def message_type_name(value: int) -> str:
+    name = MESSAGE_TYPES.get(value & ~TP_FLAG, f"0x{value:02X}")
+    return f"TP_{name}" if value & TP_FLAG else name
+
+
+def return_code_name(value: int) -> str:
+    return RETURN_CODES.get(value, f"0x{value:02X}")
+
+
+def format_msg_id(service_id: int, method_id: int) -> str:
+    """与报文表中 ETH 报文ID一致的 "0xSSSS.0xMMMM" 形式"""
+    return f"0x{service_id:04X}.0x{method_id:04X}"
+
+
+def build_message(service_id: int, method_id: int, payload: bytes = b"",
+                  client_id: int = 0, session_id: int = 0,
+                  message_type: int = 0x00, return_code: int = 0x00,
+                  protocol_version: int = 1, interface_version: int = 1) -> bytes:
+    """编码一条 SOME/IP 报文（模拟器与测试数据使用）"""
+    return HEADER.pack(
+        service_id, method_id, LENGTH_COVERED + len(payload), client_id, session_id,
+        protocol_version, interface_version, message_type, return_code,
+    ) + payload
+
+
+def header_from_hex(payload_hex: str, msg_id: str) -> Optional[tuple]:
+    """从报文负载开头读取头部；服务/方法与报文ID不一致（旧数据）时返回 None
+
+    不校验 Length，负载可能已被截断（如共享内存记录只保留前 64 字节）。
+    """
+    if len(payload_hex) < HEADER_SIZE * 2:
+        return None
+    try:
+        fields = HEADER.unpack(bytes.fromhex(payload_hex[:HEADER_SIZE * 2]))
+    except ValueError:
+        return None
+    if format_msg_id(fields[0], fields[1]) != msg_id:
+        return None
+    return fields
+
+
+@dataclass
+class SomeIpBatch:
+    """一批数据报解析出的 SOME/IP 报文的列式视图
+
+    buffer 为所有数据报拼接后的字节；第 i 条报文的头部位于
+    buffer[offsets[i]:offsets[i] + 16]，负载紧随其后，长度为 headers["length"][i] - 8。
+    """
+
+    buffer: bytes
+    datagram: np.ndarray         # int32，报文所属数据报下标
+    offsets: np.ndarray          # int64，报文在 buffer 中的起始偏移
+    headers: np.ndarray          # HEADER_DTYPE 结构化数组
+    malformed: int = 0           # 尾部不完整或 Length 非法的数据报数
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def message(self, i: int) -> memoryview:
+        """第 i 条报文（含头部）的只读视图"""
+        start = int(self.offsets[i])
+        stop = start + LENGTH_COVERED + int(self.headers["length"][i])
+        return memoryview(self.buffer)[start:stop]
+
+
+def parse_datagrams(datagrams: Sequence[bytes]) -> SomeIpBatch:
+    """批量解析数据报为列式数组"""
+    buffer = b"".join(datagrams)
+    view = memoryview(buffer)
+    unpack_length = _LENGTH.unpack_from
+    offsets: List[int] = []
+    owners: List[int] = []
+    malformed = 0
+
+    base = 0
+    for index, dgram in enumerate(datagrams):
+        offset, end = base, base + len(dgram)
+        # 只读取 Length 字段定位报文边界，其余头部字段稍后向量化聚合
+        while end - offset >= HEADER_SIZE:
+            length = unpack_length(view, offset + 4)[0]
+            stop = offset + LENGTH_COVERED + length
+            if length < LENGTH_COVERED or stop > end:
+                break
+            offsets.append(offset)
+            owners.append(index)
+            offset = stop
+        if offset != end:
+            malformed += 1
+        base = end
+
+    offsets_arr = np.asarray(offsets, dtype=np.int64)
+    if len(offsets_arr):
+        raw = np.frombuffer(buffer, dtype=np.uint8)
+        rows = raw[offsets_arr[:, None] + np.arange(HEADER_SIZE)]
+        headers = np.ascontiguousarray(rows).view(HEADER_DTYPE).reshape(-1)
+    else:
+        headers = np.empty(0, dtype=HEADER_DTYPE)
+    return SomeIpBatch(
+        buffer=buffer,
+        datagram=np.asarray(owners, dtype=np.int32),
+        offsets=offsets_arr,
+        headers=headers,
+        malformed=malformed,
+    )
+
+
+def header_dict(fields: tuple) -> dict:
+    """HEADER.unpack 的结果转为 payload_decoded 字段"""
+    (service_id, method_id, length, client_id, session_id,
+     protocol_version, interface_version, message_type, return_code) = fields
+    return {
+        "service_id": f"0x{service_id:04X}",
+        "method_id": f"0x{method_id:04X}",
+        "msg_type": message_type_name(message_type),
+        "return_code": return_code_name(return_code),
+        "length": length,
+        "client_id": f"0x{client_id:04X}",
+        "session_id": session_id,
+        "protocol_version": protocol_version,
+        "interface_version": interface_version,
+    }
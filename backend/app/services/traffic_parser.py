@@ -5,9 +5,10 @@
 
 import json
 import time
-from typing import List
+from typing import List, Optional, Tuple
 
-from app.models.packet import UnifiedPacket
+from app.models.packet import UnifiedPacket, DEFAULT_VEHICLE_ID
+from app.services import someip
 
 
 class CANParser:
@@ -28,13 +29,11 @@ class CANParser:
         "0x7E0": ("DIAG", "powertrain", "diag_request"),
     }
 
-    def parse(self, msg_id: str, payload_hex: str, timestamp: float = None) -> UnifiedPacket:
-        if timestamp is None:
-            timestamp = time.time()
-
-        ecu, domain, signal = self.KNOWN_IDS.get(
-            msg_id, ("UNKNOWN", "unknown", "unknown")
-        )
+    @classmethod
+    def decode(cls, msg_id: str, payload_hex: str) -> dict:
+        """由报文ID和负载解码信号（结果可随时重新推导，不需要持久化）"""
+        payload_hex = payload_hex.upper()
+        signal = cls.KNOWN_IDS.get(msg_id, ("UNKNOWN", "unknown", "unknown"))[2]
         dlc = len(payload_hex) // 2
 
         decoded = {"signal": signal, "dlc": dlc, "raw": payload_hex}
@@ -42,6 +41,16 @@ class CANParser:
             b0 = int(payload_hex[0:2], 16)
             b1 = int(payload_hex[2:4], 16)
             decoded["rpm"] = round(((b0 << 8) | b1) * 0.25, 1)
+        return decoded
+
+    def parse(self, msg_id: str, payload_hex: str, timestamp: float = None) -> UnifiedPacket:
+        if timestamp is None:
+            timestamp = time.time()
+
+        ecu, domain, _ = self.KNOWN_IDS.get(
+            msg_id, ("UNKNOWN", "unknown", "unknown")
+        )
+        decoded = self.decode(msg_id, payload_hex)
 
         return UnifiedPacket(
             timestamp=timestamp,
@@ -59,31 +68,89 @@ class CANParser:
 class EthernetParser:
     """车载以太网(SOME/IP)解析器"""
 
+    SERVICE_DOMAINS = {
+        0x0100: "infotainment",
+        0x0200: "chassis",
+        0x0300: "body",
+        0x0400: "body",
+        0x0500: "body",
+    }
+    METADATA = {"eth_type": "SOME/IP", "vlan": 10}
+
+    @staticmethod
+    def decode(msg_id: str, payload_hex: str) -> dict:
+        """解码SOME/IP头部字段
+
+        负载以与报文ID一致的完整SOME/IP头部开始时按二进制解析；
+        否则（仅有应用负载的旧数据、负载不是合法十六进制）由报文ID还原服务与方法。
+        """
+        if len(payload_hex) >= someip.HEADER_SIZE * 2:
+            try:
+                data = bytes.fromhex(payload_hex)
+            except ValueError:
+                data = b""
+            if len(data) >= someip.HEADER_SIZE:
+                fields = someip.HEADER.unpack_from(data)
+                if (someip.format_msg_id(fields[0], fields[1]) == msg_id
+                        and someip.LENGTH_COVERED + fields[2] == len(data)):
+                    return someip.header_dict(fields)
+        service_id, _, method_id = msg_id.partition(".")
+        return {
+            "service_id": service_id,
+            "method_id": method_id,
+            "msg_type": "REQUEST",
+            "return_code": "E_OK",
+            "length": len(payload_hex) // 2,
+        }
+
     def parse(self, service_id: str, method_id: str,
               src: str, dst: str, payload_hex: str,
               timestamp: float = None) -> UnifiedPacket:
         if timestamp is None:
             timestamp = time.time()
 
-        length = len(payload_hex) // 2
+        msg_id = f"{service_id}.{method_id}"
         return UnifiedPacket(
             timestamp=timestamp,
             protocol="ETH",
             source=src,
             destination=dst,
-            msg_id=f"{service_id}.{method_id}",
+            msg_id=msg_id,
             payload_hex=payload_hex,
-            payload_decoded={
-                "service_id": service_id,
-                "method_id": method_id,
-                "msg_type": "REQUEST",
-                "return_code": "E_OK",
-                "length": length,
-            },
+            payload_decoded=self.decode(msg_id, payload_hex),
             domain="infotainment",
-            metadata={"eth_type": "SOME/IP", "vlan": 10},
+            metadata=dict(self.METADATA),
         )
 
+    def parse_datagrams(self, datagrams: List[bytes], timestamps: List[float],
+                        sources: List[str], destinations: List[str],
+                        vehicle_ids: Optional[List[str]] = None) -> Tuple[List[UnifiedPacket], int]:
+        """批量解析UDP/TCP负载，一个数据报可拆出多条SOME/IP报文
+
+        头部字段先整体解析为列式数组，再按报文构造 UnifiedPacket；
+        报文负载保存完整的SOME/IP报文（含头部），可随时重新解码。
+        返回 (报文列表, 尾部不完整或 Length 非法的数据报数)。
+        """
+        batch = someip.parse_datagrams(datagrams)
+        # 结构化数组一次性转为 Python 元组，避免逐字段访问 NumPy 标量
+        owners = batch.datagram.tolist()
+        packets = []
+        for i, fields in enumerate(batch.headers.tolist()):
+            owner = owners[i]
+            packets.append(UnifiedPacket(
+                timestamp=timestamps[owner],
+                protocol="ETH",
+                source=sources[owner],
+                destination=destinations[owner],
+                msg_id=someip.format_msg_id(fields[0], fields[1]),
+                payload_hex=batch.message(i).hex().upper(),
+                payload_decoded=someip.header_dict(fields),
+                domain=self.SERVICE_DOMAINS.get(fields[0], "unknown"),
+                metadata=dict(self.METADATA),
+                vehicle_id=vehicle_ids[owner] if vehicle_ids else DEFAULT_VEHICLE_ID,
+            ))
+        return packets, batch.malformed
+
 
 class TrafficParserService:
     """统一流量解析入口"""
@@ -92,40 +159,80 @@ class TrafficParserService:
         self.can_parser = CANParser()
         self.eth_parser = EthernetParser()
 
-    def parse_batch(self, raw_records: List[dict]) -> List[UnifiedPacket]:
-        """批量解析原始记录"""
+    def parse_batch(self, raw_records: List[dict]) -> Tuple[List[UnifiedPacket], int]:
+        """批量解析原始记录，返回 (报文列表, 无法解析的记录数)
+
+        未给出 service_id 的 ETH 记录视为原始 UDP/TCP 负载（payload_hex），
+        汇总后一次性按二进制 SOME/IP 解析。缺少必填字段、负载不是合法十六进制、
+        协议未知的记录以及尾部不完整的数据报计入 malformed，不影响同批其他记录。
+        """
         packets = []
+        datagrams = []
+        malformed = 0
         for rec in raw_records:
-            proto = rec.get("protocol", "").upper()
-            ts = rec.get("timestamp", time.time())
-
-            if proto == "CAN":
-                pkt = self.can_parser.parse(
-                    msg_id=rec["msg_id"],
-                    payload_hex=rec.get("payload_hex", ""),
-                    timestamp=ts,
-                )
-            elif proto == "ETH":
-                pkt = self.eth_parser.parse(
-                    service_id=rec.get("service_id", "0x0000"),
-                    method_id=rec.get("method_id", "0x0000"),
-                    src=rec.get("source", ""),
-                    dst=rec.get("destination", ""),
-                    payload_hex=rec.get("payload_hex", ""),
-                    timestamp=ts,
-                )
-            elif proto == "V2X":
-                pkt = UnifiedPacket(
-                    timestamp=ts,
-                    protocol="V2X",
-                    source=rec.get("source", ""),
-                    destination=rec.get("destination", "BROADCAST"),
-                    msg_id=rec.get("msg_type", "BSM"),
-                    payload_decoded=rec.get("payload_decoded", {}),
-                    domain="v2x",
-                    metadata=rec.get("metadata", {}),
-                )
-            else:
+            try:
+                pkt = self._parse_record(rec, datagrams)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                malformed += 1
                 continue
-            packets.append(pkt)
-        return packets
+            if pkt is False:
+                malformed += 1
+            elif pkt is not None:
+                packets.append(pkt)
+
+        if datagrams:
+            parsed, bad = self.eth_parser.parse_datagrams(
+                [data for _, _, data in datagrams],
+                [ts for _, ts, _ in datagrams],
+                [rec.get("source", "") for rec, _, _ in datagrams],
+                [rec.get("destination", "") for rec, _, _ in datagrams],
+                [rec.get("vehicle_id", DEFAULT_VEHICLE_ID) for rec, _, _ in datagrams],
+            )
+            packets.extend(parsed)
+            malformed += bad
+            packets.sort(key=lambda p: p.timestamp)
+        return packets, malformed
+
+    def _parse_record(self, rec: dict, datagrams: list):
+        """解析单条记录；原始数据报放入 datagrams 后返回 None，协议未知时返回 False"""
+        proto = rec.get("protocol", "").upper()
+        ts = float(rec.get("timestamp", time.time()))
+        payload_hex = rec.get("payload_hex", "")
+        # 负载按字节入库，非法十六进制在此抛出 ValueError，不进入写入批次
+        data = bytes.fromhex(payload_hex) if proto in ("CAN", "ETH") else b""
+
+        if proto == "ETH" and "service_id" not in rec:
+            datagrams.append((rec, ts, data))
+            return None
+        if proto == "CAN":
+            pkt = self.can_parser.parse(
+                msg_id=rec["msg_id"],
+                payload_hex=payload_hex,
+                timestamp=ts,
+            )
+        elif proto == "ETH":
+            pkt = self.eth_parser.parse(
+                service_id=rec.get("service_id", "0x0000"),
+                method_id=rec.get("method_id", "0x0000"),
+                src=rec.get("source", ""),
+                dst=rec.get("destination", ""),
+                payload_hex=payload_hex,
+                timestamp=ts,
+            )
+        elif proto == "V2X":
+            pkt = UnifiedPacket(
+                timestamp=ts,
+                protocol="V2X",
+                source=rec.get("source", ""),
+                destination=rec.get("destination", "BROADCAST"),
+                msg_id=rec.get("msg_type", "BSM"),
+                payload_decoded=rec.get("payload_decoded", {}),
+                domain="v2x",
+                metadata=rec.get("metadata", {}),
+            )
+        else:
+            return False
+        pkt.vehicle_id = rec.get("vehicle_id", DEFAULT_VEHICLE_ID)
+        return pkt
+
+
@@ -0,0 +1,286 @@
+"""多车辆检测器状态管理
+
+车队场景下每辆车维护独立的检测器（频率基线、ML模型），互不干扰：
+1. VehicleDetectorRegistry：进程内 LRU 缓存，超出容量的车辆状态换出到磁盘
+2. ShardedDetectorPool：按 vehicle_id 哈希分片到多个检测进程
+"""
+
+import asyncio
+import hashlib
+import logging
+import pickle
+import zlib
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.models.anomaly import AnomalyEvent
+from app.models.packet import UnifiedPacket
+from app.services.anomaly_detector import AnomalyDetectorService, IsolationForestDetector
+from app.services.packet_batch import PacketBatch
+
+logger = logging.getLogger("gatewayguard.vehicle_registry")
+
+
+def shard_of(vehicle_id: str, shard_count: int) -> int:
+    """稳定哈希分片（不受 PYTHONHASHSEED 影响，跨进程一致）"""
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(vehicle_id.encode("utf-8")) % shard_count
+
+
+def group_by_vehicle(packets: List[UnifiedPacket]) -> Dict[str, List[int]]:
+    """按车辆分组报文下标，组内按时间升序排列"""
+    groups: Dict[str, List[int]] = defaultdict(list)
+    for i, p in enumerate(packets):
+        groups[p.vehicle_id].append(i)
+    for group in groups.values():
+        group.sort(key=lambda i: packets[i].timestamp)
+    return dict(groups)
+
+
+class VehicleDetectorRegistry:
+    """按车辆隔离的检测器缓存（LRU + 磁盘换出）"""
+
+    def __init__(self, capacity: int, state_dir: str):
+        self.capacity = max(1, capacity)
+        self.state_dir = Path(state_dir)
+        self._cache: "OrderedDict[str, AnomalyDetectorService]" = OrderedDict()
+        self.evictions = 0
+        self.restores = 0
+        self.discarded = 0
+        self.retrains = 0
+
+    def _state_path(self, vehicle_id: str) -> Path:
+        digest = hashlib.sha1(vehicle_id.encode("utf-8")).hexdigest()[:16]
+        return self.state_dir / f"{digest}.pkl"
+
+    def _load(self, vehicle_id: str) -> Optional[AnomalyDetectorService]:
+        path = self._state_path(vehicle_id)
+        if not path.is_file():
+            return None
+        try:
+            with open(path, "rb") as f:
+                detector = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        if getattr(detector, "state_version", None) != AnomalyDetectorService.STATE_VERSION:
+            # 旧版本检测器缺少后续新增的检测器与属性，丢弃后按新车辆重新训练
+            logger.info("丢弃版本不符的检测器状态: %s", path.name)
+            self.discarded += 1
+            return None
+        self.restores += 1
+        return detector
+
+    def _dump(self, vehicle_id: str, detector: AnomalyDetectorService) -> None:
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        path = self._state_path(vehicle_id)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(detector, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(path)
+
+    def get(self, vehicle_id: str) -> AnomalyDetectorService:
+        """获取车辆检测器，不在内存时从磁盘恢复或新建"""
+        detector = self._cache.get(vehicle_id)
+        if detector is not None:
+            self._cache.move_to_end(vehicle_id)
+            return detector
+
+        detector = self._load(vehicle_id) or AnomalyDetectorService()
+        self._cache[vehicle_id] = detector
+        while len(self._cache) > self.capacity:
+            old_id, old_detector = self._cache.popitem(last=False)
+            self._dump(old_id, old_detector)
+            self.evictions += 1
+        return detector
+
+    def detect(self, vehicle_id: str, packets: List[UnifiedPacket],
+               batch: Optional[PacketBatch] = None) -> List[AnomalyEvent]:
+        """对单车报文执行检测，首次检测时用本车正常流量训练ML模型"""
+        detector = self.get(vehicle_id)
+        if batch is None:
+            batch = PacketBatch.from_packets(packets)
+        if not detector.ml_detector.is_fitted:
+            normal = np.flatnonzero([not p.metadata.get("attack") for p in packets])
+            if len(normal) > 20:
+                normal_batch = batch.take(normal)
+                detector.train(normal_batch.packets, normal_batch)
+
+        alerts = detector.detect(packets, batch)
+        for a in alerts:
+            a.vehicle_id = vehicle_id
+        return alerts
+
+    def maintain(self) -> int:
+        """检查缓存中各车辆的特征漂移并按需重训练，返回重训练的车辆数"""
+        retrained = 0
+        for _, detector in list(self._cache.items()):
+            if detector.maintain():
+                retrained += 1
+        self.retrains += retrained
+        return retrained
+
+    async def maintain_async(self, build=IsolationForestDetector.build) -> int:
+        """与 detect 同在事件循环时的维护：只有模型训练放到后台线程
+
+        遍历缓存、取窗口快照并校正累计和、替换模型都在事件循环线程执行，
+        与 detect 对窗口和缓存的修改互斥；训练期间被换出的车辆丢弃新模型，
+        避免替换已写入磁盘的检测器。
+        """
+        retrained = 0
+        for vehicle_id, detector in list(self._cache.items()):
+            snapshot = detector.retrain_snapshot()
+            if snapshot is None:
+                continue
+            fitted = await asyncio.to_thread(build, snapshot)
+            if self._cache.get(vehicle_id) is not detector:
+                continue
+            detector.ml_detector.swap(fitted)
+            retrained += 1
+        self.retrains += retrained
+        return retrained
+
+    def flush(self) -> None:
+        """将内存中所有车辆状态写入磁盘"""
+        for vehicle_id, detector in self._cache.items():
+            self._dump(vehicle_id, detector)
+
+    def stats(self) -> dict:
+        return {
+            "cached_vehicles": len(self._cache),
+            "capacity": self.capacity,
+            "evictions": self.evictions,
+            "restores": self.restores,
+            "discarded": self.discarded,
+            "retrains": self.retrains,
+        }
+
+
+# ---- 检测进程侧 ----
+
+_worker_registry: Optional[VehicleDetectorRegistry] = None
+
+
+def _init_worker(capacity: int, state_dir: str) -> None:
+    global _worker_registry
+    _worker_registry = VehicleDetectorRegistry(capacity, state_dir)
+
+
+def _worker_detect(vehicle_id: str, packets: List[UnifiedPacket],
+                   batch: Optional[PacketBatch]) -> List[AnomalyEvent]:
+    return _worker_registry.detect(vehicle_id, packets, batch)
+
+
+def _worker_flush() -> None:
+    if _worker_registry is not None:
+        _worker_registry.flush()
+
+
+def _worker_maintain() -> int:
+    return _worker_registry.maintain() if _worker_registry is not None else 0
+
+
+def _worker_stats() -> dict:
+    return _worker_registry.stats() if _worker_registry is not None else {}
+
+
+class ShardedDetectorPool:
+    """按车辆哈希分片的检测器池
+
+    shard_workers=0 时在当前进程内检测；否则每个分片是一个单进程执行器，
+    同一车辆始终路由到同一进程，各分片的车辆状态互不共享。
+    """
+
+    def __init__(self, shard_workers: int, capacity: int, state_dir: str):
+        self.shard_workers = max(0, shard_workers)
+        self._local: Optional[VehicleDetectorRegistry] = None
+        self._executors: List[ProcessPoolExecutor] = []
+        if self.shard_workers == 0:
+            self._local = VehicleDetectorRegistry(capacity, state_dir)
+        else:
+            per_shard = max(1, capacity // self.shard_workers)
+            self._executors = [
+                ProcessPoolExecutor(
+                    max_workers=1,
+                    initializer=_init_worker,
+                    initargs=(per_shard, state_dir),
+                )
+                for _ in range(self.shard_workers)
+            ]
+
+    @classmethod
+    def from_settings(cls) -> "ShardedDetectorPool":
+        cfg = settings.fleet
+        return cls(cfg.shard_workers, cfg.max_cached_vehicles, cfg.state_dir)
+
+    async def detect(self, packets: List[UnifiedPacket],
+                     batch: Optional[PacketBatch] = None) -> List[AnomalyEvent]:
+        """按车辆分组后并行检测，返回按置信度降序的告警
+
+        batch 为与 packets 对应的列式批次，按车辆切分后随报文一起交给检测器。
+        """
+        groups = {}
+        for vehicle_id, index in group_by_vehicle(packets).items():
+            sub = batch.take(np.asarray(index)) if batch is not None else None
+            groups[vehicle_id] = (sub.packets if sub is not None else [packets[i] for i in index], sub)
+        alerts: List[AnomalyEvent] = []
+
+        if self._local is not None:
+            for vehicle_id, (group, sub) in groups.items():
+                alerts.extend(self._local.detect(vehicle_id, group, sub))
+        else:
+            loop = asyncio.get_running_loop()
+            futures = [
+                loop.run_in_executor(
+                    self._executors[shard_of(vehicle_id, self.shard_workers)],
+                    _worker_detect, vehicle_id, group, sub,
+                )
+                for vehicle_id, (group, sub) in groups.items()
+            ]
+            for result in await asyncio.gather(*futures):
+                alerts.extend(result)
+
+        alerts.sort(key=lambda a: a.confidence, reverse=True)
+        return alerts
+
+    async def maintain(self) -> int:
+        """在后台线程/检测进程中执行重训练，不阻塞事件循环"""
+        if self._local is not None:
+            return await self._local.maintain_async()
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(ex, _worker_maintain) for ex in self._executors
+        ])
+        return sum(results)
+
+    async def maintenance_loop(self, interval: float) -> None:
+        """周期性后台维护任务，由 lifespan 启动"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.maintain()
+            except Exception:
+                logger.exception("检测器后台维护失败")
+
+    async def stats(self) -> dict:
+        if self._local is not None:
+            return {"shards": 1, **self._local.stats()}
+        loop = asyncio.get_running_loop()
+        shard_stats = await asyncio.gather(*[
+            loop.run_in_executor(ex, _worker_stats) for ex in self._executors
+        ])
+        return {"shards": self.shard_workers, "per_shard": list(shard_stats)}
+
+    def shutdown(self) -> None:
+        """落盘所有车辆状态并关闭检测进程"""
+        if self._local is not None:
+            self._local.flush()
+            return
+        for ex in self._executors:
+            ex.submit(_worker_flush).result()
+            ex.shutdown(wait=True)
@@ -0,0 +1,207 @@
+"""写后持久化队列（组提交）
+
+报文入库与检测告警不再各自开事务提交，而是交给单一写协程：
+- 调用方提交写入任务（报文、告警、检测游标）后得到一个 Future，
+  任务所在的事务提交后 Future 才完成，await 它即表示数据已持久化
+- 写协程取到第一个任务后，在 writer.flush_interval_ms 内继续收集后续任务，
+  累计行数达到 writer.max_batch_rows 时提前提交；一组任务只编码一次、一次提交
+- 队列有界（writer.queue_size），写入跟不上时提交方在入队处等待，形成背压
+- 组内任一任务导致提交失败时回滚，再逐个任务单独重试，
+  只有真正出错的任务以异常结束，不连累同组的其他调用方
+- 同一事务中累加 rollup_buckets 时间桶计数（见 bucket_rollups）
+- 检测游标只前进（WHERE last_packet_id < 新值），乱序到达的旧游标不会使其回退
+- 写协程未启动（writer.enabled 为 false，或独立进程中）时在调用方协程内直接写入
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import update
+
+from app.config import settings
+from app.database import async_session
+from app.models.anomaly import AnomalyEventORM, DetectionCursorORM
+from app.models.packet import UnifiedPacket
+from app.services.bucket_rollups import bucket_rollups
+from app.services.packet_store import packet_store
+
+logger = logging.getLogger("gatewayguard.write_behind")
+
+# (游标名, 最大已检测报文ID, 该报文时间戳)
+CursorUpdate = Tuple[str, int, Optional[float]]
+
+
+@dataclass
+class WriteJob:
+    packets: List[UnifiedPacket] = field(default_factory=list)
+    alerts: List[AnomalyEventORM] = field(default_factory=list)
+    cursor: Optional[CursorUpdate] = None
+    future: Optional[asyncio.Future] = None
+
+    @property
+    def rows(self) -> int:
+        return len(self.packets) + len(self.alerts) + (self.cursor is not None)
+
+
+class WriteBehindQueue:
+    """单写协程的组提交队列"""
+
+    def __init__(self):
+        cfg = settings.writer
+        self.enabled = cfg.enabled
+        self.flush_interval = max(0.0, cfg.flush_interval_ms) / 1000
+        self.max_batch_rows = max(1, cfg.max_batch_rows)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, cfg.queue_size))
+        self._task: Optional[asyncio.Task] = None
+        self._queued_rows = 0
+
+        self.jobs = 0
+        self.rows = 0
+        self.commits = 0
+        self.retried_groups = 0
+        self.failed_jobs = 0
+        self.max_group = 0
+        self.last_commit_ms = 0.0
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止写协程，队列中已有的任务在退出前提交"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    # ---- 提交 ----
+
+    async def submit(self, packets: Sequence[UnifiedPacket] = (),
+                     alerts: Sequence[AnomalyEventORM] = (),
+                     cursor: Optional[CursorUpdate] = None) -> asyncio.Future:
+        """提交写入任务，返回持久化完成时结束的 Future；队列满时等待"""
+        job = WriteJob(list(packets), list(alerts), cursor,
+                       asyncio.get_running_loop().create_future())
+        if self._task is None:
+            await self._flush([job])
+            return job.future
+        await self._queue.put(job)
+        self._queued_rows += job.rows
+        return job.future
+
+    async def write(self, packets: Sequence[UnifiedPacket] = (),
+                    alerts: Sequence[AnomalyEventORM] = (),
+                    cursor: Optional[CursorUpdate] = None) -> None:
+        """提交并等待持久化完成，提交失败时抛出原异常"""
+        await (await self.submit(packets, alerts, cursor))
+
+    # ---- 写协程 ----
+
+    def _taken(self, job: WriteJob) -> WriteJob:
+        self._queued_rows -= job.rows
+        return job
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            job = await self._queue.get()
+            if job is None:  # stop() 放入的结束标记
+                return
+            jobs = [self._taken(job)]
+            rows = job.rows
+            deadline = loop.time() + self.flush_interval
+            # 在刷新间隔内继续收集任务，行数达到上限时提前提交
+            while rows < self.max_batch_rows:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        job = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    job = self._queue.get_nowait()
+                if job is None:
+                    closing = True
+                    break
+                jobs.append(self._taken(job))
+                rows += job.rows
+            await self._flush(jobs)
+
+    async def _flush(self, jobs: List[WriteJob]) -> None:
+        started = time.perf_counter()
+        try:
+            async with async_session() as db:
+                await self._write(db, jobs)
+                await db.commit()
+        except Exception as exc:
+            if len(jobs) == 1:
+                self.failed_jobs += 1
+                logger.exception("写入任务提交失败")
+                if not jobs[0].future.done():
+                    jobs[0].future.set_exception(exc)
+                return
+            # 组提交失败：逐个任务重试，定位出错的任务
+            self.retried_groups += 1
+            for job in jobs:
+                await self._flush([job])
+            return
+
+        self.commits += 1
+        self.jobs += len(jobs)
+        self.rows += sum(j.rows for j in jobs)
+        self.max_group = max(self.max_group, len(jobs))
+        self.last_commit_ms = round((time.perf_counter() - started) * 1000, 2)
+        for job in jobs:
+            if not job.future.done():
+                job.future.set_result(None)
+
+    @staticmethod
+    async def _write(db, jobs: List[WriteJob]) -> None:
+        packets = [p for j in jobs for p in j.packets]
+        rows = []
+        if packets:
+            rows = await packet_store.encode_packets(db, packets)
+            await packet_store.insert_rows(db, rows)
+        alerts = [a for j in jobs for a in j.alerts]
+        if alerts:
+            db.add_all(alerts)
+        # 时间桶汇总与明细同一事务累加，提交失败时一并回滚
+        await bucket_rollups.add(db, rows, alerts)
+        # 游标只前进：组内取最大值，且不回退到库中已有位置之前
+        # （逐个重试或租约过期后的旧检测者晚到的更新不会覆盖新位置）
+        cursors = {}
+        for j in jobs:
+            if j.cursor is not None and j.cursor[1] > cursors.get(j.cursor[0], (None, -1))[1]:
+                cursors[j.cursor[0]] = j.cursor
+        for name, last_id, last_ts in cursors.values():
+            await db.execute(
+                update(DetectionCursorORM)
+                .where(DetectionCursorORM.name == name)
+                .where(DetectionCursorORM.last_packet_id < last_id)
+                .values(last_packet_id=last_id, last_timestamp=last_ts)
+            )
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._task is not None,
+            "queue_depth": self._queue.qsize(),
+            "queued_rows": self._queued_rows,
+            "jobs": self.jobs,
+            "rows": self.rows,
+            "commits": self.commits,
+            "avg_group": round(self.jobs / self.commits, 2) if self.commits else 0.0,
+            "max_group": self.max_group,
+            "retried_groups": self.retried_groups,
+            "failed_jobs": self.failed_jobs,
+            "last_commit_ms": self.last_commit_ms,
+        }
+
+
+write_behind = WriteBehindQueue()
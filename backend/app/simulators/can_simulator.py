@@ -5,11 +5,13 @@
 - 攻击流量：DoS、Fuzzy、Spoofing
 """
 
+import heapq
 import random
 import time
 from typing import List
 
 from app.models.packet import UnifiedPacket
+from app.services.traffic_parser import CANParser
 
 # 正常CAN报文定义：(msg_id, source_ecu, domain, period_ms, dlc)
 NORMAL_CAN_MESSAGES = [
@@ -32,36 +34,63 @@ def _random_payload(dlc: int) -> str:
     return "".join(f"{random.randint(0, 255):02X}" for _ in range(dlc))
 
 
-def _decode_engine_rpm(payload_hex: str) -> dict:
-    b0 = int(payload_hex[0:2], 16)
-    b1 = int(payload_hex[2:4], 16)
-    rpm = ((b0 << 8) | b1) * 0.25
-    return {"rpm": round(rpm, 1), "raw": payload_hex}
+def _signal_payload(dlc: int, counter: int) -> str:
+    """按典型信号布局生成负载：
+
+    byte0   信号高字节，取值 0x00-0x3F
+    byte1   信号低字节
+    中间字节 小范围状态量 0x00-0x0F
+    末字节   高半字节固定 0xA，低半字节为滚动计数器
+    """
+    if dlc < 2:
+        return _random_payload(dlc)
+    body = [random.randint(0x00, 0x3F), random.randint(0x00, 0xFF)]
+    body.extend(random.randint(0x00, 0x0F) for _ in range(dlc - 3))
+    if dlc > 2:
+        body.append(0xA0 | (counter & 0x0F))
+    return "".join(f"{b:02X}" for b in body)
 
 
 def generate_normal_can(count: int = 100, base_time: float = None) -> List[UnifiedPacket]:
-    """生成正常CAN流量"""
+    """生成正常CAN流量
+
+    周期报文按各自周期调度（带固定相位偏移和微小抖动），
+    事件型诊断报文（period_ms=0）偶发出现。
+    """
     if base_time is None:
         base_time = time.time()
 
+    periodic = [m for m in NORMAL_CAN_MESSAGES if m[3] > 0]
+    event_driven = [m for m in NORMAL_CAN_MESSAGES if m[3] == 0]
+    # (下次发送时间, 相位序号, 报文定义)
+    schedule = [
+        (base_time + idx * 0.0007, idx, msg) for idx, msg in enumerate(periodic)
+    ]
+    heapq.heapify(schedule)
+
     packets = []
-    for i in range(count):
-        msg = random.choice(NORMAL_CAN_MESSAGES)
-        msg_id, src, domain, _, dlc = msg
-        payload = _random_payload(dlc)
+    counters = {}
+    while len(packets) < count:
+        ts, idx, msg = heapq.heappop(schedule)
+        period = msg[3] / 1000.0
+        heapq.heappush(
+            schedule, (ts + period + random.uniform(-5e-5, 5e-5), idx, msg),
+        )
+        if event_driven and random.random() < 0.002:
+            msg = random.choice(event_driven)
 
-        decoded = {"dlc": dlc, "raw": payload}
-        if msg_id == "0x0C0":
-            decoded = _decode_engine_rpm(payload)
+        msg_id, src, domain, _, dlc = msg
+        counters[msg_id] = counters.get(msg_id, -1) + 1
+        payload = _signal_payload(dlc, counters[msg_id])
 
         packets.append(UnifiedPacket(
-            timestamp=base_time + i * 0.01,
+            timestamp=ts,
             protocol="CAN",
             source=src,
             destination="BROADCAST",
             msg_id=msg_id,
             payload_hex=payload,
-            payload_decoded=decoded,
+            payload_decoded=CANParser.decode(msg_id, payload),
             domain=domain,
             metadata={"bus": "CAN-H", "bitrate": 500000},
         ))
@@ -1,13 +1,16 @@
 """车载以太网流量模拟器
 
-模拟SOME/IP协议通信和异常流量
+模拟SOME/IP协议通信和异常流量，负载为完整的二进制SOME/IP报文（含头部）
 """
 
+import os
 import random
 import time
 from typing import List
 
 from app.models.packet import UnifiedPacket
+from app.services import someip
+from app.services.traffic_parser import EthernetParser
 
 # SOME/IP 服务定义: (service_id, method_id, src, dst, domain)
 SOMEIP_SERVICES = [
@@ -20,33 +23,56 @@ SOMEIP_SERVICES = [
     ("0x0500", "0x0001", "DIAG_ETH", "GW", "body"),
 ]
 
+# 各节点的 SOME/IP Client ID
+CLIENT_IDS = {"HU": 0x0010, "ADAS": 0x0020, "TBOX": 0x0030, "GW": 0x0040, "DIAG_ETH": 0x0050}
+
+RESPONSE_RATIO = 0.8     # 需要应答的请求比例，其余为 REQUEST_NO_RETURN
+RESPONSE_DELAY = 0.005   # 响应相对请求的延迟（秒）
+
+
+def _packet(message: bytes, timestamp: float, src: str, dst: str, domain: str) -> UnifiedPacket:
+    fields = someip.HEADER.unpack_from(message)
+    return UnifiedPacket(
+        timestamp=timestamp,
+        protocol="ETH",
+        source=src,
+        destination=dst,
+        msg_id=someip.format_msg_id(fields[0], fields[1]),
+        payload_hex=message.hex().upper(),
+        payload_decoded=someip.header_dict(fields),
+        domain=domain,
+        metadata=dict(EthernetParser.METADATA),
+    )
+
 
 def generate_normal_eth(count: int = 80, base_time: float = None) -> List[UnifiedPacket]:
-    """生成正常车载以太网流量"""
+    """生成正常车载以太网流量：请求 / 响应对（同一 Request ID）与无需应答的请求"""
     if base_time is None:
         base_time = time.time()
 
     packets = []
-    for i in range(count):
-        svc = random.choice(SOMEIP_SERVICES)
-        service_id, method_id, src, dst, domain = svc
-        payload_len = random.randint(8, 128)
-
-        packets.append(UnifiedPacket(
-            timestamp=base_time + i * 0.02,
-            protocol="ETH",
-            source=src,
-            destination=dst,
-            msg_id=f"{service_id}.{method_id}",
-            payload_hex="AA" * payload_len,
-            payload_decoded={
-                "service_id": service_id,
-                "method_id": method_id,
-                "msg_type": "REQUEST",
-                "return_code": "E_OK",
-                "length": payload_len,
-            },
-            domain=domain,
-            metadata={"eth_type": "SOME/IP", "vlan": 10},
-        ))
+    session = random.randint(1, 0xFFFF)
+    i = 0
+    while len(packets) < count:
+        service_id, method_id, src, dst, domain = random.choice(SOMEIP_SERVICES)
+        sid, mid = int(service_id, 16), int(method_id, 16)
+        client = CLIENT_IDS.get(src, 0x0001)
+        session = session % 0xFFFF + 1
+        ts = base_time + i * 0.02
+        i += 1
+
+        # 剩余名额不足以放下响应时发送无需应答的请求，保证每个 REQUEST 都有响应
+        needs_response = len(packets) + 2 <= count and random.random() < RESPONSE_RATIO
+        request = someip.build_message(
+            sid, mid, os.urandom(random.randint(8, 128)),
+            client_id=client, session_id=session,
+            message_type=0x00 if needs_response else 0x01,
+        )
+        packets.append(_packet(request, ts, src, dst, domain))
+        if needs_response:
+            response = someip.build_message(
+                sid, mid, os.urandom(random.randint(4, 64)),
+                client_id=client, session_id=session, message_type=0x80,
+            )
+            packets.append(_packet(response, ts + RESPONSE_DELAY, dst, src, domain))
     return packets
@@ -1,11 +1,15 @@
 """V2X通信流量模拟器
 
-模拟V2I/V2V的BSM广播和异常流量
+模拟V2I/V2V的BSM广播和异常流量。
+OBU 沿各自的环形道路匀速行驶，位置、速度与航向由同一条轨迹连续给出，
+跨多次模拟调用保持一致；RSU 位置固定。
 """
 
+import math
 import random
 import time
-from typing import List
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
 
 from app.models.packet import UnifiedPacket
 
@@ -17,6 +21,95 @@ V2X_MSG_TYPES = [
     ("RSI", "V2I"),    # 路侧信息
 ]
 
+BASE_LAT, BASE_LON = 31.2304, 121.4737
+M_PER_DEG_LAT = 111320.0
+OBU_COUNT = 20
+RSU_COUNT = 5
+
+
+def offset(lat: float, lon: float, east_m: float, north_m: float) -> Tuple[float, float]:
+    """按局部平面近似在经纬度上偏移若干米"""
+    return (
+        lat + north_m / M_PER_DEG_LAT,
+        lon + east_m / (M_PER_DEG_LAT * math.cos(math.radians(lat))),
+    )
+
+
+@dataclass
+class RingTrajectory:
+    """绕圆心匀速行驶的轨迹"""
+
+    center_lat: float
+    center_lon: float
+    radius: float      # 米
+    speed_kmh: float
+    phase: float       # t=0 时的角度（弧度）
+    clockwise: bool
+
+    def state(self, t: float) -> Tuple[float, float, float]:
+        """时刻 t 的 (纬度, 经度, 航向)；航向以正北为 0 顺时针计"""
+        omega = self.speed_kmh / 3.6 / self.radius
+        theta = self.phase + (-omega if self.clockwise else omega) * t
+        lat, lon = offset(
+            self.center_lat, self.center_lon,
+            self.radius * math.cos(theta), self.radius * math.sin(theta),
+        )
+        # 切线方向：逆时针为 (-sin, cos)，顺时针取反
+        east, north = -math.sin(theta), math.cos(theta)
+        if self.clockwise:
+            east, north = -east, -north
+        heading = math.degrees(math.atan2(east, north)) % 360
+        return lat, lon, heading
+
+
+def _make_fleet() -> Tuple[Dict[str, RingTrajectory], Dict[str, Tuple[float, float]]]:
+    rng = random.Random(2024)
+    obus = {}
+    for i in range(1, OBU_COUNT + 1):
+        lat, lon = offset(BASE_LAT, BASE_LON, rng.uniform(-800, 800), rng.uniform(-800, 800))
+        obus[f"OBU_{i:03d}"] = RingTrajectory(
+            center_lat=lat, center_lon=lon,
+            radius=rng.uniform(200, 800),
+            speed_kmh=round(rng.uniform(20, 100), 1),
+            phase=rng.uniform(0, 2 * math.pi),
+            clockwise=rng.random() < 0.5,
+        )
+    rsus = {
+        f"RSU_{i:02d}": offset(BASE_LAT, BASE_LON, rng.uniform(-1000, 1000), rng.uniform(-1000, 1000))
+        for i in range(1, RSU_COUNT + 1)
+    }
+    return obus, rsus
+
+
+# 轨迹固定，多次模拟调用之间同一 OBU 的运动学保持连续
+OBU_TRAJECTORIES, RSU_POSITIONS = _make_fleet()
+
+
+def _v2x_packet(timestamp: float, src: str, dst: str, msg_type: str, comm_type: str,
+                lat: float, lon: float, speed: float, heading: float,
+                attack: bool = False) -> UnifiedPacket:
+    metadata = {"channel": "PC5", "frequency": "5.9GHz"}
+    if attack:
+        metadata["attack"] = True
+    return UnifiedPacket(
+        timestamp=timestamp,
+        protocol="V2X",
+        source=src,
+        destination=dst,
+        msg_id=msg_type,
+        payload_hex="",
+        payload_decoded={
+            "msg_type": msg_type,
+            "comm_type": comm_type,
+            "latitude": round(lat, 6),
+            "longitude": round(lon, 6),
+            "speed_kmh": round(speed, 1),
+            "heading": int(round(heading)) % 360,
+        },
+        domain="v2x",
+        metadata=metadata,
+    )
+
 
 def generate_normal_v2x(count: int = 60, base_time: float = None) -> List[UnifiedPacket]:
     """生成正常V2X通信流量"""
@@ -26,34 +119,38 @@ def generate_normal_v2x(count: int = 60, base_time: float = None) -> List[Unifie
     packets = []
     for i in range(count):
         msg_type, comm_type = random.choice(V2X_MSG_TYPES)
+        ts = base_time + i * 0.1
 
         if comm_type == "V2V":
-            src = f"OBU_{random.randint(1, 20):03d}"
+            src = random.choice(list(OBU_TRAJECTORIES))
             dst = "BROADCAST"
+            trajectory = OBU_TRAJECTORIES[src]
+            lat, lon, heading = trajectory.state(ts)
+            speed = trajectory.speed_kmh
         else:
-            src = f"RSU_{random.randint(1, 5):02d}"
+            src = random.choice(list(RSU_POSITIONS))
             dst = "OBU_001"
+            (lat, lon), speed, heading = RSU_POSITIONS[src], 0.0, 0.0
+
+        packets.append(_v2x_packet(ts, src, dst, msg_type, comm_type, lat, lon, speed, heading))
+    return packets
+
 
-        lat = 31.2304 + random.uniform(-0.01, 0.01)
-        lon = 121.4737 + random.uniform(-0.01, 0.01)
-        speed = random.uniform(0, 120)
-
-        packets.append(UnifiedPacket(
-            timestamp=base_time + i * 0.1,
-            protocol="V2X",
-            source=src,
-            destination=dst,
-            msg_id=msg_type,
-            payload_hex="",
-            payload_decoded={
-                "msg_type": msg_type,
-                "comm_type": comm_type,
-                "latitude": round(lat, 6),
-                "longitude": round(lon, 6),
-                "speed_kmh": round(speed, 1),
-                "heading": random.randint(0, 359),
-            },
-            domain="v2x",
-            metadata={"channel": "PC5", "frequency": "5.9GHz"},
+def generate_sybil_attack(count: int = 60, base_time: float = None,
+                          pseudonyms: int = 6) -> List[UnifiedPacket]:
+    """Sybil 攻击：单个攻击节点以多个伪造 OBU 身份在同一位置广播 BSM"""
+    if base_time is None:
+        base_time = time.time()
+
+    lat0, lon0 = offset(BASE_LAT, BASE_LON, random.uniform(-500, 500), random.uniform(-500, 500))
+    heading = random.randint(0, 359)
+    ids = [f"OBU_{900 + i:03d}" for i in range(pseudonyms)]
+    packets = []
+    for i in range(count):
+        # 伪造的车辆彼此相距不足 2 米、静止，单看每个身份都合理
+        lat, lon = offset(lat0, lon0, random.uniform(-1, 1), random.uniform(-1, 1))
+        packets.append(_v2x_packet(
+            base_time + i * 0.05, ids[i % pseudonyms], "BROADCAST", "BSM", "V2V",
+            lat, lon, 0.0, heading, attack=True,
         ))
     return packets
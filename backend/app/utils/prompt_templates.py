@@ -12,9 +12,41 @@ ANOMALY_ANALYSIS_PROMPT = """分析以下网关异常事件：
 直接输出JSON（不要```包裹）：
 {{"attack_type":"攻击类型","attack_method":"手法(50字内)","root_cause":"根因(50字内)","affected_scope":["受影响范围"],"attack_intent":"意图(30字内)","risk_level":"high/medium/low","recommendations":["建议1","建议2"],"summary":"一句话总结"}}"""
 
-REPORT_GENERATION_PROMPT = """基于以下异常事件生成预警报告：
+REPORT_OUTPUT_FORMAT = """直接输出JSON（不要```包裹）：
+{{"title":"报告标题","summary":"摘要(100字内)","timeline":["关键事件"],"attack_chain":"攻击链分析(100字内)","impact_assessment":"影响评估(80字内)","risk_level":"critical/high/medium/low","recommendations":["建议1","建议2","建议3"],"conclusion":"结论(50字内)"}}"""
 
-{events_json}
+REPORT_GENERATION_PROMPT = """基于以下异常事件聚合数据生成预警报告：
 
-直接输出JSON（不要```包裹）：
-{{"title":"报告标题","summary":"摘要(100字内)","timeline":["关键事件"],"attack_chain":"攻击链分析(100字内)","impact_assessment":"影响评估(80字内)","risk_level":"critical/high/medium/low","recommendations":["建议1","建议2","建议3"],"conclusion":"结论(50字内)"}}"""
+概览：
+{overview}
+
+分组明细（每行一组，| 分隔）：
+{events_table}
+
+""" + REPORT_OUTPUT_FORMAT
+
+REPORT_MAP_PROMPT = """以下是一批网关异常事件的聚合分组（每行一组，| 分隔）：
+
+{events_table}
+
+概括这批事件的攻击特征、涉及节点、时间规律和风险，150字以内，直接输出摘要正文。"""
+
+REPORT_REDUCE_PROMPT = """基于异常事件的全局概览和各分块分析摘要生成预警报告：
+
+概览：
+{overview}
+
+分块摘要：
+{summaries}
+
+""" + REPORT_OUTPUT_FORMAT
+
+CHAT_SUMMARY_PROMPT = """将以下车载网络安全对话压缩为滚动摘要，保留用户关注的事件、车辆、协议、结论和待办事项，{max_chars}字以内，直接输出摘要正文：
+
+已有摘要：
+{summary}
+
+新增对话：
+{dialogue}"""
+
+CHAT_SUMMARY_CONTEXT = """此前对话摘要：{summary}"""
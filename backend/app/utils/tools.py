@@ -19,6 +19,8 @@ CHAT_TOOLS = [
                     },
                     "minutes": {
                         "type": "integer",
+                        "minimum": 1,
+                        "maximum": 1440,
                         "description": "查询最近N分钟的数据",
                     },
                 },
@@ -44,6 +46,8 @@ CHAT_TOOLS = [
                     },
                     "limit": {
                         "type": "integer",
+                        "minimum": 1,
+                        "maximum": 50,
                         "description": "返回数量限制",
                     },
                 },
@@ -0,0 +1,44 @@
+"""测试公共配置
+
+在临时目录中运行：相对路径的数据库、检测器状态与归档目录都落在临时目录，
+不会写入仓库。须在导入 app 之前切换目录并关闭 SQL 回显。
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+os.chdir(tempfile.mkdtemp(prefix="gatewayguard-test-"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from app.config import settings  # noqa: E402
+
+settings.debug = False
+# 后台持续检测由各测试显式触发，避免与断言竞争
+settings.scheduler.enabled = False
+
+
+@pytest.fixture(scope="session")
+def _app_client():
+    # 写后队列、推送中心等单例绑定首次启动时的事件循环，整个会话只启动一次 lifespan
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture(scope="module")
+def client(_app_client):
+    """带 lifespan 的测试客户端，每个测试模块开始前清空数据
+
+    需要直接调用服务协程时用 client.portal.call，与写后队列处于同一事件循环。
+    """
+    _app_client.delete("/api/system/clear-data")
+    return _app_client
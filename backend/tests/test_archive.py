@@ -0,0 +1,115 @@
+"""冷归档块文件与透明读取"""
+
+import json
+import time
+
+from app.database import async_session
+from app.services.archive import packet_archive, read_block, write_block
+from app.services.write_behind import write_behind
+from app.simulators.can_simulator import generate_dos_attack, generate_normal_can
+
+
+def _export(client, query=""):
+    text = client.get(f"/api/traffic/export?kind=packets&format=ndjson{query}").text
+    return sorted((json.loads(line) for line in text.splitlines()), key=lambda r: r["id"])
+
+
+def test_block_file_round_trip(tmp_path):
+    rows = [
+        type("Row", (), {
+            "id": i + 1, "timestamp": 100.0 + i * 0.01, "vehicle_code": 1 + i % 2,
+            "protocol_code": 3, "source_code": 4, "destination_code": None, "msg_code": 5 + i % 3,
+            "domain_code": 6, "payload": bytes([i % 256]) * (i % 9),
+            "payload_extra": '{"x": 1}' if i % 10 == 0 else None, "profile_id": 7,
+        })()
+        for i in range(500)
+    ]
+    for codec in ("zlib", "zstd"):
+        path = tmp_path / f"block.{codec}"
+        assert write_block(path, rows, codec, 3) == path.stat().st_size
+        restored = read_block(path)
+        assert [r.id for r in restored] == [r.id for r in rows]
+        assert [r.payload or b"" for r in restored] == [r.payload for r in rows]
+        assert [r.payload_extra for r in restored] == [r.payload_extra for r in rows]
+        assert [r.destination_code for r in restored] == [None] * 500
+
+        picked = read_block(path, start=101.0, end=102.0, vehicle_code=2)
+        assert [r.id for r in picked] == [r.id for r in rows
+                                           if 101.0 <= r.timestamp < 102.0 and r.vehicle_code == 2]
+        picked = read_block(path, msg_code=6)
+        assert [r.id for r in picked] == [r.id for r in rows if r.msg_code == 6]
+
+
+def test_archived_packets_stay_readable(client, monkeypatch):
+    client.post("/api/traffic/simulate?scenario=mixed&count=300&vehicle_id=car1")
+    client.post("/api/anomaly/detect?limit=2000")
+    before = _export(client)
+    stats = client.get("/api/traffic/stats").json()
+
+    monkeypatch.setattr(packet_archive, "max_age", -3600.0)  # 模拟流量的时间戳可能略超当前时间
+    monkeypatch.setattr(packet_archive, "block_rows", 200)
+    result = client.post("/api/system/archive").json()
+    assert result["rows"] == len(before)
+    assert result["blocks"] == -(-len(before) // 200)
+
+    assert _export(client) == before
+    assert client.get("/api/traffic/stats").json()["total_packets"] == stats["total_packets"]
+    page = client.get("/api/traffic/packets?limit=50&vehicle_id=car1").json()
+    assert len(page) == 50
+
+    # 未检测的报文不归档
+    client.post("/api/traffic/simulate?scenario=normal&count=30&vehicle_id=car1")
+    assert client.post("/api/system/archive").json()["rows"] == 0
+
+
+def test_msg_filter_skips_blocks(client, monkeypatch):
+    base = time.time() - 100
+    packets = generate_normal_can(300, base) + generate_dos_attack(100, base + 10)
+    for p in packets:
+        p.vehicle_id = "car9"
+    client.portal.call(lambda: write_behind.write(packets=packets))
+    client.post("/api/anomaly/detect?limit=2000")
+    monkeypatch.setattr(packet_archive, "max_age", -3600.0)
+    monkeypatch.setattr(packet_archive, "block_rows", 100)
+    client.post("/api/system/archive")
+    archived = _export(client, "&vehicle_id=car9")
+    msg_id = "0x000"  # 仅由 DoS 攻击帧使用
+    expected = sorted(r["id"] for r in archived if r["msg_id"] == msg_id)
+    assert expected
+
+    opened = []
+    read_rows = packet_archive.read_rows
+
+    async def counting(block, *args):
+        opened.append(block.path)
+        return await read_rows(block, *args)
+
+    monkeypatch.setattr(packet_archive, "read_rows", counting)
+    page = client.get(f"/api/traffic/packets?limit=500&vehicle_id=car9&msg_id={msg_id}").json()
+    assert sorted(r["id"] for r in page) == expected
+    assert {r["msg_id"] for r in page} == {msg_id}
+
+    async def blocks(msg_code=None):
+        async with async_session() as db:
+            return await packet_archive.blocks(db, msg_code=msg_code)
+
+    # 只有 DoS 帧所在的块被打开
+    assert len(opened) == 1
+    assert len(client.portal.call(blocks)) > 1
+
+
+def test_clear_keeps_files_until_commit(client):
+    async def clear_and_rollback():
+        async with async_session() as db:
+            paths = await packet_archive.clear(db)
+            await db.rollback()
+        async with async_session() as db:
+            remaining = await packet_archive.blocks(db)
+        return paths, remaining
+
+    paths, remaining = client.portal.call(clear_and_rollback)
+    assert paths and all(p.is_file() for p in paths)
+    assert len(remaining) == len(paths)
+
+    client.delete("/api/system/clear-data")
+    assert not any(p.exists() for p in paths)
@@ -0,0 +1,102 @@
+"""多分辨率时间桶汇总：/api/traffic/aggregate 与对话工具"""
+
+import time
+
+import pytest
+
+from app.config import settings
+from app.services.bucket_rollups import bucket_rollups
+from app.services.llm_engine import LLMEngine
+
+
+@pytest.fixture(scope="module")
+def seeded(client):
+    client.post("/api/traffic/simulate?scenario=normal&count=300&vehicle_id=car1")
+    client.post("/api/traffic/simulate?scenario=dos&count=200&vehicle_id=car2")
+    client.post("/api/anomaly/detect?limit=2000")
+    return client
+
+
+def _aggregate(client, **params):
+    now = time.time()
+    params = {"start": now - 3600, "end": now + 3600, **params}
+    return client.get("/api/traffic/aggregate", params=params).json()
+
+
+def _total(client, vehicle_id=None):
+    url = "/api/traffic/stats" + (f"?vehicle_id={vehicle_id}" if vehicle_id else "")
+    return client.get(url).json()["total_packets"]
+
+
+def test_protocol_totals_match_stored_packets(seeded):
+    result = _aggregate(seeded, group_by="protocol", bucket=60)
+    assert sum(result["totals"].values()) == _total(seeded)
+    assert sum(b["total"] for b in result["series"]) == _total(seeded)
+    assert result["resolution"] == 60
+    assert len(result["series"]) == (result["end"] - result["start"] + 59) // 60
+
+
+def test_vehicle_filter(seeded):
+    car2 = _aggregate(seeded, group_by="protocol", vehicle_id="car2")
+    assert sum(car2["totals"].values()) == _total(seeded, "car2")
+    missing = _aggregate(seeded, group_by="protocol", vehicle_id="nobody")
+    assert missing["totals"] == {}
+    assert all(b["total"] == 0 for b in missing["series"])
+
+
+def test_severity_totals_match_events(seeded):
+    result = _aggregate(seeded, group_by="severity", bucket=3600)
+    events = seeded.get("/api/anomaly/events?limit=1").json()["total"]
+    assert events > 0
+    assert sum(result["totals"].values()) == events
+
+
+def test_top_merges_other(seeded):
+    result = _aggregate(seeded, group_by="msg_id", top=2)
+    assert result["keys"][-1] == "other"
+    assert len(result["keys"]) == 3
+    assert sum(result["totals"].values()) == _total(seeded)
+
+
+def test_invalid_ranges_return_error(seeded):
+    assert "error" in _aggregate(seeded, bucket=1, start=0, end=time.time())
+    now = time.time()
+    assert "error" in seeded.get(
+        "/api/traffic/aggregate", params={"start": now, "end": now - 10},
+    ).json()
+
+
+@pytest.mark.parametrize("width, resolution", [(1, 1), (30, 1), (60, 60), (300, 60), (7200, 3600)])
+def test_resolution_for(width, resolution):
+    assert bucket_rollups.resolution_for(width) == resolution
+
+
+def test_resolution_respects_retention():
+    now = time.time()
+    old = now - settings.rollup.second_retention - 3600
+    assert bucket_rollups.resolution_for(90, now - 60) == 1
+    assert bucket_rollups.resolution_for(90, old) is None
+    assert bucket_rollups.resolution_for(120, old) == 60
+    assert bucket_rollups.resolution_for(7200, now - settings.rollup.minute_retention - 3600) == 3600
+
+
+def test_range_beyond_second_retention_is_rejected(seeded):
+    old = int(time.time() - settings.rollup.second_retention - 3600) // 3600 * 3600
+    result = _aggregate(seeded, bucket=90, start=old, end=old + 3600)
+    assert "error" in result and "60 秒整数倍" in result["error"]
+    result = _aggregate(seeded, bucket=60, start=old, end=old + 3600)
+    assert result["resolution"] == 60
+    assert len(result["series"]) == 60
+
+
+def test_chat_tools_read_buckets(seeded):
+    traffic = seeded.portal.call(LLMEngine._execute_tool, "query_traffic_stats", {"minutes": 60})
+    assert 0 < traffic["total_packets"] <= _total(seeded)
+    assert traffic["by_protocol"]["CAN"] > 0
+    can = seeded.portal.call(LLMEngine._execute_tool, "query_traffic_stats", {"protocol": "can"})
+    assert set(can["by_protocol"]) == {"CAN"}
+
+    events = seeded.portal.call(LLMEngine._execute_tool, "get_anomaly_events", {"limit": 3})
+    assert sum(events["counts_by_severity"].values()) > 0
+    assert 0 < len(events["events"]) <= 3
+    assert events["top_types"]
@@ -0,0 +1,109 @@
+"""会话上下文缓存：Token 预算、滚动摘要与写穿恢复"""
+
+import asyncio
+
+from app.database import async_session
+from app.services.chat_context import ChatContext, ChatContextCache, ChatTurn, estimate_tokens
+
+
+def _cache(summarizer=None):
+    cache = ChatContextCache(summarizer)
+    cache.history_budget = 200
+    cache.summary_budget = 100
+    cache.min_recent = 2
+    return cache
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("异常告警") == 4 + 4
+    assert estimate_tokens("a" * 40) == 10 + 4
+
+
+def test_build_messages_respects_budget():
+    cache = _cache()
+    ctx = ChatContext(session_id="s", summary="此前讨论了DoS告警")
+    for i in range(20):
+        ctx.turns.append(ChatTurn(i + 1, "user" if i % 2 == 0 else "assistant", "x" * 80, 24))
+    messages = cache.build_messages(ctx, "最新问题")
+    assert messages[0]["role"] == "system" and "DoS" in messages[0]["content"]
+    assert messages[-1] == {"role": "user", "content": "最新问题"}
+    history = messages[1:-1]
+    assert 2 <= len(history) < 20
+    assert sum(estimate_tokens(m["content"]) for m in history) <= cache.history_budget
+
+
+async def _conversation(session_id):
+    calls = []
+
+    async def summarizer(summary, dialogue, max_chars):
+        calls.append(len(dialogue))
+        return f"摘要({len(dialogue)})"
+
+    cache = _cache(summarizer)
+    async with async_session() as db:
+        ctx = await cache.get(db, session_id)
+        for i in range(8):
+            await cache.append(db, ctx, f"问题{i} " + "y" * 100, {"content": "回答 " + "z" * 100,
+                                                                  "tool_calls": None})
+            # 等待本轮调度的折叠结束，折叠期间追加的消息留到下一轮
+            while cache._tasks:
+                await asyncio.sleep(0.01)
+
+    assert calls and cache.folds >= 1
+    assert ctx.history_tokens <= cache.history_budget
+    kept = [t.id for t in ctx.turns]
+
+    # 进程内缓存失效后由数据库恢复摘要与未折叠的消息
+    fresh = _cache()
+    async with async_session() as db:
+        restored = await fresh.get(db, session_id)
+    assert restored.summary == ctx.summary
+    assert [t.id for t in restored.turns] == kept
+    return cache.stats(), fresh.stats()
+
+
+def test_fold_and_restore(client):
+    stats, fresh = client.portal.call(_conversation, "chat-test")
+    assert stats["misses"] == 1
+    assert fresh["misses"] == 1
+
+
+async def _slow_fold(session_id):
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def summarizer(summary, dialogue, max_chars):
+        started.set()
+        await release.wait()
+        return "慢摘要"
+
+    cache = _cache(summarizer)
+    answer = {"content": "回答 " + "z" * 100, "tool_calls": None}
+    async with async_session() as db:
+        ctx = await cache.get(db, session_id)
+        i = 0
+        while not cache._tasks:
+            async with ctx.lock:
+                await cache.append(db, ctx, f"问题{i} " + "y" * 100, answer)
+            i += 1
+        await asyncio.wait_for(started.wait(), 1)
+
+        # 摘要生成期间，同一会话的新消息不等待折叠
+        await asyncio.wait_for(ctx.lock.acquire(), 0.5)
+        try:
+            await cache.append(db, ctx, "新问题", answer)
+        finally:
+            ctx.lock.release()
+        newest = ctx.turns[-1].id
+
+        release.set()
+        while cache._tasks:
+            await asyncio.sleep(0.01)
+    return ctx, newest
+
+
+def test_fold_does_not_block_session(client):
+    ctx, newest = client.portal.call(_slow_fold, "chat-slow")
+    assert ctx.summary == "慢摘要"
+    assert ctx.summarized_upto < newest
+    assert ctx.turns[-1].id == newest
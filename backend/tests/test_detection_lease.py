@@ -0,0 +1,67 @@
+"""多进程共用检测游标时的租约"""
+
+import time
+
+from sqlalchemy import update
+
+from app.database import async_session
+from app.models.anomaly import DetectionCursorORM
+from app.routers.anomaly import detector_pool
+from app.services import detection_pipeline
+from app.services.detection_pipeline import CURSOR_NAME, _claim, get_cursor, run_detection
+
+
+async def _set_lease(owner, until):
+    async with async_session() as db:
+        await get_cursor(db)
+        await db.execute(
+            update(DetectionCursorORM).where(DetectionCursorORM.name == CURSOR_NAME)
+            .values(lease_owner=owner, lease_until=until)
+        )
+        await db.commit()
+
+
+async def _claim_as(owner):
+    original = detection_pipeline.LEASE_OWNER
+    detection_pipeline.LEASE_OWNER = owner
+    try:
+        async with async_session() as db:
+            return await _claim(db)
+    finally:
+        detection_pipeline.LEASE_OWNER = original
+
+
+async def _detect():
+    async with async_session() as db:
+        return await run_detection(db, detector_pool, 500, 10)
+
+
+def test_lease_is_exclusive(client):
+    call = client.portal.call
+    call(_set_lease, None, None)
+    assert call(_claim_as, "worker-a")
+    assert call(_claim_as, "worker-a")  # 续期
+    assert not call(_claim_as, "worker-b")
+
+    call(_set_lease, "worker-a", time.time() - 1)  # 持有者退出，租约过期
+    assert call(_claim_as, "worker-b")
+    call(_set_lease, None, None)
+
+
+def test_busy_worker_skips_detection(client):
+    client.post("/api/traffic/simulate?scenario=normal&count=100&vehicle_id=car1")
+    client.portal.call(_set_lease, "other-worker", time.time() + 60)
+    result = client.portal.call(_detect)
+    assert result["busy"]
+    assert client.post("/api/anomaly/detect").json()["processed"] == 0
+
+    client.portal.call(_set_lease, None, None)
+    result = client.portal.call(_detect)
+    assert result["processed"] > 0
+    assert not result.get("busy")
+
+    async def lease():
+        async with async_session() as db:
+            return (await get_cursor(db)).lease_owner
+
+    assert client.portal.call(lease) is None  # 检测结束后释放
@@ -0,0 +1,78 @@
+"""后台持续检测调度器"""
+
+import asyncio
+import time
+
+from sqlalchemy import update
+
+from app.config import settings
+from app.database import async_session
+from app.models.anomaly import DetectionCursorORM
+from app.routers.anomaly import detector_pool
+from app.services.detection_pipeline import CURSOR_NAME, get_cursor
+from app.services.detection_scheduler import DetectionScheduler
+
+
+async def _set_lease(owner, until):
+    async with async_session() as db:
+        await get_cursor(db)
+        await db.execute(
+            update(DetectionCursorORM).where(DetectionCursorORM.name == CURSOR_NAME)
+            .values(lease_owner=owner, lease_until=until)
+        )
+        await db.commit()
+
+
+def test_plan_adapts_to_throughput():
+    scheduler = DetectionScheduler(detector_pool)
+    # 尚无吞吐数据时按块上限处理
+    assert scheduler._plan(50_000) == (scheduler.max_batch, 1)
+    scheduler.throughput = 10_000.0  # 单轮目标耗时为间隔的一半
+    chunk_size, chunks = scheduler._plan(50_000)
+    assert chunk_size == scheduler.max_batch
+    assert chunks == min(scheduler.max_chunks, 25_000 // scheduler.max_batch + 1)
+    assert scheduler._plan(10) == (scheduler.min_batch, 1)
+
+
+def test_threshold_wakes_scheduler(monkeypatch):
+    monkeypatch.setattr(settings.scheduler, "enabled", True)
+    scheduler = DetectionScheduler(detector_pool)
+    scheduler.notify_packets(scheduler.packet_threshold - 1)
+    assert not scheduler._wake.is_set()
+    scheduler.notify_packets(1)
+    assert scheduler._wake.is_set()
+
+
+def test_run_once_drains_backlog(client):
+    client.post("/api/traffic/simulate?scenario=normal&count=300&vehicle_id=car1")
+    scheduler = DetectionScheduler(detector_pool)
+    result = client.portal.call(scheduler.run_once)
+    assert result["processed"] == 300 + 150 + 100
+    stats = scheduler.stats()
+    assert stats["runs"] == 1
+    assert stats["backlog_packets"] == 0
+    assert stats["throughput_pps"] > 0
+    assert client.portal.call(scheduler.run_once) == {}
+
+
+def test_standby_worker_does_not_busy_loop(client, monkeypatch):
+    client.post("/api/traffic/simulate?scenario=normal&count=100&vehicle_id=car1")
+    monkeypatch.setattr(settings.scheduler, "enabled", True)
+    monkeypatch.setattr(settings.scheduler, "interval", 0.1)
+    scheduler = DetectionScheduler(detector_pool)
+
+    async def run_for(seconds):
+        await _set_lease("other-worker", time.time() + 60)
+        task = asyncio.create_task(scheduler.run_forever())
+        for _ in range(int(seconds / 0.05)):
+            await asyncio.sleep(0.05)
+            scheduler.notify_packets(scheduler.packet_threshold)  # 持续入库
+        task.cancel()
+        await _set_lease(None, None)
+
+    client.portal.call(run_for, 1.0)
+    stats = scheduler.stats()
+    assert stats["runs"] == 0
+    assert stats["standby"]
+    assert 1 <= stats["standby_rounds"] <= 12
+    assert stats["backlog_packets"] > 0
@@ -0,0 +1,61 @@
+"""实时推送：帧合并、慢订阅者与 /ws/live"""
+
+from app.services.live_hub import LiveHub, merge_frames
+from app.simulators.can_simulator import generate_normal_can
+
+
+def _frame(seq, packets, alerts=()):
+    return {
+        "type": "update", "seq": seq, "ts": float(seq),
+        "delta": {"packets": packets, "by_protocol": {"CAN": packets}, "alerts": len(alerts)},
+        "alerts": list(alerts), "packets": [{"seq": seq}], "rates": {"packets_per_second": seq},
+    }
+
+
+def test_merge_keeps_deltas_and_latest_rates():
+    merged = merge_frames(_frame(1, 10, ["a"]), _frame(2, 5, ["b", "c"]), max_alerts=2, max_packets=5)
+    assert merged["seq"] == 2
+    assert merged["delta"] == {"packets": 15, "by_protocol": {"CAN": 15}, "alerts": 3}
+    assert merged["alerts"] == ["b", "c"]  # 新告警在前，按上限截断
+    assert merged["packets"] == [{"seq": 2}, {"seq": 1}]
+    assert merged["rates"] == {"packets_per_second": 2}
+    assert merged["coalesced"] == 2
+
+    reset = {"type": "reset", "seq": 3, "ts": 3.0, "rates": {}}
+    assert merge_frames(_frame(1, 10), reset, 2, 5) is reset
+    assert merge_frames(reset, _frame(4, 1), 2, 5)["type"] == "reset"
+
+
+def test_slow_subscriber_holds_one_merged_frame():
+    hub = LiveHub()
+    sub = hub.subscribe()
+    for seq in range(1, 6):
+        sub.offer(_frame(seq, 1))
+    assert sub.dropped == 4
+    assert sub.pending["delta"]["packets"] == 5
+    assert sub.pending["seq"] == 5
+    hub.unsubscribe(sub)
+    assert hub.stats()["subscribers"] == 0
+
+
+def test_take_frame_drains_increments():
+    hub = LiveHub()
+    hub.publish_packets(generate_normal_can(30, 1000.0))
+    frame = hub._take_frame()
+    assert frame["delta"]["packets"] == 30
+    assert len(frame["packets"]) <= hub.max_packets
+    assert not hub._dirty
+    hub.publish_reset()
+    assert hub._take_frame()["type"] == "reset"
+
+
+def test_live_socket_receives_updates(client):
+    with client.websocket_connect("/ws/live") as ws:
+        client.post("/api/traffic/simulate?scenario=normal&count=40&vehicle_id=car1")
+        total = 0
+        while total < 40:
+            frame = ws.receive_json()
+            if frame["type"] == "update":
+                total += frame["delta"]["packets"]
+        assert total >= 40
+        assert frame["packets"][0]["vehicle_id"] == "car1"
@@ -0,0 +1,116 @@
+"""弹性 LLM 客户端：熔断、重试、故障转移与并发限制"""
+
+import asyncio
+import dataclasses
+import time
+
+import pytest
+
+from app.config import settings
+from app.services.llm_client import CircuitBreaker, LLMUnavailableError, ResilientLLMClient
+
+
+def _client(**overrides) -> ResilientLLMClient:
+    options = dict(
+        provider="openai", fallback_enabled=True, max_retries=2,
+        retry_backoff=0.001, retry_backoff_max=0.001, breaker_failures=3,
+        breaker_cooldown=60.0, request_deadline=5.0, queue_timeout=0.05,
+    )
+    options.update(overrides)
+    return ResilientLLMClient(dataclasses.replace(settings.llm, **options))
+
+
+def _script(provider, outcomes):
+    """按顺序返回结果或抛出异常的 provider.create 替身"""
+    calls = []
+
+    async def create(timeout, **kwargs):
+        calls.append(kwargs)
+        provider.stats.requests += 1
+        outcome = outcomes.pop(0) if outcomes else "ok"
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return f"{provider.name}:{outcome}"
+
+    provider.create = create
+    return calls
+
+
+def test_breaker_opens_and_probes():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # 冷却后只放行一次试探
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 2
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_retries_transient_errors():
+    client = _client()
+    primary, _ = client.providers
+    calls = _script(primary, [asyncio.TimeoutError(), "ok"])
+    assert asyncio.run(client.create(messages=[])) == "openai:ok"
+    assert len(calls) == 2
+    assert primary.stats.retries == 1
+    assert primary.breaker.state == "closed"
+
+
+def test_fails_over_and_skips_open_circuit():
+    client = _client()
+    primary, backup = client.providers
+    _script(primary, [asyncio.TimeoutError()] * 3)
+    _script(backup, [])
+    assert asyncio.run(client.create(messages=[])) == "ollama:ok"
+    assert primary.breaker.state == "open"
+    assert client.failovers == 1
+
+    primary_calls = _script(primary, [])
+    assert asyncio.run(client.create(messages=[])) == "ollama:ok"
+    assert primary_calls == []  # 熔断期间不再调用主提供方
+    assert primary.stats.rejected == 1
+
+
+def test_client_errors_are_not_retried():
+    client = _client()
+    primary, backup = client.providers
+    _script(primary, [ValueError("bad request")])
+    backup_calls = _script(backup, [])
+    with pytest.raises(ValueError):
+        asyncio.run(client.create(messages=[]))
+    assert backup_calls == []
+    assert primary.breaker.failures == 0
+
+
+def test_all_providers_down():
+    client = _client(max_retries=0)
+    for provider in client.providers:
+        _script(provider, [asyncio.TimeoutError()])
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(client.create(messages=[]))
+
+
+def test_saturated_provider_fails_over():
+    client = _client(max_concurrency=1)
+    primary, backup = client.providers
+    _script(backup, [])
+
+    async def run():
+        await primary.semaphore.acquire()  # 主提供方的并发槽位被占满
+        try:
+            return await client.create(messages=[])
+        finally:
+            primary.semaphore.release()
+
+    assert asyncio.run(run()) == "ollama:ok"
+    assert primary.stats.rejected == 1
@@ -0,0 +1,75 @@
+"""对话工具调用：参数校验与错误回传"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+from app.services.llm_engine import TOOL_MAX_LIMIT, TOOL_MAX_MINUTES, LLMEngine
+
+
+def _tool(client, name, arguments):
+    return client.portal.call(LLMEngine._execute_tool, name, arguments)
+
+
+def test_tool_arguments_are_coerced_and_clamped(client):
+    result = _tool(client, "query_traffic_stats", {"protocol": "CAN", "minutes": "15"})
+    assert result["minutes"] == 15
+    result = _tool(client, "query_traffic_stats", {"minutes": 10 ** 9})
+    assert result["minutes"] == TOOL_MAX_MINUTES
+    assert result["protocol"] == "ALL"
+    result = _tool(client, "query_traffic_stats", {"minutes": -3})
+    assert result["minutes"] == 1
+    assert "error" not in _tool(client, "get_anomaly_events", {"limit": TOOL_MAX_LIMIT * 10})
+
+
+def test_invalid_tool_arguments_return_error(client):
+    assert "error" in _tool(client, "query_traffic_stats", {"minutes": "abc"})
+    assert "error" in _tool(client, "query_traffic_stats", {"minutes": [5]})
+    assert "error" in _tool(client, "get_anomaly_events", {"limit": True})
+    assert "error" in _tool(client, "get_anomaly_events", ["limit"])
+    assert "error" in _tool(client, "drop_tables", {})
+
+
+def _response(tool_calls=None, content=""):
+    message = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=message)])
+
+
+def _tool_call(name, arguments):
+    return SimpleNamespace(id=f"call_{name}", function=SimpleNamespace(name=name, arguments=arguments))
+
+
+def test_chat_returns_tool_errors_to_model(monkeypatch):
+    engine = LLMEngine.__new__(LLMEngine)
+    replies = [
+        _response([_tool_call("query_traffic_stats", '{"minutes": "lots"}'),
+                   _tool_call("get_anomaly_events", "{}"),
+                   _tool_call("query_traffic_stats", "not json")]),
+        _response(content="已完成"),
+    ]
+    seen = []
+
+    async def fake_call(messages, **kwargs):
+        seen.append(list(messages))
+        return replies.pop(0)
+
+    calls = []
+
+    async def broken_tool(name, arguments):
+        calls.append(name)
+        if name == "get_anomaly_events":
+            raise RuntimeError("汇总不可用")
+        return await LLMEngine._execute_tool(name, arguments)
+
+    monkeypatch.setattr(engine, "_call_llm", fake_call, raising=False)
+    monkeypatch.setattr(engine, "_execute_tool", broken_tool, raising=False)
+    result = asyncio.run(engine.chat([{"role": "user", "content": "最近流量如何"}]))
+
+    assert result["content"] == "已完成"
+    tool_messages = [m for m in seen[-1] if m["role"] == "tool"]
+    assert len(tool_messages) == 3
+    assert "工具参数无效" in json.loads(tool_messages[0]["content"])["error"]
+    assert "工具执行失败" in json.loads(tool_messages[1]["content"])["error"]
+    # 无法解析的参数不以默认值执行
+    assert "不是有效的 JSON" in json.loads(tool_messages[2]["content"])["error"]
+    assert calls == ["query_traffic_stats", "get_anomaly_events"]
@@ -0,0 +1,104 @@
+"""Isolation Forest 基线窗口与漂移重训练"""
+
+import asyncio
+import threading
+
+import numpy as np
+
+from app.config import settings
+from app.services.anomaly_detector import AnomalyDetectorService, IsolationForestDetector
+from app.services.packet_batch import PacketBatch
+from app.services.vehicle_registry import VehicleDetectorRegistry
+from app.simulators.can_simulator import generate_fuzzy_attack, generate_normal_can
+
+
+def test_window_keeps_running_sum():
+    detector = IsolationForestDetector()
+    detector.window_size = 8
+    rng = np.random.default_rng(0)
+    rows = rng.normal(size=(21, 5))
+    for chunk in np.array_split(rows, 5):
+        detector._append(chunk)
+    assert detector.window_count == 8
+    kept = rows[-8:]
+    np.testing.assert_allclose(np.sort(detector.window_snapshot(), axis=0), np.sort(kept, axis=0))
+    np.testing.assert_allclose(detector._window_sum, kept.sum(axis=0))
+
+
+def test_drift_triggers_retrain(monkeypatch):
+    monkeypatch.setattr(settings.detector, "retrain_min_samples", 50)
+    detector = IsolationForestDetector()
+    detector.fit(PacketBatch.from_packets(generate_normal_can(300, 0.0)))
+    assert detector.drift_score() < settings.detector.drift_threshold
+    assert not detector.maybe_retrain()
+
+    shifted = np.tile([5000.0, 64.0, 6.0, 1.0, 3.0], (detector.window_size, 1))
+    detector._append(shifted)
+    assert detector.drift_score() > settings.detector.drift_threshold
+    generation = detector.generation
+    assert detector.maybe_retrain()
+    assert detector.generation == generation + 1
+
+
+def test_flagged_frames_stay_out_of_window():
+    service = AnomalyDetectorService()
+    normal = generate_normal_can(400, 0.0)
+    service.train(normal)
+    before = service.ml_detector.window_count
+
+    attack = generate_fuzzy_attack(200, 100.0)
+    service.detect(attack)
+    snapshot = service.ml_detector.window_snapshot()[before:]
+    learned_ids = set(snapshot[:, 0].astype(int).tolist())
+    attack_ids = {int(p.msg_id, 16) for p in attack
+                  if p.msg_id not in service.rule_detector.VALID_CAN_IDS}
+    assert not learned_ids & attack_ids
+
+
+def _drifted_registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.detector, "retrain_min_samples", 50)
+    registry = VehicleDetectorRegistry(1, str(tmp_path))
+    detector = registry.get("car1")
+    detector.train(generate_normal_can(300, 0.0))
+    ml = detector.ml_detector
+    ml._append(np.tile([5000.0, 64.0, 6.0, 1.0, 3.0], (ml.window_size, 1)))
+    return registry, detector
+
+
+def test_rows_appended_during_build_stay_in_sum(tmp_path, monkeypatch):
+    registry, detector = _drifted_registry(tmp_path, monkeypatch)
+    ml = detector.ml_detector
+    started, release = threading.Event(), threading.Event()
+
+    def slow_build(snapshot):
+        started.set()
+        release.wait(5)
+        return IsolationForestDetector.build(snapshot)
+
+    async def run():
+        task = asyncio.create_task(registry.maintain_async(slow_build))
+        await asyncio.to_thread(started.wait, 5)
+        # 训练期间事件循环继续检测并追加窗口
+        ml._append(np.full((10, 5), 7.0))
+        release.set()
+        return await task
+
+    generation = ml.generation
+    assert asyncio.run(run()) == 1
+    assert ml.generation == generation + 1
+    np.testing.assert_allclose(ml._window_sum, ml.window_snapshot().sum(axis=0))
+
+
+def test_evicted_detector_keeps_dumped_model(tmp_path, monkeypatch):
+    registry, detector = _drifted_registry(tmp_path, monkeypatch)
+    generation = detector.ml_detector.generation
+
+    async def run():
+        task = asyncio.create_task(registry.maintain_async())
+        await asyncio.sleep(0)
+        registry.get("car2")  # 容量为 1，car1 被换出并落盘
+        return await task
+
+    assert asyncio.run(run()) == 0
+    assert detector.ml_detector.generation == generation
+    assert registry._load("car1").ml_detector.generation == generation
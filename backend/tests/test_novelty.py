@@ -0,0 +1,46 @@
+"""未知CAN ID的跨批次新颖性状态"""
+
+import pickle
+
+from app.config import settings
+from app.models.packet import UnifiedPacket
+from app.services.anomaly_detector import NoveltyTracker, RuleBasedDetector
+
+
+def _can(msg_id: str, ts: float, source: str = "ECU_X") -> UnifiedPacket:
+    return UnifiedPacket(timestamp=ts, protocol="CAN", source=source, destination="BROADCAST",
+                         msg_id=msg_id, payload_hex="00" * 8)
+
+
+def test_alerts_once_per_window_and_carries_previous_count():
+    tracker = NoveltyTracker(window=60.0, extended_slots=64)
+    assert tracker.observe({"0x555": 3}, 0.0) == [("0x555", 3, 0)]
+    assert tracker.observe({"0x555": 2}, 30.0) == []
+    # 新窗口再告警一次，附带上一窗口累计次数
+    assert tracker.observe({"0x555": 1}, 61.0) == [("0x555", 1, 5)]
+    # 中间整窗口无活动，上一窗口计数清零
+    assert tracker.observe({"0x555": 1}, 300.0) == [("0x555", 1, 0)]
+
+
+def test_extended_ids_hash_into_fixed_slots():
+    tracker = NoveltyTracker(window=60.0, extended_slots=8)
+    assert tracker.slot("0x7FF") == 0x7FF
+    slots = {tracker.slot(f"0x{0x18DA0000 + i:08X}") for i in range(100)}
+    assert slots <= set(range(2048, 2048 + 8))
+    novel = tracker.observe({f"0x{0x18DA0000 + i:08X}": 1 for i in range(100)}, 0.0)
+    assert len(novel) <= 8  # 哈希冲突只会少报
+    assert tracker.reported.nbytes == (2048 + 8 + 7) // 8
+
+
+def test_detector_summarizes_bursts_and_survives_pickle(monkeypatch):
+    monkeypatch.setattr(settings.detector, "novelty_max_alerts", 4)
+    detector = RuleBasedDetector()
+    batch = [_can(f"0x{0x400 + i:03X}", 10.0 + i * 0.01) for i in range(10)]
+    alerts = detector._check_unknown_id(batch)
+    assert len(alerts) == 4 + 1
+    assert "另有 6 个未知CAN ID" in alerts[-1].description
+
+    restored = pickle.loads(pickle.dumps(detector))
+    assert restored._check_unknown_id(batch) == []
+    assert restored._check_unknown_id([_can("0x6AA", 20.0)])[0].target_node == "0x6AA"
+    assert restored._check_unknown_id([_can("0x0C0", 21.0)]) == []  # 白名单ID不计入
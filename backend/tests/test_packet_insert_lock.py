@@ -0,0 +1,34 @@
+"""报文插入在 PostgreSQL 上按提交顺序分配ID"""
+
+import asyncio
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+
+from app.services.packet_store import PACKET_INSERT_LOCK, packet_store
+
+
+class _RecordingSession:
+    def __init__(self, dialect: str):
+        self.bind = SimpleNamespace(dialect=SimpleNamespace(name=dialect))
+        self.statements = []
+
+    async def execute(self, stmt, params=None):
+        self.statements.append(str(stmt.compile(dialect=postgresql.dialect())))
+
+
+def test_postgres_insert_takes_advisory_lock_first():
+    db = _RecordingSession("postgresql")
+    asyncio.run(packet_store.insert_rows(db, [{"timestamp": 1.0}]))
+    assert "pg_advisory_xact_lock" in db.statements[0]
+    assert db.statements[1].startswith("INSERT INTO packets")
+    assert len(db.statements) == 2
+    assert PACKET_INSERT_LOCK > 0
+
+
+def test_sqlite_insert_has_no_lock():
+    db = _RecordingSession("sqlite")
+    asyncio.run(packet_store.insert_rows(db, [{"timestamp": 1.0}]))
+    assert len(db.statements) == 1
+    asyncio.run(packet_store.insert_rows(db, []))
+    assert len(db.statements) == 1
@@ -0,0 +1,88 @@
+"""紧凑报文存储：字典编码、画像去重与惰性解码"""
+
+import numpy as np
+from sqlalchemy import delete, func, insert, select
+
+from app.database import async_session
+from app.models.packet import MetadataProfileORM, PacketORM, StringDictORM
+from app.services.packet_batch import PacketBatch
+from app.services.packet_store import PACKET_COLUMNS, packet_store
+from app.simulators.can_simulator import generate_dos_attack, generate_normal_can
+from app.simulators.eth_simulator import generate_normal_eth
+from app.simulators.v2x_simulator import generate_normal_v2x
+
+
+def _packets():
+    packets = (generate_normal_can(60, 500.0) + generate_dos_attack(30, 500.0)
+               + generate_normal_eth(20, 500.0) + generate_normal_v2x(20, 500.0))
+    for p in packets:
+        p.vehicle_id = "store-car"
+    return packets
+
+
+async def _round_trip(packets):
+    async with async_session() as db:
+        rows = await packet_store.encode_packets(db, packets)
+        await packet_store.insert_rows(db, rows)
+        await db.commit()
+        vehicle = await packet_store.code_of(db, "vehicle", "store-car")
+        stored = (await db.execute(
+            select(*PACKET_COLUMNS).where(PacketORM.vehicle_code == vehicle).order_by(PacketORM.id)
+        )).all()
+        profiles = await db.scalar(select(func.count(MetadataProfileORM.id)))
+        await db.execute(delete(PacketORM).where(PacketORM.vehicle_code == vehicle))
+        await db.commit()
+    return rows, stored, profiles
+
+
+def test_round_trip_is_lossless(client):
+    packets = _packets()
+    rows, stored, profiles = client.portal.call(_round_trip, packets)
+    assert len(stored) == len(packets)
+    for original, row in zip(packets, stored):
+        assert packet_store.to_packet(row).model_dump() == original.model_dump()
+    # 元数据按内容去重：正常帧与攻击帧只有少量画像
+    assert profiles < 10
+    # 可推导的解码结果不落库，V2X 运动学字段无法推导
+    assert all(r["payload_extra"] is None for r in rows[:60])  # 正常CAN帧
+    assert all(r["payload_extra"] for r, p in zip(rows, packets) if p.protocol == "V2X")
+
+
+def test_detection_batch_matches_packets(client):
+    packets = _packets()
+    _, stored, _ = client.portal.call(_round_trip, packets)
+    batch = packet_store.detection_batch(stored)
+    expected = PacketBatch.from_packets(packets)
+    np.testing.assert_array_equal(batch.can_ids, expected.can_ids)
+    np.testing.assert_array_equal(batch.payload, expected.payload)
+    np.testing.assert_allclose(batch.features(), expected.features())
+    assert [p.msg_id for p in batch.packets] == [p.msg_id for p in packets]
+
+
+async def _insert_foreign_codes():
+    """模拟其他进程：直接写入新的字典项与引用它们的报文，本进程缓存不知情"""
+    async with async_session() as db:
+        [row] = await packet_store.encode_packets(db, generate_normal_can(1, 900.0)[:1])
+        await db.commit()
+        codes = {}
+        for kind, value in (("protocol", "XCP"), ("node", "FOREIGN_ECU")):
+            codes[value] = await db.scalar(
+                insert(StringDictORM).values(kind=kind, value=value).returning(StringDictORM.id)
+            )
+        row.update(protocol_code=codes["XCP"], source_code=codes["FOREIGN_ECU"])
+        await packet_store.insert_rows(db, [row])
+        await db.commit()
+        stored = (await db.execute(
+            select(*PACKET_COLUMNS).where(PacketORM.protocol_code == codes["XCP"])
+        )).all()
+        await packet_store.prepare(db, stored)
+        await db.execute(delete(PacketORM).where(PacketORM.protocol_code == codes["XCP"]))
+        await db.commit()
+    return stored
+
+
+def test_prepare_reloads_unknown_protocol_codes(client):
+    stored = client.portal.call(_insert_foreign_codes)
+    fields = packet_store.row_fields(stored[0])
+    assert fields["protocol"] == "XCP"
+    assert fields["source"] == "FOREIGN_ECU"
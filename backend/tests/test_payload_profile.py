@@ -0,0 +1,51 @@
+"""按 CAN ID 学习的负载字节/比特画像"""
+
+from app.models.packet import UnifiedPacket
+from app.services.anomaly_detector import PayloadProfileDetector
+from app.services.packet_batch import PacketBatch
+
+
+def _frames(payloads, msg_id="0x0C0", start=0.0):
+    return PacketBatch.from_packets([
+        UnifiedPacket(timestamp=start + i * 0.01, protocol="CAN", source="ECM",
+                      destination="BUS", msg_id=msg_id, payload_hex=h)
+        for i, h in enumerate(payloads)
+    ])
+
+
+def _normal(n, start=0.0):
+    # byte0 计数器 0x10-0x2F，byte1 恒为 0x80，其余为 0
+    return _frames([f"{0x10 + i % 32:02X}80" + "00" * 6 for i in range(n)], start=start)
+
+
+def _fitted():
+    detector = PayloadProfileDetector()
+    detector.fit(_normal(200))
+    assert detector.is_fitted
+    return detector
+
+
+def test_normal_payload_is_clean():
+    assert _fitted().check(_normal(64, start=10.0)) == []
+
+
+def test_constant_bit_change_is_high():
+    alerts = _fitted().check(_frames(["1081" + "00" * 6], start=10.0))
+    assert len(alerts) == 1
+    assert alerts[0].severity == "high"
+    assert "常量位" in alerts[0].description
+
+
+def test_byte_range_and_dlc():
+    detector = _fitted()
+    out_of_range = detector.check(_frames(["F080" + "00" * 6], start=10.0))
+    assert "字节 [0]" in out_of_range[0].description
+    short = detector.check(_frames(["1080"], start=11.0))
+    assert "DLC" in short[0].description
+
+
+def test_unknown_or_sparse_ids_are_skipped():
+    detector = PayloadProfileDetector()
+    detector.fit(_frames(["00" * 8] * (detector.min_samples - 1), msg_id="0x130"))
+    assert not detector.is_fitted
+    assert _fitted().check(_frames(["FF" * 8], msg_id="0x7E0")) == []
@@ -0,0 +1,74 @@
+"""预警报告的本地预聚合与 map-reduce 生成"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+from app.config import settings
+from app.models.anomaly import AnomalyEvent
+from app.services import report_builder
+from app.services.llm_engine import LLMEngine
+
+
+def _events(types: int, sources: int, repeat: int = 3):
+    return [
+        AnomalyEvent(timestamp=1000.0 + i, anomaly_type=f"type{t}", severity="high" if t % 2 else "low",
+                     confidence=0.5 + 0.01 * i, protocol="CAN", source_node=f"0x{s:03X}",
+                     description=f"事件 {t}/{s}")
+        for t in range(types) for s in range(sources) for i in range(repeat)
+    ]
+
+
+def test_group_events_aggregates_and_orders():
+    groups = report_builder.group_events(_events(2, 3))
+    assert len(groups) == 6
+    assert all(g.count == 3 for g in groups)
+    assert groups[0].severity == "high"
+    assert groups[0].first_ts == 1000.0 and groups[0].last_ts == 1002.0
+    assert groups[0].max_confidence == 0.52
+    table = report_builder.table(groups)
+    assert table.splitlines()[0] == report_builder.TABLE_HEADER
+    assert len(table.splitlines()) == 7
+
+
+def test_partition_respects_limits():
+    groups = report_builder.group_events(_events(5, 7, repeat=1))
+    chunks = report_builder.partition(groups, chunk_rows=10, max_chunks=3)
+    assert len(chunks) == 3
+    assert all(len(c) <= 10 for c in chunks)
+    # 同一类型的分组不被拆散到不相邻的块
+    assert {g.anomaly_type for g in chunks[0]} == {"type1"}
+
+
+def _engine(prompts):
+    engine = LLMEngine.__new__(LLMEngine)
+
+    async def fake_call(messages, **kwargs):
+        prompts.append(messages[-1]["content"])
+        content = json.dumps({"title": "报告"})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    engine._call_llm = fake_call
+    return engine
+
+
+def test_report_prompt_size_is_bounded(monkeypatch):
+    monkeypatch.setattr(settings.llm, "report_direct_rows", 5)
+    monkeypatch.setattr(settings.llm, "report_chunk_rows", 4)
+    monkeypatch.setattr(settings.llm, "report_max_chunks", 3)
+
+    prompts = []
+    small = asyncio.run(_engine(prompts).generate_report(_events(1, 2)))
+    assert small == {"title": "报告"}
+    assert len(prompts) == 1  # 分组少时单次调用
+
+    prompts.clear()
+    asyncio.run(_engine(prompts).generate_report(_events(6, 6, repeat=20)))
+    assert len(prompts) == 3 + 1  # 3 个 map 块加一次 reduce
+    longest = max(len(p) for p in prompts)
+
+    prompts.clear()
+    asyncio.run(_engine(prompts).generate_report(_events(6, 6, repeat=200)))
+    assert len(prompts) == 4
+    # 事件数量增长十倍，提示长度不随之增长
+    assert max(len(p) for p in prompts) <= longest + 50
@@ -0,0 +1,72 @@
+"""后台报告任务：提交、轮询、幂等与失败"""
+
+import time
+
+import pytest
+
+from app.routers.llm import llm, report_jobs
+
+
+def _wait(client, job_id, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/api/llm/report/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"报告任务 {job_id} 未结束")
+
+
+@pytest.fixture
+def fake_report(monkeypatch):
+    calls = []
+
+    async def generate_report(events):
+        calls.append(len(events))
+        return {"title": "测试报告", "events": len(events)}
+
+    monkeypatch.setattr(llm, "generate_report", generate_report)
+    return calls
+
+
+def test_job_fails_without_events(client, fake_report):
+    job = client.post("/api/llm/report").json()
+    assert job["status"] == "queued"
+    job = _wait(client, job["job_id"])
+    assert job["status"] == "failed"
+    assert "No anomaly events" in job["error"]
+    assert fake_report == []
+
+
+def test_job_generates_and_deduplicates(client, fake_report):
+    client.post("/api/traffic/simulate?scenario=dos&count=300&vehicle_id=car1")
+    client.post("/api/anomaly/detect?max_chunks=100")
+    expected = min(5, client.get("/api/anomaly/events?limit=1").json()["total"])
+    assert expected > 0
+
+    headers = {"Idempotency-Key": "report-1"}
+    first = client.post("/api/llm/report?limit=5", headers=headers).json()
+    again = client.post("/api/llm/report?limit=5", headers=headers).json()
+    assert not first["deduplicated"] and again["deduplicated"]
+    assert again["job_id"] == first["job_id"]
+
+    job = _wait(client, first["job_id"])
+    assert job["status"] == "done"
+    assert job["report"] == {"title": "测试报告", "events": expected}
+    assert job["report_id"]
+    assert fake_report == [expected]
+    assert client.get("/api/llm/report/missing").json() == {"error": "Report job not found"}
+
+
+def test_failed_job_is_resubmitted(client, monkeypatch):
+    async def broken(events):
+        raise RuntimeError("LLM 不可用")
+
+    monkeypatch.setattr(llm, "generate_report", broken)
+    headers = {"Idempotency-Key": "report-2"}
+    failed = _wait(client, client.post("/api/llm/report", headers=headers).json()["job_id"])
+    assert failed["error"] == "LLM 不可用"
+    retry = client.post("/api/llm/report", headers=headers).json()
+    assert retry["job_id"] != failed["job_id"]
+    _wait(client, retry["job_id"])
+    assert report_jobs.stats()["submitted"] >= 3
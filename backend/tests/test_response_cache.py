@@ -0,0 +1,43 @@
+"""读接口响应缓存：代号失效、ETag 与多进程关闭"""
+
+from app.config import settings
+from app.services.response_cache import ResponseCache, response_cache
+
+
+def test_stats_cache_invalidated_by_writes(client):
+    client.post("/api/traffic/simulate?scenario=normal&count=30&vehicle_id=car1")
+    first = client.get("/api/traffic/stats")
+    hits = response_cache.hits
+    second = client.get("/api/traffic/stats")
+    assert response_cache.hits == hits + 1
+    assert second.json() == first.json()
+    etag = second.headers["etag"]
+    assert client.get("/api/traffic/stats", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/api/traffic/simulate?scenario=normal&count=30&vehicle_id=car1")
+    third = client.get("/api/traffic/stats", headers={"If-None-Match": etag})
+    assert third.status_code == 200
+    assert third.json()["total_packets"] > first.json()["total_packets"]
+    assert third.headers["etag"] != etag
+
+
+def test_events_cache_invalidated_by_clear(client):
+    client.post("/api/traffic/simulate?scenario=dos&count=200&vehicle_id=car1")
+    client.post("/api/anomaly/detect?max_chunks=100")
+    before = client.get("/api/anomaly/events").json()["total"]
+    assert before > 1
+    after = client.delete("/api/system/clear-anomalies?keep_recent=1").json()
+    assert after["deleted"] > 0
+    assert client.get("/api/anomaly/events").json()["total"] == after["remaining"] < before
+
+
+def test_disabled_with_multiple_api_workers(monkeypatch):
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    assert ResponseCache().enabled == settings.cache.enabled
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    cache = ResponseCache()
+    assert not cache.enabled
+    assert cache.stats()["api_workers"] == 4
+    monkeypatch.delenv("WEB_CONCURRENCY")
+    monkeypatch.setattr(settings.cache, "api_workers", 2)
+    assert not ResponseCache().enabled
@@ -0,0 +1,46 @@
+"""CAN ID 转移概率序列检测"""
+
+from app.models.packet import UnifiedPacket
+from app.services.anomaly_detector import CANSequenceDetector
+from app.services.packet_batch import PacketBatch
+
+CYCLE = ["0x0C0", "0x130", "0x180", "0x200"]
+
+
+def _frames(ids, start=0.0, step=0.001):
+    return PacketBatch.from_packets([
+        UnifiedPacket(timestamp=start + i * step, protocol="CAN", source="ECU",
+                      destination="BUS", msg_id=m, payload_hex="00" * 8)
+        for i, m in enumerate(ids)
+    ])
+
+
+def test_learned_cycle_is_clean():
+    detector = CANSequenceDetector()
+    detector.fit(_frames(CYCLE * 200))
+    assert detector.is_fitted
+    assert detector.check(_frames(CYCLE * 20, start=10.0)) == []
+
+
+def test_unseen_transition_is_aggregated():
+    detector = CANSequenceDetector()
+    detector.fit(_frames(CYCLE * 200))
+    # 0x200 -> 0x130 与 0x130 -> 0x0C0 训练中从未出现
+    alerts = detector.check(_frames(["0x0C0", "0x200", "0x130", "0x0C0"] * 10, start=10.0))
+    pairs = {a.description.split(": ")[1].split(" 转移")[0] for a in alerts}
+    # 同一转移只告警一次
+    assert pairs == {"0x0C0 -> 0x200", "0x200 -> 0x130", "0x130 -> 0x0C0", "0x0C0 -> 0x0C0"}
+    assert len(alerts) == len(pairs)
+    assert all(a.anomaly_type == "sequence_anomaly" and a.severity == "high" for a in alerts)
+
+
+def test_batches_are_linked():
+    detector = CANSequenceDetector()
+    detector.fit(_frames(CYCLE * 200))
+    assert detector.check(_frames(["0x0C0", "0x130"], start=10.0)) == []
+    # 上一批以 0x130 结尾，0x130 -> 0x200 是跨批次的异常转移
+    alerts = detector.check(_frames(["0x200"], start=10.01))
+    assert [a.target_node for a in alerts] == ["0x200"]
+    # 间隔超过 MAX_LINK_GAP 时不衔接
+    detector.check(_frames(["0x130"], start=20.0))
+    assert detector.check(_frames(["0x200"], start=30.0)) == []
@@ -0,0 +1,123 @@
+"""共享内存环形缓冲区与检测进程"""
+
+import os
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.services.detection_scheduler import DetectionScheduler
+from app.services.detector_worker import RingDetectorWorker
+from app.services.packet_batch import PacketBatch
+from app.services.shm_ring import ShmRing, detection_batch, encode_packets
+from app.simulators.can_simulator import generate_dos_attack, generate_normal_can
+from app.simulators.v2x_simulator import generate_normal_v2x
+
+
+@pytest.fixture
+def ring():
+    r = ShmRing(f"gg_test_{os.getpid()}", 16)
+    yield r
+    r.unlink()
+    r.close()
+
+
+def _records(n: int) -> np.ndarray:
+    return encode_packets(generate_normal_can(n, 1000.0))
+
+
+def _read_all(ring: ShmRing, cursor: int, max_records: int = 1000):
+    chunks, cursor, dropped = ring.read(cursor, max_records)
+    merged = np.concatenate(chunks) if chunks else np.zeros(0, dtype=ring.records.dtype)
+    return merged, cursor, dropped
+
+
+def test_read_wraps_around(ring):
+    records = _records(12)
+    ring.write(records[:10])
+    got, cursor, dropped = _read_all(ring, 0)
+    assert (cursor, dropped, len(got)) == (10, 0, 10)
+
+    ring.write(records)  # 跨越环尾
+    got, cursor, dropped = _read_all(ring, cursor)
+    assert (cursor, dropped) == (22, 0)
+    np.testing.assert_array_equal(got["timestamp"], records["timestamp"])
+    assert got["seq"].tolist() == list(range(11, 23))
+
+
+def test_lagging_reader_counts_dropped(ring):
+    ring.write(_records(10))
+    ring.write(_records(10))
+    got, cursor, dropped = _read_all(ring, 0)
+    assert dropped == 4
+    assert cursor == 20
+    assert got["seq"].tolist() == list(range(5, 21))
+
+
+def test_uncommitted_slot_stops_read(ring):
+    ring.write(_records(6))
+    ring.records["seq"][3] = 0  # 写入方正在改写该槽位
+    got, cursor, _ = _read_all(ring, 0)
+    assert cursor == 3
+    assert len(got) == 3
+
+    ring.records["seq"][3] = 4
+    got, cursor, _ = _read_all(ring, cursor)
+    assert cursor == 6
+    assert got["seq"].tolist() == [4, 5, 6]
+
+
+def test_read_returns_copies(ring):
+    ring.write(_records(4))
+    got, _, _ = _read_all(ring, 0)
+    ring.records["timestamp"][:] = -1.0
+    assert (got["timestamp"] > 0).all()
+
+
+def test_detection_batch_matches_packets():
+    packets = generate_normal_can(50, 1000.0) + generate_normal_v2x(10, 1000.0)
+    batch = detection_batch(encode_packets(packets))
+    expected = PacketBatch.from_packets(packets)
+    np.testing.assert_array_equal(batch.timestamps, expected.timestamps)
+    np.testing.assert_array_equal(batch.can_ids, expected.can_ids)
+    np.testing.assert_array_equal(batch.payload, expected.payload)
+    np.testing.assert_allclose(batch.entropy, expected.entropy)
+    v2x = next(p for p in batch.packets if p.protocol == "V2X")
+    assert set(v2x.payload_decoded) == {"latitude", "longitude", "speed_kmh", "heading"}
+    assert batch.packets[0].payload_hex == packets[0].payload_hex
+
+
+def test_attack_label_survives_ring():
+    packets = generate_normal_can(30, 1000.0) + generate_dos_attack(20, 1000.0)
+    batch = detection_batch(encode_packets(packets))
+    assert [bool(p.metadata.get("attack")) for p in batch.packets] == \
+        [bool(p.metadata.get("attack")) for p in packets]
+    assert sum(bool(p.metadata.get("attack")) for p in batch.packets) == 20
+
+
+def test_worker_detects_from_ring(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.ingest, "shm_name", f"gg_worker_{os.getpid()}")
+    monkeypatch.setattr(settings.ingest, "state_dir", str(tmp_path / "ring"))
+    worker = RingDetectorWorker(0, 1)
+    try:
+        worker.ring.write_packets(generate_normal_can(300, 1000.0))
+        worker.poll()
+        assert worker.processed == 300
+        worker.ring.write_packets(generate_dos_attack(200, 1010.0))
+        alerts = worker.poll()
+        assert worker.processed == 500
+        assert alerts
+
+        worker.registry.flush()
+        assert list((tmp_path / "ring").glob("*.pkl"))
+    finally:
+        worker.ring.unlink()
+        worker.ring.close()
+
+
+def test_scheduler_disabled_with_shm(monkeypatch):
+    monkeypatch.setattr(settings.ingest, "shm_enabled", True)
+    scheduler = DetectionScheduler(pool=None)
+    assert not scheduler.enabled
+    scheduler.notify_packets(10_000)
+    assert scheduler.stats()["pending_packets"] == 0
@@ -0,0 +1,68 @@
+"""SOME/IP 二进制解析与原始流量接入"""
+
+from app.services import someip
+from app.services.traffic_parser import EthernetParser, TrafficParserService
+
+
+def _request(session: int, payload: bytes = b"\x01\x02") -> bytes:
+    return someip.build_message(0x0100, 0x0001, payload, client_id=0x10, session_id=session)
+
+
+def test_parse_datagrams_splits_concatenated_messages():
+    response = someip.build_message(0x0200, 0x8001, b"", session_id=7, message_type=0x80)
+    batch = someip.parse_datagrams([_request(1) + _request(2, b"\xAA" * 40), response])
+    assert len(batch) == 3
+    assert batch.malformed == 0
+    assert batch.datagram.tolist() == [0, 0, 1]
+    assert batch.headers["session_id"].tolist() == [1, 2, 7]
+    assert batch.headers["length"].tolist() == [10, 48, 8]
+    assert bytes(batch.message(1)) == _request(2, b"\xAA" * 40)
+    assert someip.header_dict(batch.headers[2].tolist())["msg_type"] == "RESPONSE"
+
+
+def test_malformed_datagrams_are_counted():
+    truncated = _request(1, b"\x00" * 10)[:-3]
+    bad_length = bytearray(_request(2))
+    bad_length[4:8] = (3).to_bytes(4, "big")  # Length 小于 8
+    batch = someip.parse_datagrams([_request(3) + b"\x00\x01", truncated, bytes(bad_length), b""])
+    assert len(batch) == 1  # 完整的报文保留，残余字节丢弃
+    assert batch.malformed == 3
+    assert someip.parse_datagrams([]).headers.shape == (0,)
+
+
+def test_decode_falls_back_for_legacy_and_invalid_payloads():
+    msg = _request(5)
+    assert EthernetParser.decode("0x0100.0x0001", msg.hex())["session_id"] == 5
+    assert EthernetParser.decode("0x0100.0x0001", "01020304")["service_id"] == "0x0100"
+    assert EthernetParser.decode("0x0100.0x0001", "ZZ" * 20)["method_id"] == "0x0001"
+    assert someip.header_from_hex("ZZ" * 20, "0x0100.0x0001") is None
+    assert someip.header_from_hex(msg.hex(), "0x0100.0x0002") is None
+
+
+def test_parse_batch_counts_malformed_records():
+    records = [
+        {"protocol": "ETH", "payload_hex": (_request(1) + _request(2)).hex(), "timestamp": 2.0},
+        {"protocol": "ETH", "payload_hex": "not hex", "timestamp": 1.0},
+        {"protocol": "ETH", "payload_hex": _request(3).hex()[:-4]},
+        {"protocol": "CAN", "payload_hex": "00FF"},  # 缺少 msg_id
+        {"protocol": "CAN", "msg_id": "0x0C0", "payload_hex": "0G"},
+        {"protocol": "CAN", "msg_id": "0x0C0", "payload_hex": "0FA0", "timestamp": 1.5},
+        {"protocol": "LIN", "msg_id": "0x01"},
+        {"protocol": "V2X", "source": "OBU_1", "timestamp": "bad"},
+    ]
+    packets, malformed = TrafficParserService().parse_batch(records)
+    assert malformed == 6
+    assert [p.protocol for p in packets] == ["CAN", "ETH", "ETH"]
+    assert packets[0].payload_decoded["rpm"] == 1000.0
+
+
+def test_ingest_endpoint_reports_malformed(client):
+    records = [
+        {"protocol": "ETH", "payload_hex": _request(1).hex(), "source": "HU", "vehicle_id": "car1"},
+        {"protocol": "ETH", "payload_hex": "xyz", "vehicle_id": "car1"},
+        {"protocol": "CAN", "msg_id": "0x180", "payload_hex": "0011", "vehicle_id": "car1"},
+    ]
+    result = client.post("/api/traffic/ingest", json=records).json()
+    assert result == {"received": 3, "ingested": 2, "malformed": 1}
+    eth = client.get("/api/traffic/packets?protocol=ETH&vehicle_id=car1").json()
+    assert eth[0]["payload_decoded"]["client_id"] == "0x0010"
@@ -0,0 +1,67 @@
+"""SOME/IP 服务级规则检测：白名单、速率与请求/响应配对"""
+
+from app.config import settings
+from app.models.packet import UnifiedPacket
+from app.services import someip
+from app.services.anomaly_detector import SomeIpServiceDetector
+from app.simulators.eth_simulator import generate_normal_eth
+
+
+def _eth(service: int, method: int, src: str, dst: str, ts: float,
+         message_type: int = 0x00, session: int = 1) -> UnifiedPacket:
+    data = someip.build_message(service, method, b"\x00" * 4, client_id=0x10,
+                                session_id=session, message_type=message_type)
+    return UnifiedPacket(timestamp=ts, protocol="ETH", source=src, destination=dst,
+                         msg_id=someip.format_msg_id(service, method), payload_hex=data.hex().upper())
+
+
+def _types(alerts):
+    return sorted(a.anomaly_type for a in alerts)
+
+
+def test_normal_traffic_is_clean():
+    detector = SomeIpServiceDetector()
+    packets = generate_normal_eth(200, 1000.0)
+    assert detector.check(packets) == []
+
+
+def test_unknown_flow_and_training():
+    detector = SomeIpServiceDetector()
+    rogue = [_eth(0x0100, 0x0001, "TBOX", "ADAS", 1.0, message_type=0x01)]
+    alerts = detector.check(rogue)
+    assert _types(alerts) == ["someip_unknown_service"]
+    assert "TBOX -> ADAS" in alerts[0].description
+
+    detector.fit(rogue)
+    assert detector.check([_eth(0x0100, 0x0001, "TBOX", "ADAS", 2.0, message_type=0x01)]) == []
+
+
+def test_request_response_pairing(monkeypatch):
+    monkeypatch.setattr(settings.detector, "someip_response_timeout", 1.0)
+    detector = SomeIpServiceDetector()
+    batch = [
+        _eth(0x0100, 0x0001, "HU", "ADAS", 10.0, session=1),
+        _eth(0x0100, 0x0001, "ADAS", "HU", 10.1, message_type=0x80, session=1),
+        _eth(0x0100, 0x0001, "HU", "ADAS", 10.2, session=2),  # 未应答
+        _eth(0x0100, 0x0001, "ADAS", "HU", 10.3, message_type=0x80, session=9),
+    ]
+    assert _types(detector.check(batch)) == ["someip_unsolicited_response"]
+    assert len(detector.pending) == 1
+
+    later = [_eth(0x0100, 0x0002, "HU", "ADAS", 12.0, message_type=0x01)]
+    alerts = detector.check(later)
+    assert _types(alerts) == ["someip_unanswered_request"]
+    assert "1 个请求" in alerts[0].description
+    assert detector.pending == {}
+
+
+def test_rate_limit_alerts_once_per_window(monkeypatch):
+    monkeypatch.setattr(settings.detector, "someip_rate_limit", 20)
+    detector = SomeIpServiceDetector()
+    flood = [_eth(0x0400, 0x0001, "GW", "BCM", 5.0 + i * 0.001, message_type=0x01) for i in range(80)]
+    alerts = detector.check(flood[:40]) + detector.check(flood[40:])
+    assert _types(alerts) == ["someip_rate_anomaly"]
+    assert alerts[0].severity == "high"  # 首批窗口内 40 帧，为上限的 2 倍
+
+    next_window = [_eth(0x0400, 0x0001, "GW", "BCM", 6.5 + i * 0.001, message_type=0x01) for i in range(30)]
+    assert _types(detector.check(next_window)) == ["someip_rate_anomaly"]
@@ -0,0 +1,60 @@
+"""V2X 运动学合理性检测：位置跳变、速度/航向一致性与 Sybil 聚集"""
+
+from app.services.anomaly_detector import V2XPlausibilityDetector
+from app.simulators.v2x_simulator import (
+    BASE_LAT, BASE_LON, _v2x_packet, generate_normal_v2x, generate_sybil_attack, offset,
+)
+
+
+def _bsm(src, ts, east, north, speed=0.0, heading=0):
+    lat, lon = offset(BASE_LAT, BASE_LON, east, north)
+    return _v2x_packet(ts, src, "BROADCAST", "BSM", "V2V", lat, lon, speed, heading)
+
+
+def _types(alerts):
+    return sorted(a.anomaly_type for a in alerts)
+
+
+def test_normal_trajectories_are_clean():
+    detector = V2XPlausibilityDetector()
+    assert detector.check(generate_normal_v2x(300, 1000.0)) == []
+    assert detector.check(generate_normal_v2x(300, 1030.0)) == []
+
+
+def test_position_jump():
+    detector = V2XPlausibilityDetector()
+    alerts = detector.check([_bsm("OBU_A", 0.0, 0, 0), _bsm("OBU_A", 1.0, 500, 0)])
+    assert _types(alerts) == ["v2x_position_jump"]
+    assert alerts[0].severity == "high"
+
+
+def test_speed_and_heading_inconsistency():
+    detector = V2XPlausibilityDetector()
+    # 上报 72 km/h 向北，实际 1 秒只移动 1 米
+    slow = [_bsm("OBU_B", 0.0, 0, 0, 72.0, 0), _bsm("OBU_B", 1.0, 0, 1, 72.0, 0)]
+    assert _types(detector.check(slow)) == ["v2x_kinematic_inconsistency"]
+    # 速度吻合（20 m/s）但向东行驶，航向却报告正北
+    east = [_bsm("OBU_C", 0.0, 0, 100, 72.0, 0), _bsm("OBU_C", 1.0, 20, 100, 72.0, 0)]
+    alerts = detector.check(east)
+    assert _types(alerts) == ["v2x_kinematic_inconsistency"]
+    assert "航向" in alerts[0].description
+
+
+def test_sybil_cluster_reported_once():
+    detector = V2XPlausibilityDetector()
+    attack = generate_sybil_attack(60, 1000.0, pseudonyms=6)
+    alerts = detector.check(attack)
+    assert _types(alerts) == ["v2x_sybil"]
+    assert "6 个身份" in alerts[0].description
+    assert detector.check(generate_sybil_attack(0, 1001.0)) == []
+    # 同一批身份继续广播不重复告警
+    again = [p.model_copy(update={"timestamp": p.timestamp + 3.0}) for p in attack[-6:]]
+    assert "v2x_sybil" not in _types(detector.check(again))
+
+
+def test_senders_expire_from_grid():
+    detector = V2XPlausibilityDetector()
+    detector.check([_bsm("OBU_D", 0.0, 0, 0)])
+    detector.check([_bsm("OBU_E", detector.sender_ttl + 1.0, 5000, 5000)])
+    assert set(detector.senders) == {"OBU_E"}
+    assert sum(len(s) for s in detector.grid.values()) == 1
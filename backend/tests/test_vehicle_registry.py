@@ -0,0 +1,71 @@
+"""车辆维度与按车辆分片的检测器状态"""
+
+import pickle
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from app.database import SchemaMismatchError, _check_columns
+from app.models.packet import PacketResponse
+from app.services.anomaly_detector import AnomalyDetectorService
+from app.services.vehicle_registry import VehicleDetectorRegistry, shard_of
+from app.simulators.can_simulator import generate_normal_can
+
+
+def test_shard_of_is_stable():
+    assert shard_of("car1", 1) == 0
+    assert shard_of("car1", 4) == shard_of("car1", 4)
+    assert {shard_of(f"car{i}", 4) for i in range(64)} == {0, 1, 2, 3}
+
+
+def test_registry_evicts_and_restores(tmp_path):
+    registry = VehicleDetectorRegistry(1, str(tmp_path))
+    packets = generate_normal_can(200, 0.0)
+    registry.detect("car1", packets)
+    first = registry.get("car1")
+    registry.get("car2")  # 容量为 1，car1 被换出到磁盘
+    assert registry.evictions == 1
+    restored = registry.get("car1")
+    assert registry.restores == 1
+    assert restored is not first
+    assert restored.ml_detector.is_fitted
+
+
+def test_registry_discards_stale_state(tmp_path):
+    registry = VehicleDetectorRegistry(4, str(tmp_path))
+    stale = AnomalyDetectorService()
+    stale.state_version = AnomalyDetectorService.STATE_VERSION - 1
+    registry.state_dir.mkdir(parents=True, exist_ok=True)
+    with open(registry._state_path("car1"), "wb") as f:
+        pickle.dump(stale, f)
+
+    detector = registry.get("car1")
+    assert detector.state_version == AnomalyDetectorService.STATE_VERSION
+    assert registry.discarded == 1
+    assert registry.restores == 0
+
+
+def test_vehicle_stats_are_isolated(client):
+    client.post("/api/traffic/simulate?scenario=normal&count=100&vehicle_id=car1")
+    client.post("/api/traffic/simulate?scenario=normal&count=50&vehicle_id=car2")
+    total = client.get("/api/traffic/stats").json()["total_packets"]
+    car1 = client.get("/api/traffic/stats?vehicle_id=car1").json()["total_packets"]
+    car2 = client.get("/api/traffic/stats?vehicle_id=car2").json()["total_packets"]
+    assert car1 + car2 == total
+    assert car1 > car2 > 0
+    assert client.get("/api/traffic/stats?vehicle_id=none").json()["total_packets"] == 0
+
+    packets = client.get("/api/traffic/packets?vehicle_id=car2&limit=500").json()
+    assert len(packets) == car2
+    assert all(p["vehicle_id"] == "car2" for p in packets)
+    assert "created_at" not in packets[0]
+    assert "created_at" not in PacketResponse.model_fields
+
+
+def test_old_schema_is_rejected(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE packets (id INTEGER PRIMARY KEY, protocol VARCHAR(8))"))
+        with pytest.raises(SchemaMismatchError, match="packets"):
+            _check_columns(conn)
+    engine.dispose()
@@ -0,0 +1,99 @@
+"""写后队列：组提交、失败任务隔离、游标单调前进与编码缓存的提交可见性"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from app.database import async_session
+from app.models.anomaly import AnomalyEventORM
+from app.models.packet import PacketORM
+from app.services.detection_pipeline import CURSOR_NAME, get_cursor
+from app.services.packet_store import KIND_VEHICLE, packet_store
+from app.services.write_behind import write_behind
+from app.simulators.can_simulator import generate_normal_can
+
+
+def _packets(n, vehicle_id, ts=1000.0):
+    packets = generate_normal_can(n, ts)
+    for p in packets:
+        p.vehicle_id = vehicle_id
+    return packets
+
+
+async def _group_with_bad_job():
+    retried, failed = write_behind.retried_groups, write_behind.failed_jobs
+    good = await write_behind.submit(packets=_packets(20, "wb-good"))
+    bad = await write_behind.submit(alerts=[AnomalyEventORM(timestamp=None, anomaly_type="x",
+                                                            severity="low")])
+    also_good = await write_behind.submit(packets=_packets(10, "wb-good", 2000.0))
+    results = await asyncio.gather(good, bad, also_good, return_exceptions=True)
+    async with async_session() as db:
+        code = await packet_store.code_of(db, KIND_VEHICLE, "wb-good")
+        stored = len((await db.execute(
+            select(PacketORM.id).where(PacketORM.vehicle_code == code)
+        )).all())
+    return (results, write_behind.retried_groups - retried,
+            write_behind.failed_jobs - failed, stored)
+
+
+def test_failed_job_does_not_fail_its_group(client):
+    results, retried, failed, stored = client.portal.call(_group_with_bad_job)
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], Exception)
+    assert (retried, failed) == (1, 1)
+    assert stored == 30
+
+
+async def _rolled_back_codes():
+    async with async_session() as db:
+        await packet_store.encode_packets(db, _packets(3, "wb-rollback"))
+        await db.rollback()
+    async with async_session() as db:
+        await packet_store.encode_packets(db, _packets(3, "wb-closed"))
+        # 未提交即关闭会话
+    unpublished = [k for k in (("vehicle", "wb-rollback"), ("vehicle", "wb-closed"))
+                   if k in packet_store._codes]
+
+    await write_behind.write(packets=_packets(3, "wb-commit"))
+    return unpublished, packet_store._codes.get((KIND_VEHICLE, "wb-commit"))
+
+
+def test_codes_are_published_only_after_commit(client):
+    unpublished, committed = client.portal.call(_rolled_back_codes)
+    assert unpublished == []
+    assert committed is not None
+    packets = client.get("/api/traffic/packets?vehicle_id=wb-commit").json()
+    assert len(packets) == 3 and packets[0]["vehicle_id"] == "wb-commit"
+
+
+async def _cursor_after(updates):
+    async with async_session() as db:
+        await get_cursor(db)
+        await db.commit()
+    for last_id in updates:
+        await write_behind.write(cursor=(CURSOR_NAME, last_id, float(last_id)))
+    async with async_session() as db:
+        return (await get_cursor(db)).last_packet_id
+
+
+def test_cursor_never_moves_backwards(client):
+    assert client.portal.call(_cursor_after, [100, 40]) == 100
+    assert client.portal.call(_cursor_after, [150]) == 150
+    client.delete("/api/system/clear-data")
+
+
+@pytest.mark.parametrize("order", [(10, 30, 20), (30, 10, 20)])
+def test_grouped_cursor_updates_keep_the_maximum(client, order):
+    async def submit_group():
+        async with async_session() as db:
+            await get_cursor(db)
+            await db.commit()
+        futures = [await write_behind.submit(cursor=(CURSOR_NAME, i, float(i))) for i in order]
+        await asyncio.gather(*futures)
+        async with async_session() as db:
+            return (await get_cursor(db)).last_packet_id
+
+    client.delete("/api/system/clear-data")
+    assert client.portal.call(submit_group) == 30
+    client.delete("/api/system/clear-data")
@@ -5,6 +5,8 @@ const api = axios.create({ baseURL: '/api' })
 export const trafficApi = {
   getStats: () => api.get('/traffic/stats'),
   getPackets: (params) => api.get('/traffic/packets', { params }),
+  // 时间桶聚合：group_by = protocol / msg_id / source / severity
+  getAggregate: (params) => api.get('/traffic/aggregate', { params }),
   simulate: (scenario, count) =>
     api.post(`/traffic/simulate?scenario=${scenario}&count=${count}`),
 }
@@ -17,7 +19,11 @@ export const anomalyApi = {
 
 export const llmApi = {
   analyze: (eventId) => api.post(`/llm/analyze?event_id=${eventId}`),
-  report: (limit) => api.post(`/llm/report?limit=${limit || 10}`),
+  report: (limit, idempotencyKey) =>
+    api.post(`/llm/report?limit=${limit || 10}`, null, {
+      headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {},
+    }),
+  reportJob: (jobId) => api.get(`/llm/report/${jobId}`),
   chat: (message, sessionId) =>
     api.post('/llm/chat', null, { params: { message, session_id: sessionId } }),
 }
@@ -28,3 +34,37 @@ export const systemApi = {
   clearPackets: (params) => api.delete('/system/clear-packets', { params }),
   clearAnomalies: (params) => api.delete('/system/clear-anomalies', { params }),
 }
+
+// WebSocket 推送（开发服务器将 /ws 代理到后端）
+export function openSocket(path) {
+  const scheme = location.protocol === 'https:' ? 'wss' : 'ws'
+  return new WebSocket(`${scheme}://${location.host}/ws${path}`)
+}
+
+// 订阅 /ws/live 实时推送（告警、统计增量、速率），断线后自动重连；
+// 重连期间的增量已丢失，onReconnect 中应重新加载数据。返回取消订阅函数
+export function subscribeLive(onFrame, onReconnect) {
+  let ws = null
+  let closed = false
+  let dropped = false
+  let timer = null
+  const connect = () => {
+    ws = openSocket('/live')
+    ws.onopen = () => {
+      if (dropped && onReconnect) onReconnect()
+      dropped = false
+    }
+    ws.onmessage = (e) => onFrame(JSON.parse(e.data))
+    ws.onclose = () => {
+      if (closed) return
+      dropped = true
+      timer = setTimeout(connect, 3000)
+    }
+  }
+  connect()
+  return () => {
+    closed = true
+    clearTimeout(timer)
+    ws.close()
+  }
+}